@@ -2,18 +2,35 @@
 
 ## api/main.py
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Query, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
+import asyncio
+import csv
+import io
+import json
+import time
+from functools import partial
 from datetime import datetime
+from typing import List, Optional
 import os
 
 from api.models import *
 from services.data_service import DataService
 from services.session_service import SessionService
-from services.face_service import FaceService
+from services.face_service import FaceService, init_face_worker, call_face_worker
+from services.model_server import ModelServerClient
 from services.qr_service import QRService
+from services.qr_token import InvalidQRToken
+from services.inference_batcher import MicroBatcher
+from services.worker_pool import BoundedExecutor, PoolSaturated
+from services.attendance_store import compact_all_stores
+from services.session_scheduler import SessionExpiryScheduler
+from services.event_bus import event_bus
+from services.student_import import StudentImport
+from services.scan_station import JPEGFrameSplitter, ScanDeduplicator
 
 app = FastAPI(title="Face Recognition Attendance System", version="1.0.0")
 
@@ -24,6 +41,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Initialize services
@@ -32,10 +50,169 @@ session_service = SessionService()
 face_service = FaceService()
 qr_service = QRService()
 
+# CPU-bound work runs in bounded pools so it never blocks the event loop.
+# FACE_POOL=process gives TensorFlow its own worker processes, FACE_POOL=thread keeps it in-process,
+# FACE_POOL=server sends it to one model server shared by every API worker (see api/serve.py).
+FACE_POOL = os.environ.get("FACE_POOL", "process")
+face_pool = BoundedExecutor(
+    "face",
+    workers=int(os.environ.get("FACE_WORKERS", 1)),
+    max_pending=int(os.environ.get("FACE_QUEUE_DEPTH", 64)),
+    use_processes=FACE_POOL == "process",
+    initializer=init_face_worker if FACE_POOL == "process" else None
+)
+model_server = ModelServerClient() if FACE_POOL == "server" else None
+# The model (and any embedding of stored images) lives outside this process
+face_model_elsewhere = FACE_POOL in ("process", "server")
+qr_pool = BoundedExecutor(
+    "qr",
+    workers=int(os.environ.get("QR_WORKERS", 4)),
+    max_pending=int(os.environ.get("QR_QUEUE_DEPTH", 64))
+)
+
+# Live feeds only hear this process's event bus; with several API workers they poll for the others' marks
+LIVE_POLL_SECONDS = (float(os.environ.get("LIVE_POLL_SECONDS", 2))
+                     if int(os.environ.get("API_WORKERS", 1)) > 1 else None)
+
+# Scanning stations see a student in many consecutive frames; a roll number is marked once per window
+station_dedupe = ScanDeduplicator(float(os.environ.get("QR_DEDUPE_SECONDS", 60)))
+
+def face_task(method: str):
+    """Callable that runs a FaceService method where the face pool runs its work"""
+    if model_server:
+        return partial(model_server.call, method)
+    if face_pool.use_processes:
+        return partial(call_face_worker, method)
+    return getattr(face_service, method)
+
+# Concurrent face requests share one batched forward pass
+face_batcher = MicroBatcher(
+    face_task("embed_probes"),
+    max_batch_size=int(os.environ.get("FACE_BATCH_SIZE", 16)),
+    max_wait_ms=float(os.environ.get("FACE_BATCH_WAIT_MS", 25)),
+    executor=face_pool.executor,
+    name="face-embedder",
+    # One batch per face worker can be in flight
+    max_concurrent=face_pool.workers
+)
+
+# Closes sessions at their deadline in the background, so reads never pay for it
+session_scheduler = SessionExpiryScheduler(session_service)
+
+# Galleries already checked for missing embeddings by a face worker (process / server mode)
+synced_galleries = set()
+face_service.embed_missing = not face_model_elsewhere
+
+async def sync_gallery(branch_code: str, year: str):
+    if face_model_elsewhere and (branch_code, year) not in synced_galleries:
+        # Any one-time embedding of stored images happens in a worker, not in the API process
+        await face_pool.run(face_task("ensure_gallery"), branch_code, year)
+        synced_galleries.add((branch_code, year))
+
+async def embed_probe_batched(face_image_bytes: bytes):
+    """Embed a probe through the micro-batcher: (embedding or None, timings in ms).
+    
+    Timings are decode, detect and embed from the face worker, and queue for
+    the time spent waiting for a batch and a worker.
+    """
+    start = time.perf_counter()
+    async with face_pool.slot():
+        probe_embedding, timings = await face_batcher.submit(face_image_bytes)
+    timings["queue"] = round(max(0.0, (time.perf_counter() - start) * 1000 - sum(timings.values())), 2)
+    
+    if probe_embedding is None:
+        print("❌ Could not compute embedding for input image")
+    return probe_embedding, timings
+
+async def recognize_face_batched(face_image_bytes: bytes, branch_code: str, year: str):
+    """Embed the probe, then match it against the branch-year gallery.
+    
+    Returns the roll number (or None) and per-stage timings in ms (see
+    embed_probe_batched) plus match.
+    """
+    await sync_gallery(branch_code, year)
+    
+    probe_embedding, timings = await embed_probe_batched(face_image_bytes)
+    if probe_embedding is None:
+        return None, timings
+    
+    start = time.perf_counter()
+    roll_no = await run_in_threadpool(face_service.match_embedding, probe_embedding, branch_code, year)
+    timings["match"] = round((time.perf_counter() - start) * 1000, 2)
+    return roll_no, timings
+
+async def recognize_face_campus(face_image_bytes: bytes, branch_code: Optional[str] = None,
+                                year: Optional[str] = None):
+    """Embed the probe, then match it against every gallery on campus.
+    
+    branch_code and year are optional hints that narrow the search. Returns the
+    matched candidate ({"roll_no", "branch_code", "year", "distance"} or None)
+    and per-stage timings in ms.
+    """
+    for partition in face_service.campus_index.partitions():
+        await sync_gallery(*partition)
+    
+    probe_embedding, timings = await embed_probe_batched(face_image_bytes)
+    if probe_embedding is None:
+        return None, timings
+    
+    start = time.perf_counter()
+    match = await run_in_threadpool(face_service.match_embedding_campus, probe_embedding, branch_code, year)
+    timings["match"] = round((time.perf_counter() - start) * 1000, 2)
+    return match, timings
+
+async def warm_up_face_workers():
+    """Load the model in every face worker, then flag the API as ready"""
+    loop = asyncio.get_running_loop()
+    warm_up = face_task("warm_up")
+    # Thread workers share this process's FaceService and the server has one model: load it once
+    calls = face_pool.workers if face_pool.use_processes else 1
+    results = await asyncio.gather(*[
+        loop.run_in_executor(face_pool.executor, warm_up) for _ in range(calls)
+    ])
+    face_service.ready = all(results)
+
+startup_tasks = []
+
+@app.on_event("startup")
+async def warm_up_face_model():
+    # Load the model in the background so the server can answer readiness probes meanwhile
+    startup_tasks.append(asyncio.create_task(warm_up_face_workers()))
+    face_batcher.start()
+    # One expiry scheduler per deployment: under api.serve only worker 0 runs it
+    if os.environ.get("API_WORKER_INDEX", "0") == "0":
+        session_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    await face_batcher.stop()
+    await session_scheduler.stop()
+    face_pool.shutdown()
+    face_service.campus_index.shutdown()
+    qr_pool.shutdown()
+    compact_all_stores()
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request, exc: PoolSaturated):
+    print(f"⏳ {exc}")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.get("/")
 def read_root():
     return {"message": "Face Recognition Attendance System API", "status": "running"}
 
+@app.get("/api/ready")
+def readiness():
+    """Readiness probe: 200 once the face model is loaded and warmed up, 503 before"""
+    model = {"model": face_service.model_name, "detector": face_service.detector_backend, "runtime": face_service.runtime}
+    if face_service.ready:
+        return {"ready": True, **model}
+    return JSONResponse(status_code=503, content={"ready": False, **model})
+
 # Authentication endpoints
 @app.post("/api/teacher/login")
 def teacher_login(login_data: TeacherLogin):
@@ -61,7 +238,7 @@ async def register_student(
     name: str = Form(...),
     password: str = Form(...),
     branch_code: str = Form(...),
-    face_image: UploadFile = File(...)
+    face_image: List[UploadFile] = File(...)
 ):
     # Validate roll number format (BT23CSH013)
     if len(roll_no) < 8 or not roll_no.startswith('BT'):
@@ -71,34 +248,183 @@ async def register_student(
         # Extract year from roll number
         year = "20" + roll_no[2:4]
         
-        # Read face image
-        face_image_bytes = await face_image.read()
+        # Read face captures, several give a steadier template than one
+        face_images_bytes = [data for data in [await image.read() for image in face_image] if data]
+        if not face_images_bytes:
+            raise HTTPException(status_code=400, detail="Empty face image received")
         
         # Register student
-        success = data_service.register_student(roll_no, name, password, branch_code)
+        success = await run_in_threadpool(data_service.register_student, roll_no, name, password, branch_code)
         if not success:
             raise HTTPException(status_code=400, detail="Student already exists or registration failed")
         
         # Save face image
-        face_saved = face_service.save_face_image(face_image_bytes, roll_no, branch_code, year)
+        face_saved = await face_pool.run(face_task("save_face_images"), face_images_bytes, roll_no, branch_code, year)
         if not face_saved:
             raise HTTPException(status_code=400, detail="Failed to save face image")
         
         # Generate QR code
-        qr_generated = qr_service.generate_qr_code(roll_no, branch_code, year)
+        qr_generated = await qr_pool.run(qr_service.generate_qr_code, roll_no, branch_code, year)
         if not qr_generated:
             raise HTTPException(status_code=400, detail="Failed to generate QR code")
         
         return {"success": True, "message": "Student registered successfully"}
         
+    except (HTTPException, PoolSaturated):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
+@app.post("/api/students/{branch_code}/{year}/{roll_no}/faces")
+async def add_face_captures(
+    branch_code: str,
+    year: str,
+    roll_no: str,
+    face_image: List[UploadFile] = File(...),
+    replace: bool = Form(False)
+):
+    """Add face captures to a registered student's template (or replace them all)"""
+    store = data_service.get_attendance_store(branch_code, year)
+    if not await run_in_threadpool(store.has_student, roll_no):
+        raise HTTPException(status_code=404, detail=f"Student {roll_no} not found in {branch_code}/{year}")
+    
+    face_images_bytes = [data for data in [await image.read() for image in face_image] if data]
+    if not face_images_bytes:
+        raise HTTPException(status_code=400, detail="Empty face image received")
+    
+    await sync_gallery(branch_code, year)
+    face_saved = await face_pool.run(face_task("save_face_images"), face_images_bytes, roll_no, branch_code, year, replace)
+    if not face_saved:
+        raise HTTPException(status_code=400, detail="Failed to save face images")
+    return {"success": True, "roll_no": roll_no, "captures": len(face_images_bytes)}
+
+# Photos per face-pool task during bulk import, embedded with one batched forward pass
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 16))
+
+def import_line(payload: dict) -> str:
+    return json.dumps(payload, default=str) + "\n"
+
+def import_row_result(row: dict, status: str, error: str = None) -> str:
+    result = {"event": "row", "row": row["row"], "roll_no": row["roll_no"], "status": status}
+    if error:
+        result["error"] = error
+    return import_line(result)
+
+async def enrol_import_batch(plan: StudentImport, rows: list, branch_code: str, year: str):
+    """Face embeddings (face pool) and QR codes (QR pool) for one batch of import rows"""
+    items = [(row["roll_no"], plan.read_photo(row["roll_no"])) for row in rows]
+    results = await face_pool.run_queued(face_task("prepare_enrolment"), items, branch_code, year)
+    
+    enrolled = [row for row, (embedding, _, _) in zip(rows, results) if embedding is not None]
+    qr_results = await asyncio.gather(*[
+        qr_pool.run_queued(qr_service.generate_qr_code, row["roll_no"], branch_code, year) for row in enrolled
+    ])
+    qr_ok = {row["roll_no"]: ok for row, ok in zip(enrolled, qr_results)}
+    
+    outcomes = []
+    for row, (embedding, error, staged_path) in zip(rows, results):
+        if embedding is not None and not qr_ok[row["roll_no"]]:
+            embedding, error = None, "Failed to generate QR code"
+        outcomes.append((row, embedding, error, staged_path))
+    return outcomes
+
+async def run_student_import(plan: StudentImport, dry_run: bool):
+    """NDJSON progress of a bulk import: validation, one line per row as it finishes, then a summary"""
+    start = time.perf_counter()
+    rejected = plan.rejected
+    yield import_line({"event": "validated", "total": len(plan.rows), "valid": len(plan.rows) - len(rejected),
+                       "rejected": len(rejected)})
+    for row in rejected:
+        yield import_row_result(row, "rejected", row["error"])
+    
+    registered = 0
+    failed = 0
+    if not dry_run:
+        for (branch_code, year), rows in plan.groups().items():
+            # Gallery loaded before any photo is written, so new photos aren't treated as a migration
+            await sync_gallery(branch_code, year)
+            await run_in_threadpool(face_service.get_gallery, branch_code, year)
+            
+            # Batches run concurrently, at most one per face worker plus one queued
+            limit = asyncio.Semaphore(face_pool.workers + 1)
+            
+            async def enrol(batch):
+                async with limit:
+                    return await enrol_import_batch(plan, batch, branch_code, year)
+            
+            batches = [rows[i:i + IMPORT_BATCH_SIZE] for i in range(0, len(rows), IMPORT_BATCH_SIZE)]
+            enrolled = {}
+            # Photos stay under temp names until their student is registered
+            staged = {}
+            added = []
+            try:
+                for finished in asyncio.as_completed([enrol(batch) for batch in batches]):
+                    for row, embedding, error, staged_path in await finished:
+                        if staged_path:
+                            staged[row["roll_no"]] = staged_path
+                        if embedding is None:
+                            failed += 1
+                            yield import_row_result(row, "failed", error)
+                        else:
+                            enrolled[row["roll_no"]] = (row, embedding)
+                            yield import_row_result(row, "enrolled")
+                
+                # One write per file for the whole branch-year, then one gallery save
+                added = await run_in_threadpool(
+                    data_service.register_students, [row for row, _ in enrolled.values()], branch_code, year
+                )
+                await run_in_threadpool(
+                    face_service.add_embeddings, {roll_no: enrolled[roll_no][1] for roll_no in added}, branch_code, year
+                )
+            finally:
+                # Already registered students keep their stored photo
+                await run_in_threadpool(face_service.place_enrolment_photos, staged, added, branch_code, year)
+            registered += len(added)
+            
+            for roll_no in set(enrolled) - set(added):
+                failed += 1
+                yield import_row_result(enrolled[roll_no][0], "failed", "Student already registered")
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"📥 Student import: {registered} registered, {failed} failed, {len(rejected)} rejected in {elapsed_ms:.0f}ms")
+    yield import_line({"event": "done", "dry_run": dry_run, "registered": registered, "failed": failed,
+                       "rejected": len(rejected), "elapsed_ms": round(elapsed_ms, 1)})
+
+@app.post("/api/students/import")
+async def import_students(
+    roster: UploadFile = File(...),
+    photos: UploadFile = File(...),
+    branch_code: Optional[str] = Form(None),
+    dry_run: bool = Form(False)
+):
+    """Bulk registration from a roster CSV and a ZIP of <roll_no>.jpg photos, streamed as NDJSON progress"""
+    roster_bytes = await roster.read()
+    photos_bytes = await photos.read()
+    
+    branches = await run_in_threadpool(data_service.get_branches)
+    registered = lambda branch, year: {s['roll_no'] for s in data_service.get_students(branch, year)}
+    try:
+        plan = await run_in_threadpool(
+            StudentImport, roster_bytes, photos_bytes, branch_code,
+            [b['branch_code'] for b in branches], registered
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(run_student_import(plan, dry_run), media_type="application/x-ndjson")
+
 @app.get("/api/students/{branch_code}/{year}")
 def get_students(branch_code: str, year: str):
     return data_service.get_students(branch_code, year)
 
 # Session Management endpoints
+def active_session_or_400(session_id: str):
+    active_session = session_service.get_active_session_by_id(session_id)
+    if not active_session:
+        print(f"❌ Session not active: {session_id}")
+        raise HTTPException(status_code=400, detail="Session not active or expired")
+    return active_session
+
 @app.post("/api/sessions/start")
 def start_session(session_data: SessionStart):
     session_id = session_service.start_session(
@@ -109,6 +435,9 @@ def start_session(session_data: SessionStart):
     )
     
     if session_id:
+        session = session_service.get_active_session(session_data.branch_code, session_data.year)
+        if session:
+            session_scheduler.schedule(session)
         return {"success": True, "session_id": session_id}
     else:
         raise HTTPException(status_code=400, detail="Session already active for this branch-year")
@@ -123,13 +452,108 @@ def get_active_session(branch_code: str, year: str):
 
 @app.post("/api/sessions/{session_id}/close")
 def close_session(session_id: str, branch_code: str, year: str):
-    session_service.close_session(session_id, branch_code, year)
-    return {"success": True, "message": "Session closed successfully"}
+    result = session_service.close_session(session_id, branch_code, year)
+    return {"success": True, "message": "Session closed successfully", **result}
+
+@app.post("/api/sessions/{session_id}/display-key")
+def get_display_key(session_id: str, login_data: StudentLogin):
+    """Key a student's app uses to show a rotating, session-bound QR code (see qr_token.display_code)"""
+    session = active_session_or_400(session_id)
+    student = data_service.verify_student(login_data.roll_no, login_data.password)
+    if not student:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if (student['branch'], student['year']) != (str(session['branch_code']), str(session['year'])):
+        raise HTTPException(status_code=400, detail=f"Student {login_data.roll_no} is not in this session's branch-year")
+    return {
+        "roll_no": login_data.roll_no,
+        "branch_code": student['branch'],
+        "year": student['year'],
+        "session_id": session_id,
+        "display_key": qr_service.tokens.display_key(session_id, login_data.roll_no),
+        "period_seconds": qr_service.tokens.display_period
+    }
 
 @app.get("/api/sessions/{session_id}/attendance")
 def get_session_attendance(session_id: str, branch_code: str, year: str):
     return session_service.get_session_attendance(session_id, branch_code, year)
 
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def live_session_events(branch_code: str, year: str, heartbeat: float):
+    """Snapshot of the branch-year's session, then every change pushed through the event bus.
+    
+    With several API workers, marks taken by the others are picked up by
+    polling the shared attendance store every LIVE_POLL_SECONDS.
+    """
+    queue = event_bus.subscribe(branch_code, year)
+    try:
+        snapshot = await run_in_threadpool(session_service.get_live_snapshot, branch_code, year)
+        session_id = snapshot["session"]["session_id"] if snapshot["session"] else None
+        # Statuses the client has been sent, to tell which polled marks are new
+        known = {row["roll_no"]: row["status"] for row in snapshot["attendance"]}
+        yield format_sse("snapshot", snapshot)
+        
+        next_poll = time.monotonic() + LIVE_POLL_SECONDS if LIVE_POLL_SECONDS else None
+        idle_since = time.monotonic()
+        # Starlette cancels this generator when the client disconnects
+        while True:
+            timeout = heartbeat - (time.monotonic() - idle_since)
+            if next_poll is not None:
+                timeout = min(timeout, next_poll - time.monotonic())
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=max(timeout, 0.01))
+            except asyncio.TimeoutError:
+                event, data = None, None
+            
+            if next_poll is not None and time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + LIVE_POLL_SECONDS
+                if session_id:
+                    for mark in await run_in_threadpool(session_service.get_new_marks, branch_code, year,
+                                                        session_id, known):
+                        idle_since = time.monotonic()
+                        yield format_sse("mark", mark)
+            
+            if event is None:
+                if time.monotonic() - idle_since < heartbeat:
+                    continue
+                idle_since = time.monotonic()
+                # Idle: a registry lookup catches sessions started, closed or expired
+                # by another worker, otherwise just keep the connection alive
+                session = await run_in_threadpool(session_service.get_active_session, branch_code, year)
+                if (session["session_id"] if session else None) == session_id:
+                    yield ": ping\n\n"
+                    continue
+                event, data = "resync", {}
+            idle_since = time.monotonic()
+            
+            if event == "resync":
+                snapshot = await run_in_threadpool(session_service.get_live_snapshot, branch_code, year)
+                session_id = snapshot["session"]["session_id"] if snapshot["session"] else None
+                known = {row["roll_no"]: row["status"] for row in snapshot["attendance"]}
+                yield format_sse("snapshot", snapshot)
+                continue
+            
+            if event == "session_started":
+                session_id = data["session_id"]
+                known = {}
+            elif event == "session_closed" and data["session_id"] == session_id:
+                session_id = None
+            elif event == "mark" and data["session_id"] == session_id:
+                known[data["roll_no"]] = data["status"]
+            yield format_sse(event, data)
+    finally:
+        event_bus.unsubscribe(branch_code, year, queue)
+
+@app.get("/api/sessions/{branch_code}/{year}/events")
+async def session_events(branch_code: str, year: str, heartbeat: float = 15):
+    """Server-Sent Events feed: snapshot, session_started, mark and session_closed events"""
+    return StreamingResponse(
+        live_session_events(branch_code, year, max(heartbeat, 0.5)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Attendance endpoints
 @app.post("/api/attendance/mark-face")
 async def mark_attendance_face(
@@ -139,23 +563,16 @@ async def mark_attendance_face(
     try:
         print(f"📸 Face attendance request for session: {session_id}")
         
-        # Get session info
-        # Extract branch and year from session_id (format: SES_YYYYMMDD_HHMMSS_BRANCH_YEAR)
-        parts = session_id.split('_')
-        if len(parts) < 5:
-            print(f"❌ Invalid session ID format: {session_id}")
-            raise HTTPException(status_code=400, detail="Invalid session ID format")
-        
-        branch_code = parts[3]
-        year = parts[4]
-        print(f"📂 Extracted branch: {branch_code}, year: {year}")
-        
-        # Verify session is active
-        active_session = session_service.get_active_session(branch_code, year)
-        if not active_session or active_session['session_id'] != session_id:
+        # Verify session is active (registry lookup, in the threadpool since it may reload from storage)
+        active_session = await run_in_threadpool(session_service.get_active_session_by_id, session_id)
+        if not active_session:
             print(f"❌ Session not active: {session_id}")
             raise HTTPException(status_code=400, detail="Session not active or expired")
         
+        branch_code = str(active_session['branch_code'])
+        year = str(active_session['year'])
+        print(f"📂 Session branch: {branch_code}, year: {year}")
+        
         print("✅ Session verified as active")
         
         # Read face image
@@ -168,19 +585,21 @@ async def mark_attendance_face(
         
         # Recognize face
         print("🔍 Starting face recognition...")
-        recognized_roll_no = face_service.recognize_face(face_image_bytes, branch_code, year)
+        recognized_roll_no, recognition_timings = await recognize_face_batched(face_image_bytes, branch_code, year)
+        print(f"⏱️ Face recognition stages (ms): {recognition_timings}")
         
         if recognized_roll_no:
             print(f"✅ Face recognized as: {recognized_roll_no}")
             
             # Mark attendance
-            success = data_service.mark_attendance(recognized_roll_no, branch_code, year, "Present")
+            success = await run_in_threadpool(data_service.mark_attendance, recognized_roll_no, branch_code, year, "Present", session_id)
             if success:
                 print(f"✅ Attendance marked for: {recognized_roll_no}")
                 return {
                     "success": True, 
                     "roll_no": recognized_roll_no, 
-                    "message": "Attendance marked successfully via face recognition"
+                    "message": "Attendance marked successfully via face recognition",
+                    "recognition_ms": recognition_timings
                 }
             else:
                 print(f"❌ Failed to mark attendance for: {recognized_roll_no}")
@@ -189,7 +608,7 @@ async def mark_attendance_face(
             print("❌ Face not recognized or no match found")
             raise HTTPException(status_code=400, detail="Face not recognized. Please ensure good lighting and clear face visibility.")
             
-    except HTTPException:
+    except (HTTPException, PoolSaturated):
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
@@ -205,22 +624,16 @@ async def mark_attendance_qr(
     try:
         print(f"📱 QR attendance request for session: {session_id}")
         
-        # Get session info
-        parts = session_id.split('_')
-        if len(parts) < 5:
-            print(f"❌ Invalid session ID format: {session_id}")
-            raise HTTPException(status_code=400, detail="Invalid session ID format")
-        
-        branch_code = parts[3]
-        year = parts[4]
-        print(f"📂 Extracted branch: {branch_code}, year: {year}")
-        
-        # Verify session is active
-        active_session = session_service.get_active_session(branch_code, year)
-        if not active_session or active_session['session_id'] != session_id:
+        # Verify session is active (registry lookup, in the threadpool since it may reload from storage)
+        active_session = await run_in_threadpool(session_service.get_active_session_by_id, session_id)
+        if not active_session:
             print(f"❌ Session not active: {session_id}")
             raise HTTPException(status_code=400, detail="Session not active or expired")
         
+        branch_code = str(active_session['branch_code'])
+        year = str(active_session['year'])
+        print(f"📂 Session branch: {branch_code}, year: {year}")
+        
         print("✅ Session verified as active")
         
         # Read QR image
@@ -233,30 +646,28 @@ async def mark_attendance_qr(
         
         # Decode QR code
         print("🔍 Starting QR code decoding...")
-        roll_no = qr_service.decode_qr_code(qr_image_bytes)
+        code, decode_timings = await qr_pool.run(qr_service.decode_qr_code_timed, qr_image_bytes)
+        print(f"⏱️ QR decode stages (ms): {decode_timings}")
         
-        if roll_no:
+        if code:
+            # Signed token checked in memory: no roster read
+            try:
+                roll_no = qr_service.resolve_attendance_code(code, active_session)
+            except InvalidQRToken as e:
+                print(f"❌ Rejected QR code: {e}")
+                raise HTTPException(status_code=400, detail=str(e))
             print(f"📱 QR code decoded as: {roll_no}")
             
-            # Verify student exists in this branch-year
-            students = data_service.get_students(branch_code, year)
-            student_exists = any(s['roll_no'] == roll_no for s in students)
-            
-            if student_exists:
-                print(f"✅ Student {roll_no} found in database")
-                
-                # Mark attendance
-                success = data_service.mark_attendance(roll_no, branch_code, year, "Present")
-                if success:
-                    print(f"✅ Attendance marked for: {roll_no}")
-                    return {
-                        "success": True, 
-                        "roll_no": roll_no, 
-                        "message": "Attendance marked successfully via QR code"
-                    }
-                else:
-                    print(f"❌ Failed to mark attendance for: {roll_no}")
-                    raise HTTPException(status_code=400, detail="Failed to mark attendance in database")
+            # Mark attendance; the resident store rejects students outside this branch-year
+            success = await run_in_threadpool(data_service.mark_attendance, roll_no, branch_code, year, "Present", session_id)
+            if success:
+                print(f"✅ Attendance marked for: {roll_no}")
+                return {
+                    "success": True, 
+                    "roll_no": roll_no, 
+                    "message": "Attendance marked successfully via QR code",
+                    "decode_ms": decode_timings
+                }
             else:
                 print(f"❌ Student {roll_no} not found in {branch_code}/{year}")
                 raise HTTPException(status_code=400, detail=f"Student {roll_no} not found in this branch-year")
@@ -264,7 +675,7 @@ async def mark_attendance_qr(
             print("❌ QR code not decoded")
             raise HTTPException(status_code=400, detail="QR code not recognized. Please ensure clear and well-lit QR code.")
             
-    except HTTPException:
+    except (HTTPException, PoolSaturated):
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
@@ -272,34 +683,237 @@ async def mark_attendance_qr(
         print(f"❌ Unexpected error in QR recognition: {error_msg}")
         raise HTTPException(status_code=500, detail=f"QR recognition failed: {error_msg}")
 
+async def mark_station_scans(active_session, codes: List[str]):
+    """Batch-mark QR codes seen by a scanning station, after dropping repeats within the dedupe window"""
+    session_id = active_session['session_id']
+    roll_nos, rejected = [], []
+    for code in codes:
+        try:
+            # A station sees the same display code in many frames, that is not a replay
+            roll_nos.append(qr_service.resolve_attendance_code(code, active_session, single_use=False))
+        except InvalidQRToken as e:
+            rejected.append(str(e))
+    roll_nos = list(dict.fromkeys(roll_nos))
+    
+    new_roll_nos = station_dedupe.filter_new(session_id, roll_nos)
+    result = {"marked": [], "already_marked": [], "unknown": []}
+    if new_roll_nos:
+        result = await run_in_threadpool(
+            data_service.mark_attendance_many, new_roll_nos, str(active_session['branch_code']),
+            str(active_session['year']), "Present", session_id
+        )
+    result["duplicates"] = [roll_no for roll_no in roll_nos if roll_no not in new_roll_nos]
+    result["rejected"] = rejected
+    return result
+
+def merge_station_results(total, result):
+    for key, roll_nos in result.items():
+        total.setdefault(key, []).extend(roll_no for roll_no in roll_nos if roll_no not in total[key])
+
+@app.post("/api/attendance/station/{session_id}/frames")
+async def station_frames(session_id: str, frames: List[UploadFile] = File(...)):
+    """A burst of camera frames from a classroom scanning station; every QR code in every frame is marked"""
+    start = time.perf_counter()
+    active_session = await run_in_threadpool(active_session_or_400, session_id)
+    
+    frame_bytes = [data for data in [await frame.read() for frame in frames] if data]
+    if not frame_bytes:
+        raise HTTPException(status_code=400, detail="No frames received")
+    
+    # Frames decode in parallel; codes are collected in first-seen order
+    decoded = await asyncio.gather(*[qr_pool.run(qr_service.decode_qr_codes, data) for data in frame_bytes])
+    codes = list(dict.fromkeys(code for frame_codes in decoded for code in frame_codes))
+    
+    result = await mark_station_scans(active_session, codes)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"🎥 Station {session_id}: {len(frame_bytes)} frames, {len(codes)} codes, "
+          f"{len(result['marked'])} marked in {elapsed_ms:.0f}ms")
+    return {"session_id": session_id, "frames": len(frame_bytes), "codes": len(codes), **result,
+            "elapsed_ms": round(elapsed_ms, 1)}
+
+@app.post("/api/attendance/station/{session_id}/stream")
+async def station_stream(session_id: str, request: Request):
+    """A live camera feed from a scanning station, as an MJPEG (multipart/x-mixed-replace) or
+    concatenated-JPEG request body. Frames are decoded and marked while the upload is still
+    running, so the teacher's live feed fills in as students walk past; the response is a
+    summary sent when the station ends the upload or the session closes.
+    """
+    start = time.perf_counter()
+    active_session = await run_in_threadpool(active_session_or_400, session_id)
+    
+    splitter = JPEGFrameSplitter()
+    total = {"marked": [], "already_marked": [], "unknown": [], "duplicates": [], "rejected": []}
+    counts = {"frames": 0, "decoded_frames": 0, "dropped_frames": 0}
+    in_flight = set()
+    
+    async def process_frame(data: bytes):
+        try:
+            codes = await qr_pool.run(qr_service.decode_qr_codes, data)
+        except PoolSaturated:
+            counts["dropped_frames"] += 1
+            return
+        counts["decoded_frames"] += 1
+        if codes:
+            merge_station_results(total, await mark_station_scans(active_session, codes))
+    
+    async for chunk in request.stream():
+        for frame in splitter.feed(chunk):
+            counts["frames"] += 1
+            # Decoding can fall behind the camera; drop frames rather than queue stale ones
+            if len(in_flight) >= qr_pool.workers:
+                counts["dropped_frames"] += 1
+                continue
+            task = asyncio.create_task(process_frame(frame))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if not await run_in_threadpool(session_service.get_active_session_by_id, session_id):
+            print(f"🔒 Session {session_id} closed, ending station stream")
+            break
+    
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"🎥 Station stream {session_id}: {counts['frames']} frames ({counts['dropped_frames']} dropped), "
+          f"{len(total['marked'])} marked in {elapsed_ms:.0f}ms")
+    return {"session_id": session_id, **counts, **total, "elapsed_ms": round(elapsed_ms, 1)}
+
+def split_param(value: Optional[str]):
+    """Comma-separated query parameter as a list (None if absent)"""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def page_response(page, output_format: str, filename: str):
+    """A RecordPage as a JSON list, or streamed as NDJSON/CSV; the next cursor goes in X-Next-Cursor"""
+    headers = {"X-Next-Cursor": page.next_cursor} if page.next_cursor else {}
+    
+    if output_format == "json":
+        return JSONResponse(content=page.rows, headers=headers)
+    
+    def ndjson_chunks():
+        for i in range(0, len(page.rows), 500):
+            yield "".join(json.dumps(row, default=str) + "\n" for row in page.rows[i:i + 500])
+    
+    def csv_chunks():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=page.columns, extrasaction="ignore")
+        writer.writeheader()
+        for i in range(0, len(page.rows), 500):
+            writer.writerows(page.rows[i:i + 500])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    
+    if output_format == "ndjson":
+        return StreamingResponse(ndjson_chunks(), media_type="application/x-ndjson", headers=headers)
+    if output_format == "csv":
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+        return StreamingResponse(csv_chunks(), media_type="text/csv", headers=headers)
+    raise HTTPException(status_code=400, detail="format must be json, ndjson or csv")
+
+# Without any query parameters both endpoints return the full table as before.
+# roll_no and columns take comma-separated lists; cursor is the X-Next-Cursor of the previous page.
 @app.get("/api/attendance/{branch_code}/{year}")
-def get_attendance_data(branch_code: str, year: str):
-    return data_service.get_attendance_data(branch_code, year)
+def get_attendance_data(branch_code: str, year: str, roll_no: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=5000),
+                        columns: Optional[str] = None, format: str = "json"):
+    page = data_service.query_attendance(
+        branch_code, year, split_param(roll_no), date_from, date_to, cursor, limit, split_param(columns)
+    )
+    return page_response(page, format, f"attendance_{branch_code}_{year}")
 
 @app.get("/api/stats/{branch_code}/{year}")
-def get_stats_data(branch_code: str, year: str):
-    return data_service.get_stats_data(branch_code, year)
+def get_stats_data(branch_code: str, year: str, roll_no: Optional[str] = None,
+                   date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=5000),
+                   columns: Optional[str] = None, format: str = "json"):
+    page = data_service.query_stats(
+        branch_code, year, split_param(roll_no), date_from, date_to, cursor, limit, split_param(columns)
+    )
+    return page_response(page, format, f"stats_{branch_code}_{year}")
+
+@app.post("/api/stats/{branch_code}/{year}/rebuild")
+def rebuild_stats(branch_code: str, year: str):
+    return data_service.rebuild_stats(branch_code, year)
+
+# QR codes
+def students_for_qr(year: str, branch_code: Optional[str] = None):
+    """(roll_no, branch_code, year) of every student in one branch-year, or in every branch for that year"""
+    branch_codes = [branch_code] if branch_code else [b['branch_code'] for b in data_service.get_branches()]
+    return [(str(s['roll_no']), code, year) for code in branch_codes for s in data_service.get_students(code, year)]
+
+@app.post("/api/qr/generate")
+def generate_qr_codes(year: str, branch_code: Optional[str] = None, overwrite: bool = False):
+    """Render QR codes for a branch-year, or a whole year when branch_code is omitted, in parallel.
+    
+    Without overwrite, only missing codes, codes holding a bare roll number and
+    expired card tokens are rendered, so this also migrates old cards.
+    """
+    start = time.perf_counter()
+    students = students_for_qr(year, branch_code)
+    if not overwrite:
+        students = [s for s in students if qr_service.needs_new_qr_code(*s)]
+    
+    results = qr_service.generate_qr_codes(students)
+    failed = [roll_no for roll_no, ok in results.items() if not ok]
+    return {
+        "success": not failed,
+        "generated": len(results) - len(failed),
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+
+@app.get("/api/id-cards/{branch_code}/{year}")
+def get_id_cards(branch_code: str, year: str):
+    """Printable PDF of the branch-year's ID cards with their QR codes"""
+    students = data_service.get_students(branch_code, year)
+    if not students:
+        raise HTTPException(status_code=404, detail="No students registered for this branch-year")
+    
+    # Cards are never printed with a bare roll number or an expired token
+    stale = [(str(s['roll_no']), branch_code, year) for s in students
+             if qr_service.needs_new_qr_code(str(s['roll_no']), branch_code, year)]
+    qr_service.generate_qr_codes(stale)
+    
+    pdf = qr_service.build_id_cards_pdf(students, branch_code, year)
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="id_cards_{branch_code}_{year}.pdf"'}
+    )
 
 # File serving endpoints
 @app.get("/api/qr/{branch_code}/{year}/{roll_no}")
-def get_qr_code(branch_code: str, year: str, roll_no: str):
-    qr_path = qr_service.get_qr_code_path(roll_no, branch_code, year)
-    if os.path.exists(qr_path):
-        return FileResponse(qr_path)
-    else:
+def get_qr_code(branch_code: str, year: str, roll_no: str, if_none_match: Optional[str] = Header(None)):
+    image = qr_service.get_qr_code_image(roll_no, branch_code, year)
+    if image is None:
         raise HTTPException(status_code=404, detail="QR code not found")
+    
+    content, etag = image
+    # The image only changes when it is regenerated, and then so does its ETag
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if if_none_match and (if_none_match.strip() == "*" or
+                          etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="image/png", headers=headers)
 ## api/main.py - ADD THIS NEW ENDPOINT
 # Add after the existing student_login endpoint (around line 1673)
 
 @app.post("/api/student/face-login")
 async def student_face_login(
-    branch_code: str = Form(...),
-    year: str = Form(...),
-    face_image: UploadFile = File(...)
+    face_image: UploadFile = File(...),
+    branch_code: Optional[str] = Form(None),
+    year: Optional[str] = Form(None)
 ):
-    """Login student using face recognition"""
+    """Login student using face recognition.
+    
+    The face is searched across every branch-year; branch_code and year are
+    optional hints that only narrow the search.
+    """
     try:
-        print(f"📸 Face login request for {branch_code}/{year}")
+        print(f"📸 Face login request (hint: {branch_code or 'any'}/{year or 'any'})")
         
         # Read face image
         face_image_bytes = await face_image.read()
@@ -311,13 +925,17 @@ async def student_face_login(
         
         # Recognize face
         print("🔍 Starting face recognition for login...")
-        recognized_roll_no = face_service.recognize_face(face_image_bytes, branch_code, year)
+        match, recognition_timings = await recognize_face_campus(face_image_bytes, branch_code or None, year or None)
+        print(f"⏱️ Face recognition stages (ms): {recognition_timings}")
         
-        if recognized_roll_no:
-            print(f"✅ Face recognized as: {recognized_roll_no}")
+        if match:
+            recognized_roll_no = match['roll_no']
+            # The student's own branch-year, whatever the hint was
+            branch_code, year = match['branch_code'], match['year']
+            print(f"✅ Face recognized as: {recognized_roll_no} ({branch_code}/{year})")
             
             # Get student data
-            students = data_service.get_students(branch_code, year)
+            students = await run_in_threadpool(data_service.get_students, branch_code, year)
             student = next((s for s in students if s['roll_no'] == recognized_roll_no), None)
             
             if student:
@@ -338,7 +956,7 @@ async def student_face_login(
             print("❌ Face not recognized")
             raise HTTPException(status_code=401, detail="Face not recognized. Please try again with better lighting or use manual login.")
             
-    except HTTPException:
+    except (HTTPException, PoolSaturated):
         raise
     except Exception as e:
         error_msg = str(e)
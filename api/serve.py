@@ -0,0 +1,139 @@
+## api/serve.py
+
+"""Multi-worker API server: load once, then fork the workers.
+
+    python -m api.serve --workers 4 --port 8000
+
+The face model is loaded once, in a model server process the workers call
+over a unix socket (FACE_POOL=server, see services/model_server.py).
+TensorFlow's thread pools don't survive a fork, so the model is never
+loaded in the master itself. The master imports the app and loads every
+branch-year face gallery and its index, freezes the garbage collector and
+forks the workers. The workers then share those pages copy-on-write, and
+accept connections from one listening socket.
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import time
+
+def preload(face_service) -> int:
+    """Load every face gallery and build its index, returns the number of students"""
+    students = 0
+    for branch_code, year in face_service.campus_index.partitions():
+        gallery = face_service.get_gallery(branch_code, year)
+        if len(gallery):
+            gallery.get_index()
+            students += len(gallery)
+    return students
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def start_model_server() -> multiprocessing.Process:
+    from services.model_server import serve_model
+
+    # spawn: a clean interpreter, the master's imports aren't inherited
+    process = multiprocessing.get_context("spawn").Process(target=serve_model, name="face-model-server")
+    process.start()
+    return process
+
+def fork_worker(app, sock: socket.socket, index: int) -> int:
+    """Fork a uvicorn worker serving ``app`` on the shared socket, returns its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # Worker 0 runs the session expiry scheduler, see api/main.py
+    os.environ["API_WORKER_INDEX"] = str(index)
+    import uvicorn
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("API_WORKERS", 2)))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        import uvicorn
+        print("⚠️ This platform can't fork, running a single worker")
+        uvicorn.run("api.main:app", host=args.host, port=args.port)
+        return
+
+    # Set before the app is imported, it reads them at import time
+    os.environ["API_WORKERS"] = str(args.workers)
+    if os.environ.setdefault("FACE_POOL", "server") == "process":
+        # The app would create that process pool here in the master, and every forked worker would share its queues
+        print("⚠️ FACE_POOL=process can't be used with api.serve, using the face model server instead")
+        os.environ["FACE_POOL"] = "server"
+    model_server = None
+    if os.environ["FACE_POOL"] == "server":
+        os.environ.setdefault("FACE_MODEL_SERVER_KEY", secrets.token_hex(16))
+        model_server = start_model_server()
+
+    start = time.perf_counter()
+    import api.main
+    students = preload(api.main.face_service)
+    # Objects loaded so far are never collected; the workers' GC then doesn't write to (and copy) their pages
+    gc.collect()
+    gc.freeze()
+    print(f"📦 Preloaded the app and {students} students' face templates in {time.perf_counter() - start:.1f}s")
+
+    sock = bind_socket(args.host, args.port)
+    # pid -> worker index, a replacement worker takes over its predecessor's index
+    workers = {fork_worker(api.main.app, sock, index): index for index in range(args.workers)}
+    print(f"🚀 {len(workers)} API workers on {args.host}:{args.port} (FACE_POOL={os.environ['FACE_POOL']})")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Replace workers (and the model server) that die, until told to stop
+    while workers:
+        time.sleep(1)
+        for pid in list(workers):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+            index = workers.pop(pid)
+            if not stopping:
+                print(f"⚠️ API worker {pid} exited ({status}), starting another")
+                workers[fork_worker(api.main.app, sock, index)] = index
+        if model_server and not model_server.is_alive() and not stopping:
+            print(f"⚠️ Face model server exited ({model_server.exitcode}), restarting")
+            model_server = start_model_server()
+
+    if model_server:
+        model_server.terminate()
+        model_server.join(10)
+    sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+## attendance_stress.py
+
+"""Check that concurrent writers never lose attendance marks.
+
+    python attendance_stress.py
+    python attendance_stress.py --processes 4 --threads 8 --students 500 --compact-every 37
+
+Several processes (API workers) with several threads each mark every
+student into their own session of one branch-year store, in a scratch
+directory, with frequent compactions. A fresh store then has to hold every
+mark of every session, both in memory and in the compacted attendance.npz.
+Exits non-zero when marks were lost.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.attendance_store import AttendanceStore
+
+def roster(students: int):
+    return [(f"BT23CSE{n:04d}", f"Student {n}") for n in range(students)]
+
+def mark_students(branch_dir: str, worker: int, threads: int, students: int, compact_every: int):
+    """One process: its threads split the roster and mark each student into this worker's session"""
+    store = AttendanceStore(branch_dir, compact_every=compact_every)
+    session_id = f"S{worker}"
+    roll_nos = [roll_no for roll_no, _ in roster(students)]
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda roll_no: store.mark(roll_no, "2025-01-01", "Present", session_id), roll_nos))
+    store.compact()
+
+def missing_marks(branch_dir: str, processes: int, students: int):
+    """Marks absent from a fresh store, per session"""
+    store = AttendanceStore(branch_dir)
+    return {f"S{worker}": students - len(store.get_session_marks(f"S{worker}")) for worker in range(processes)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the attendance store with concurrent writers")
+    parser.add_argument("--processes", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--compact-every", type=int, default=37)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    lost = 0
+    for round_number in range(1, args.rounds + 1):
+        with tempfile.TemporaryDirectory() as branch_dir:
+            AttendanceStore(branch_dir).add_students(roster(args.students))
+
+            start = time.perf_counter()
+            context = multiprocessing.get_context("spawn")
+            workers = [context.Process(target=mark_students, args=(branch_dir, worker, args.threads, args.students,
+                                                                    args.compact_every))
+                       for worker in range(args.processes)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if any(worker.exitcode for worker in workers):
+                print(f"❌ Round {round_number}: a writer process failed")
+                sys.exit(1)
+
+            missing = missing_marks(branch_dir, args.processes, args.students)
+            # The log is empty after the writers' last compaction, so this is what attendance.npz holds
+            log_size = os.path.getsize(os.path.join(branch_dir, "attendance.log"))
+            lost += sum(missing.values())
+            status = "✅" if not any(missing.values()) else "❌"
+            print(f"{status} Round {round_number}: {args.processes}x{args.threads} writers, "
+                  f"{args.students} students, missing per session {missing}, log {log_size} bytes, "
+                  f"{time.perf_counter() - start:.1f}s")
+
+    if lost:
+        print(f"❌ {lost} marks lost")
+        sys.exit(1)
+    print("✅ No marks lost")
+
+if __name__ == "__main__":
+    main()
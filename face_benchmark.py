@@ -0,0 +1,213 @@
+## face_benchmark.py
+
+"""Compare face models on this machine and on our own enrolled faces.
+
+    python face_benchmark.py
+    python face_benchmark.py --models ArcFace SFace --detector yunet
+    python face_benchmark.py --runtime onnx --export-onnx --min-accuracy 0.95 --json results.json
+
+Each model runs in its own process, so its memory is measured alone:
+  latency     p50 / p95 ms of one probe (decode, detect, embed), as in a face-login request
+  throughput  images/s when FACE_BATCH_SIZE probes share one forward pass
+  peak RSS    resident memory after loading and running the model
+  accuracy    every capture of a student with 2+ captures is searched against all
+              students' templates, its own template built from the other captures:
+              rank-1 accuracy, true accepts at the model's distance threshold, and
+              false accepts (another student within the threshold)
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from services.face_models import DETECTOR_BACKENDS, FACE_MODELS, RUNTIMES, export_onnx, load_face_model_config
+
+def collect_captures(base_dir: str = "data", max_students: Optional[int] = None) -> Dict[str, List[str]]:
+    """Stored capture files of every enrolled student on campus"""
+    from services.face_service import face_image_files
+
+    captures = {}
+    branches_dir = os.path.join(base_dir, "branches")
+    for branch_code in sorted(os.listdir(branches_dir)) if os.path.isdir(branches_dir) else []:
+        for year in sorted(os.listdir(os.path.join(branches_dir, branch_code))):
+            faces_dir = os.path.join(branches_dir, branch_code, year, "faces")
+            for roll_no, files in sorted(face_image_files(faces_dir).items()):
+                captures[roll_no] = [os.path.join(faces_dir, face_file) for face_file in files]
+    if max_students:
+        # Students with several captures first, only they can be probed
+        ranked = sorted(captures, key=lambda roll_no: len(captures[roll_no]) < 2)
+        captures = {roll_no: captures[roll_no] for roll_no in ranked[:max_students]}
+    return captures
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def evaluate(embeddings: Dict[str, np.ndarray], threshold: float) -> Optional[Dict]:
+    """Leave-one-capture-out identification over (captures, dim) embeddings per student"""
+    embeddings = {roll_no: _normalize(vectors) for roll_no, vectors in embeddings.items() if len(vectors)}
+    roll_nos = list(embeddings)
+    if len(roll_nos) < 2:
+        return None
+    templates = _normalize(np.stack([vectors.mean(axis=0) for vectors in embeddings.values()]))
+
+    probes = rank1 = accepted = false_accepts = 0
+    for own, roll_no in enumerate(roll_nos):
+        vectors = embeddings[roll_no]
+        if len(vectors) < 2:
+            continue
+        for held_out in range(len(vectors)):
+            probe = vectors[held_out]
+            rest = np.delete(vectors, held_out, axis=0)
+            distances = 1.0 - templates @ probe
+            distances[own] = 1.0 - float(_normalize(rest.mean(axis=0, keepdims=True))[0] @ probe)
+            others = np.delete(distances, own)
+
+            probes += 1
+            best_is_own = distances[own] < others.min()
+            rank1 += best_is_own
+            accepted += best_is_own and distances[own] <= threshold
+            false_accepts += others.min() <= threshold
+
+    if not probes:
+        return None
+    return {
+        "probes": probes,
+        "rank1": round(rank1 / probes, 4),
+        "true_accept": round(accepted / probes, 4),
+        "false_accept": round(false_accepts / probes, 4),
+    }
+
+def benchmark_model(model_name: str, detector_backend: str, runtime: str, captures: Dict[str, List[str]],
+                    repeat: int, batch_size: int, export: bool) -> Dict:
+    """Benchmark one model in this (fresh) process"""
+    from services.face_service import FaceService
+
+    result = {"model": model_name, "detector": detector_backend, "runtime": runtime}
+    config = load_face_model_config(model_name, detector_backend, runtime)
+    if runtime == "onnx" and export and not os.path.exists(config.onnx_path):
+        try:
+            print(f"📦 Exporting {model_name} to {config.onnx_path}")
+            export_onnx(model_name, config.onnx_path)
+        except Exception as e:
+            print(f"⚠️ {model_name}: {e}")
+
+    service = FaceService(model_name, detector_backend, runtime)
+    start = time.perf_counter()
+    if not service.warm_up():
+        return {**result, "error": "model failed to load"}
+    result["load_s"] = round(time.perf_counter() - start, 1)
+    # Falls back to DeepFace when there is no ONNX model or runtime
+    result["runtime"] = "onnx" if service.onnx_model is not None else "deepface"
+
+    images = [open(path, "rb").read() for paths in captures.values() for path in paths]
+    if not images:
+        # No enrolled faces: time a blank camera frame, accuracy stays unknown
+        images = [_blank_jpeg()]
+
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        service.embed_probes([images[i % len(images)]])
+        latencies.append((time.perf_counter() - start) * 1000)
+    result["p50_ms"] = round(float(np.percentile(latencies, 50)), 1)
+    result["p95_ms"] = round(float(np.percentile(latencies, 95)), 1)
+
+    batch = [images[i % len(images)] for i in range(batch_size)]
+    rounds = max(1, repeat // batch_size)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        service.embed_probes(batch)
+    result["images_per_s"] = round(rounds * batch_size / (time.perf_counter() - start), 1)
+
+    embeddings = {}
+    for roll_no, paths in captures.items():
+        probes = service.embed_probes([open(path, "rb").read() for path in paths])
+        embeddings[roll_no] = np.array([embedding for embedding, _ in probes if embedding is not None])
+    result["accuracy"] = evaluate(embeddings, service.distance_threshold)
+    result["threshold"] = service.distance_threshold
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def print_results(results: List[Dict]):
+    print(f"\n{'model':<11} {'runtime':<8} {'load s':>6} {'p50 ms':>7} {'p95 ms':>7} {'img/s':>6} "
+          f"{'RSS MB':>7} {'rank-1':>7} {'TAR':>6} {'FAR':>6}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['model']:<11} {result['runtime']:<8} {result['error']}")
+            continue
+        accuracy = result["accuracy"] or {}
+        print(f"{result['model']:<11} {result['runtime']:<8} {result['load_s']:>6} {result['p50_ms']:>7} "
+              f"{result['p95_ms']:>7} {result['images_per_s']:>6} {str(result['peak_rss_mb']):>7} "
+              f"{str(accuracy.get('rank1', '-')):>7} {str(accuracy.get('true_accept', '-')):>6} "
+              f"{str(accuracy.get('false_accept', '-')):>6}")
+
+def pick_model(results: List[Dict], min_accuracy: float) -> Optional[Dict]:
+    """Fastest model whose rank-1 accuracy meets the bar"""
+    eligible = [result for result in results if "error" not in result and result["accuracy"]
+                and result["accuracy"]["rank1"] >= min_accuracy]
+    return min(eligible, key=lambda result: result["p50_ms"]) if eligible else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face models on enrolled faces")
+    parser.add_argument("--models", nargs="+", default=list(FACE_MODELS), choices=list(FACE_MODELS))
+    parser.add_argument("--detector", default=os.environ.get("FACE_DETECTOR", "opencv"), choices=DETECTOR_BACKENDS)
+    parser.add_argument("--runtime", default="deepface", choices=RUNTIMES)
+    parser.add_argument("--export-onnx", action="store_true", help="export missing ONNX models first")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--max-students", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50, help="probes timed per model")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("FACE_BATCH_SIZE", 16)))
+    parser.add_argument("--min-accuracy", type=float, default=0.95, help="rank-1 accuracy bar")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    captures = collect_captures(args.data_dir, args.max_students)
+    print(f"🧑 {len(captures)} students, {sum(len(paths) >= 2 for paths in captures.values())} with 2+ captures")
+
+    results = []
+    for model_name in args.models:
+        print(f"⏱️ Benchmarking {model_name}...")
+        # spawn: a fresh interpreter per model, so RSS and load time are the model's own
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            try:
+                results.append(executor.submit(benchmark_model, model_name, args.detector, args.runtime, captures,
+                                               args.repeat, args.batch_size, args.export_onnx).result())
+            except Exception as e:
+                results.append({"model": model_name, "runtime": args.runtime, "error": str(e)})
+
+    print_results(results)
+    best = pick_model(results, args.min_accuracy)
+    if best:
+        print(f"\n🎯 Fastest model with rank-1 >= {args.min_accuracy}: {best['model']} "
+              f"(FACE_MODEL={best['model']} FACE_RUNTIME={best['runtime']})")
+    else:
+        print(f"\n⚠️ No model reached rank-1 >= {args.min_accuracy} (or no student has 2+ captures)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+def _blank_jpeg() -> bytes:
+    import cv2
+    return cv2.imencode(".jpg", np.zeros((480, 640, 3), dtype=np.uint8))[1].tobytes()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,13 @@ from config import setup_directories
 
 def run_api():
     """Run FastAPI server"""
+    workers = int(os.environ.get("API_WORKERS", 1))
+    if workers > 1:
+        # Preloaded master forking the workers, one face model server for all of them.
+        # Live session feeds only push their own worker's marks, the others' arrive by polling (LIVE_POLL_SECONDS)
+        print(f"🚀 Starting FastAPI server on port 8000 with {workers} workers...")
+        subprocess.Popen([sys.executable, "-m", "api.serve", "--workers", str(workers), "--host", "0.0.0.0", "--port", "8000"])
+        return
     print("🚀 Starting FastAPI server on port 8000...")
     subprocess.Popen([sys.executable, "-m", "uvicorn", "api.main:app", "--host", "0.0.0.0", "--port", "8000"])
 
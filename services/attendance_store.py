@@ -0,0 +1,611 @@
+## services/attendance_store.py
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from services.file_lock import atomic_write_csv, file_lock, file_signature
+from services.stats_aggregator import STATS_COLUMNS, StatsAggregator
+
+# Status codes used in the columnar file
+STATUSES = ["Present", "Absent"]
+
+class RecordPage(NamedTuple):
+    """One page of per-student rows, the columns they carry and the cursor for the next page"""
+    columns: List[str]
+    rows: List[Dict]
+    next_cursor: Optional[str]
+
+def select_page(rows: List[Dict], available: List[str], columns: Optional[List[str]] = None,
+                roll_nos: Optional[List[str]] = None, after: Optional[str] = None,
+                limit: Optional[int] = None) -> RecordPage:
+    """Filter per-student rows by roll_no, page them and keep only the requested columns.
+
+    Paging is keyset-based: rows are ordered by roll_no and ``after`` is the
+    last roll_no of the previous page, so pages stay consistent while
+    students are added. Without ``after``/``limit`` the store's order is kept.
+    """
+    if columns:
+        wanted = set(columns) | {"roll_no"}  # the cursor key is always returned
+        selected = [c for c in available if c in wanted]
+    else:
+        selected = available
+
+    if roll_nos is not None:
+        wanted_rolls = set(roll_nos)
+        rows = [row for row in rows if row["roll_no"] in wanted_rolls]
+
+    next_cursor = None
+    if after is not None or limit is not None:
+        rows = sorted(rows, key=lambda row: row["roll_no"])
+        if after is not None:
+            rows = rows[bisect.bisect_right([row["roll_no"] for row in rows], after):]
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]["roll_no"]
+
+    if rows and len(selected) != len(rows[0]):
+        # Rows are shared with the store's caches, project into new dicts
+        rows = [{c: row.get(c) for c in selected} for row in rows]
+    return RecordPage(selected, rows, next_cursor)
+
+def _in_range(date: str, date_from: Optional[str], date_to: Optional[str]) -> bool:
+    return (date_from is None or date >= date_from) and (date_to is None or date <= date_to)
+
+
+class _PendingCommit:
+    """Events from one caller waiting for the next group commit"""
+
+    __slots__ = ("events", "done", "error")
+
+    def __init__(self, events: List[Dict]):
+        self.events = events
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class AttendanceStore:
+    """Resident attendance for one branch-year with write-through persistence.
+
+    Attendance is kept as normalized long-format records keyed by
+    (roll_no, date, session_id), so several sessions on one day don't collide
+    and a mark is an O(1) dict update plus one appended line in
+    ``attendance.log``. Compaction folds the log into ``attendance.npz``, a
+    columnar file of integer-coded roll/date/session/status arrays, and
+    re-exports the legacy wide ``attendance.csv`` and ``stats.csv``. The wide
+    view and the per-student stats served to the API are built lazily and
+    cached until the next change; stats counters are kept up to date per
+    event instead of being recomputed.
+
+    Marks arriving while a flush is in progress are group-committed: the
+    first waiting caller writes everyone's events with a single fsync. Log
+    appends and compaction hold a cross-process file lock, and every access
+    first tails the log, so several uvicorn workers can share one branch-year.
+    """
+
+    def __init__(self, branch_dir: str, compact_every: int = 500, group_commit_ms: Optional[float] = None):
+        self.branch_dir = branch_dir
+        self.attendance_path = os.path.join(branch_dir, "attendance.csv")
+        self.stats_path = os.path.join(branch_dir, "stats.csv")
+        self.columnar_path = os.path.join(branch_dir, "attendance.npz")
+        self.log_path = os.path.join(branch_dir, "attendance.log")
+        self.compact_every = compact_every
+        if group_commit_ms is None:
+            group_commit_ms = float(os.getenv("ATTENDANCE_GROUP_COMMIT_MS", "0"))
+        self.group_commit_ms = group_commit_ms
+
+        self.names: Dict[str, str] = {}
+        self.marks: Dict[Tuple[str, str, str], str] = {}
+        self.dates: List[str] = []
+        # session_id -> {roll_no: status}
+        self._by_session: Dict[str, Dict[str, str]] = {}
+        self.exists = False
+        self.stats = StatsAggregator()
+        self._wide_cache = None
+        self._stats_cache = None
+        self._events_since_compaction = 0
+        self._lock = threading.RLock()
+
+        # How far into which log file this process has read
+        self._tail_lock = threading.Lock()
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+        self._columnar_signature = None
+
+        # Group commit state
+        self._commit_cond = threading.Condition()
+        self._pending: List[_PendingCommit] = []
+        self._inflight: List[_PendingCommit] = []
+        self._flushing = False
+
+        self.load()
+
+    def load(self):
+        """Load the columnar file (or migrate the wide CSV) and replay the event log"""
+        # The file lock keeps a concurrent compaction from swapping files mid-read
+        with self._lock, file_lock(self.log_path):
+            self.names, self.marks, self.dates = {}, {}, []
+
+            self._columnar_signature = file_signature(self.columnar_path)
+            if self._columnar_signature is not None:
+                self._load_columnar()
+                self.exists = True
+            elif os.path.exists(self.attendance_path):
+                self._load_wide_csv()
+                self.exists = True
+            else:
+                self.exists = False
+
+            with self._tail_lock:
+                self._log_offset = 0
+                self._log_inode = None
+                events = self._read_tail() or []
+            self._events_since_compaction = len(events)
+
+            # Derived views come from one pass over the bulk-loaded records, log events update them incrementally
+            self._rebuild_derived()
+
+            # Marks accepted in this process but not flushed yet aren't in the files
+            unflushed = [e for c in list(self._inflight) + list(self._pending) for e in c.events]
+            for event in events + unflushed:
+                self._apply(event)
+            if self._log_inode is not None or unflushed:
+                self.exists = True
+
+            self._changed()
+
+    def _load_columnar(self):
+        data = np.load(self.columnar_path, allow_pickle=False)
+        roll_nos = data["roll_nos"].tolist()
+        dates = data["dates"].tolist()
+        sessions = data["sessions"].tolist()
+
+        self.names = dict(zip(data["student_roll_nos"].tolist(), data["student_names"].tolist()))
+        self.dates = list(dates)
+        codes = zip(data["roll_codes"].tolist(), data["date_codes"].tolist(),
+                    data["session_codes"].tolist(), data["status_codes"].tolist())
+        for r, d, s, st in codes:
+            self.marks[(roll_nos[r], dates[d], sessions[s])] = STATUSES[st]
+
+    def _load_wide_csv(self):
+        """One-time migration from the legacy one-column-per-date layout"""
+        df = pd.read_csv(self.attendance_path, dtype=str)
+        self.dates = [c for c in df.columns if c not in ("roll_no", "name")]
+        for row in df.to_dict('records'):
+            roll_no = row["roll_no"]
+            self.names[roll_no] = row.get("name") if isinstance(row.get("name"), str) else ""
+            for date in self.dates:
+                if isinstance(row[date], str) and row[date]:
+                    # Legacy marks predate sessions, keep them under an empty session_id
+                    self.marks[(roll_no, date, "")] = row[date]
+
+    def _rebuild_derived(self):
+        self.stats.rebuild(self.marks)
+        self._by_session = {}
+        for (roll_no, _, session_id), status in self.marks.items():
+            self._by_session.setdefault(session_id, {})[roll_no] = status
+
+    def _read_tail(self) -> Optional[List[Dict]]:
+        """Parse complete log lines past the last read position (caller holds _lock, then _tail_lock).
+
+        The caller applies the events before releasing _lock: a compaction
+        (which holds _lock) must never see the offset moved past events that
+        aren't in memory yet, or it would fold a log missing them.
+
+        Returns None when the log was replaced by another process's
+        compaction, in which case the store has to be reloaded.
+        """
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return None if self._log_inode is not None else []
+
+        with f:
+            st = os.fstat(f.fileno())
+            if self._log_inode is not None and (st.st_ino != self._log_inode or st.st_size < self._log_offset):
+                return None
+            self._log_inode = st.st_ino
+            f.seek(self._log_offset)
+            data = f.read()
+
+        # A line without its newline is still being written by another process
+        end = data.rfind(b"\n") + 1
+        self._log_offset += end
+
+        events = []
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # Torn line from a crash mid-write
+                print(f"⚠️ Skipping corrupt attendance log line in {self.log_path}")
+        return events
+
+    def _sync(self):
+        """Catch up with events other processes appended, reloading after their compactions"""
+        with self._lock:
+            if file_signature(self.columnar_path) != self._columnar_signature:
+                self.load()
+                return
+
+            with self._tail_lock:
+                events = self._read_tail()
+            if events is None:
+                self.load()
+            elif events:
+                for event in events:
+                    self._apply(event)
+                self._events_since_compaction += len(events)
+                self.exists = True
+                self._changed()
+
+    def _apply(self, event: Dict):
+        op = event.get("op")
+        roll_no = event["roll_no"]
+        if op == "student":
+            self.names[roll_no] = event.get("name", "")
+        elif op == "mark":
+            date = event["date"]
+            if date not in self.dates:
+                self.dates.append(date)
+            key = (roll_no, date, event.get("session_id", ""))
+            old_status = self.marks.get(key)
+            self.marks[key] = event["status"]
+            self._by_session.setdefault(key[2], {})[roll_no] = event["status"]
+            self.stats.apply(roll_no, date, old_status, event["status"])
+
+    def _changed(self):
+        self._wide_cache = None
+        self._stats_cache = None
+
+    def _enqueue(self, events: List[Dict]) -> _PendingCommit:
+        """Queue events for the next group commit (caller holds _lock, so queue order matches memory)"""
+        commit = _PendingCommit(events)
+        with self._commit_cond:
+            self._pending.append(commit)
+        return commit
+
+    def _commit(self, commit: _PendingCommit):
+        """Wait until a queued commit is durable, sharing one flush with concurrent callers"""
+        with self._commit_cond:
+            while not commit.done:
+                if self._flushing:
+                    self._commit_cond.wait()
+                    continue
+
+                # This caller leads the next flush for everything queued so far
+                self._flushing = True
+                if self.group_commit_ms > 0:
+                    self._commit_cond.wait(self.group_commit_ms / 1000)
+                batch, self._pending = self._pending, []
+                self._inflight = batch
+
+                self._commit_cond.release()
+                error = None
+                try:
+                    self._write_events([event for c in batch for event in c.events])
+                except BaseException as e:
+                    error = e
+                finally:
+                    self._commit_cond.acquire()
+
+                for c in batch:
+                    c.done = True
+                    c.error = error
+                self._inflight = []
+                self._flushing = False
+                self._commit_cond.notify_all()
+
+        if commit.error is not None:
+            raise commit.error
+
+        if self._events_since_compaction >= self.compact_every:
+            self.compact()
+
+    def _write_events(self, events: List[Dict]):
+        """Append events to the log with one write and one fsync"""
+        payload = "".join(json.dumps(event) + "\n" for event in events).encode()
+        # _lock first (same order as compact): other processes' events are applied before it is released
+        with self._lock, file_lock(self.log_path):
+            f = open(self.log_path, "ab")
+            try:
+                with self._tail_lock:
+                    # Pick up other processes' events first so the offset stays contiguous
+                    foreign = self._read_tail()
+                    f.write(payload)
+                    f.flush()
+                    if foreign is not None:
+                        self._log_offset = f.tell()
+                        self._log_inode = os.fstat(f.fileno()).st_ino
+
+                if foreign is None:
+                    # Another process compacted under us, its files already hold everything else
+                    self.load()
+                else:
+                    for event in foreign:
+                        self._apply(event)
+                    if foreign:
+                        self._changed()
+                    self._events_since_compaction += len(foreign) + len(events)
+            except BaseException:
+                f.close()
+                raise
+
+        # Readers already see the appended lines; only durability waits on the disk, outside the locks
+        with f:
+            os.fsync(f.fileno())
+
+    def has_student(self, roll_no: str) -> bool:
+        self._sync()
+        return roll_no in self.names
+
+    def add_student(self, roll_no: str, name: str) -> bool:
+        """Add a student row, returns False if already present"""
+        self._sync()
+        with self._lock:
+            if roll_no in self.names:
+                return False
+            event = {"op": "student", "roll_no": roll_no, "name": name}
+            self._apply(event)
+            self.exists = True
+            self._changed()
+            commit = self._enqueue([event])
+        self._commit(commit)
+        return True
+
+    def add_students(self, students: List[Tuple[str, str]]) -> int:
+        """Add many (roll_no, name) rows with a single commit, returns how many were new"""
+        self._sync()
+        with self._lock:
+            events = []
+            for roll_no, name in students:
+                if roll_no in self.names:
+                    continue
+                event = {"op": "student", "roll_no": roll_no, "name": name}
+                self._apply(event)
+                events.append(event)
+            if not events:
+                return 0
+            self.exists = True
+            self._changed()
+            commit = self._enqueue(events)
+        self._commit(commit)
+        return len(events)
+
+    def get_status(self, roll_no: str, date: str, session_id: Optional[str] = None) -> Optional[str]:
+        """Recorded status of a student for a session, or for a whole date when session_id is None"""
+        self._sync()
+        if session_id is not None:
+            return self.marks.get((roll_no, date, session_id))
+
+        with self._lock:
+            statuses = [status for (r, d, _), status in self.marks.items() if r == roll_no and d == date]
+        if not statuses:
+            return None
+        return "Present" if "Present" in statuses else statuses[-1]
+
+    def mark(self, roll_no: str, date: str, status: str, session_id: str = "") -> bool:
+        """Record a student's status for a date/session, returns False for unknown students"""
+        self._sync()
+        with self._lock:
+            if roll_no not in self.names:
+                return False
+            event = {"op": "mark", "roll_no": roll_no, "date": date, "session_id": session_id,
+                     "status": status, "ts": datetime.now().isoformat()}
+            self._apply(event)
+            self._changed()
+            commit = self._enqueue([event])
+        self._commit(commit)
+        return True
+
+    def mark_many(self, roll_nos: List[str], date: str, status: str, session_id: str = "") -> int:
+        """Record one status for many students with a single commit, returns how many were marked"""
+        self._sync()
+        with self._lock:
+            ts = datetime.now().isoformat()
+            events = [{"op": "mark", "roll_no": roll_no, "date": date, "session_id": session_id,
+                       "status": status, "ts": ts} for roll_no in roll_nos if roll_no in self.names]
+            if not events:
+                return 0
+            for event in events:
+                self._apply(event)
+            self._changed()
+            commit = self._enqueue(events)
+        self._commit(commit)
+        return len(events)
+
+    def unmarked_students(self, session_id: str, date: Optional[str] = None) -> List[str]:
+        """Roster students with no record in the given session.
+
+        With ``date``, a legacy mark on that date (migrated from the wide CSV,
+        under the empty session_id) also counts as a record of the session.
+        """
+        self._sync()
+        with self._lock:
+            roster = np.array(list(self.names), dtype=str)
+            marked = list(self._by_session.get(session_id, {}))
+            if date is not None:
+                marked += [roll_no for roll_no in self._by_session.get("", {}) if (roll_no, date, "") in self.marks]
+            marked = np.array(marked, dtype=str)
+        if not len(roster):
+            return []
+        return roster[~np.isin(roster, marked)].tolist()
+
+    def get_session_marks(self, session_id: str) -> Dict[str, str]:
+        """roll_no -> status for one session"""
+        self._sync()
+        with self._lock:
+            return dict(self._by_session.get(session_id, {}))
+
+    def to_long_records(self) -> List[Dict]:
+        """Normalized (roll_no, date, session_id, status) records"""
+        self._sync()
+        with self._lock:
+            return [{"roll_no": r, "date": d, "session_id": s, "status": status}
+                    for (r, d, s), status in self.marks.items()]
+
+    def to_records(self) -> List[Dict]:
+        """Legacy wide view: one dict per student with a column per date.
+
+        A student counts as present on a date if any session that day marked
+        them present. Dates a student was never marked on read as "Absent",
+        the same default the wide CSV used when a new date column was added.
+        """
+        self._sync()
+        with self._lock:
+            if self._wide_cache is not None:
+                return self._wide_cache
+
+            per_student = {roll_no: {} for roll_no in self.names}
+            for (roll_no, date, _), status in self.marks.items():
+                day = per_student.setdefault(roll_no, {})
+                if day.get(date) != "Present":
+                    day[date] = status
+
+            rows = []
+            for roll_no, day in per_student.items():
+                row = {"roll_no": roll_no, "name": self.names.get(roll_no, "")}
+                for date in self.dates:
+                    row[date] = day.get(date, "Absent")
+                rows.append(row)
+
+            self._wide_cache = rows
+            return rows
+
+    def stats_records(self) -> List[Dict]:
+        """Per-student present/absent counts in the stats.csv layout"""
+        self._sync()
+        with self._lock:
+            if self._stats_cache is None:
+                self._stats_cache = self.stats.to_records(self.names, self.marks)
+            return self._stats_cache
+
+    def attendance_page(self, roll_nos: Optional[List[str]] = None, date_from: Optional[str] = None,
+                        date_to: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                        columns: Optional[List[str]] = None) -> RecordPage:
+        """Slice of the wide view; the date range selects which date columns are returned"""
+        self._sync()
+        with self._lock:
+            rows = self.to_records()
+            dates = [d for d in self.dates if _in_range(d, date_from, date_to)]
+        return select_page(rows, ["roll_no", "name"] + dates, columns, roll_nos, after, limit)
+
+    def stats_page(self, roll_nos: Optional[List[str]] = None, date_from: Optional[str] = None,
+                   date_to: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                   columns: Optional[List[str]] = None) -> RecordPage:
+        """Slice of the per-student stats; with a date range they are counted over that window only"""
+        if date_from is None and date_to is None:
+            rows = self.stats_records()
+        else:
+            self._sync()
+            with self._lock:
+                window = {key: status for key, status in self.marks.items() if _in_range(key[1], date_from, date_to)}
+                names = self.names
+                if roll_nos is not None:
+                    names = {r: self.names[r] for r in roll_nos if r in self.names}
+            stats = StatsAggregator()
+            stats.rebuild(window)
+            rows = stats.to_records(names, window)
+        return select_page(rows, STATS_COLUMNS, columns, roll_nos, after, limit)
+
+    def rebuild_stats(self):
+        """Recompute every student's counters from the raw records"""
+        self._sync()
+        with self._lock:
+            self._rebuild_derived()
+            self._changed()
+
+    def _write_columnar(self):
+        roll_nos = list(self.names)
+        roll_index = {r: i for i, r in enumerate(roll_nos)}
+        date_index = {d: i for i, d in enumerate(self.dates)}
+        sessions = sorted({s for (_, _, s) in self.marks})
+        session_index = {s: i for i, s in enumerate(sessions)}
+        status_index = {s: i for i, s in enumerate(STATUSES)}
+
+        # Marks for students missing from the roster still need a code
+        for (r, _, _) in self.marks:
+            if r not in roll_index:
+                roll_index[r] = len(roll_nos)
+                roll_nos.append(r)
+
+        keys = list(self.marks.keys())
+        fd, tmp_path = tempfile.mkstemp(dir=self.branch_dir, prefix="attendance.", suffix=".tmp.npz")
+        os.close(fd)
+        np.savez_compressed(
+            tmp_path,
+            student_roll_nos=np.array(list(self.names), dtype=str),
+            student_names=np.array([self.names[r] for r in self.names], dtype=str),
+            roll_nos=np.array(roll_nos, dtype=str),
+            dates=np.array(self.dates, dtype=str),
+            sessions=np.array(sessions, dtype=str),
+            roll_codes=np.array([roll_index[r] for r, _, _ in keys], dtype=np.int32),
+            date_codes=np.array([date_index[d] for _, d, _ in keys], dtype=np.int32),
+            session_codes=np.array([session_index[s] for _, _, s in keys], dtype=np.int32),
+            status_codes=np.array([status_index.get(self.marks[k], 1) for k in keys], dtype=np.uint8),
+        )
+        os.replace(tmp_path, self.columnar_path)
+
+    def _write_wide_csv(self):
+        df = pd.DataFrame(self.to_records(), columns=["roll_no", "name"] + self.dates)
+        atomic_write_csv(df, self.attendance_path)
+
+    def _write_stats_csv(self):
+        df = pd.DataFrame(self.stats_records(), columns=STATS_COLUMNS)
+        with file_lock(self.stats_path):
+            atomic_write_csv(df, self.stats_path)
+
+    def compact(self):
+        """Fold the event log into attendance.npz, re-export the CSVs, start a fresh log"""
+        with self._lock, file_lock(self.log_path):
+            self._sync()
+            self._write_columnar()
+            self._write_wide_csv()
+            self._write_stats_csv()
+
+            # Swap in an empty log (new inode) so other processes notice and reload
+            fd, tmp_path = tempfile.mkstemp(dir=self.branch_dir, prefix="attendance.", suffix=".log.tmp")
+            os.close(fd)
+            os.replace(tmp_path, self.log_path)
+
+            with self._tail_lock:
+                self._columnar_signature = file_signature(self.columnar_path)
+                self._log_inode = os.stat(self.log_path).st_ino
+                self._log_offset = 0
+            self._events_since_compaction = 0
+
+
+# One resident store per branch-year, shared by every service in this process
+_stores: Dict[str, AttendanceStore] = {}
+_stores_lock = threading.Lock()
+
+def get_attendance_store(base_dir: str, branch_code: str, year: str) -> AttendanceStore:
+    branch_dir = os.path.join(base_dir, "branches", branch_code, year)
+    key = os.path.abspath(branch_dir)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                from services.database import get_database, SQLiteAttendanceStore
+                db = get_database(base_dir)
+                if db is not None:
+                    store = SQLiteAttendanceStore(branch_dir, db, branch_code, year)
+                else:
+                    store = AttendanceStore(branch_dir)
+                _stores[key] = store
+    return store
+
+def compact_all_stores():
+    """Flush every loaded store back to disk (e.g. on shutdown)"""
+    for store in list(_stores.values()):
+        if store._events_since_compaction:
+            store.compact()
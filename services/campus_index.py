@@ -0,0 +1,81 @@
+## services/campus_index.py
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from services.face_gallery import FaceGallery
+
+class CampusFaceIndex:
+    """Face search across every branch-year gallery on campus.
+
+    Each ``branches/<branch>/<year>/faces`` gallery is one partition, loaded
+    through ``get_gallery`` (memory-mapped, see FaceGallery.load) and searched
+    in its own thread, since numpy's matrix products release the GIL. The
+    per-partition top-k lists are merged into one ranking. Branch/year hints
+    only narrow the search: hinted partitions are searched first, the rest
+    only when the hinted ones give no candidate within ``accept_distance``.
+    """
+
+    def __init__(self, base_dir: str, get_gallery: Callable[[str, str], FaceGallery], workers: Optional[int] = None):
+        self.branches_dir = os.path.join(base_dir, "branches")
+        self.get_gallery = get_gallery
+        workers = workers or int(os.environ.get("FACE_SEARCH_WORKERS", min(8, os.cpu_count() or 1)))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-search")
+
+    def partitions(self) -> List[Tuple[str, str]]:
+        """(branch_code, year) of every faces folder"""
+        keys = []
+        if not os.path.isdir(self.branches_dir):
+            return keys
+        for branch_code in sorted(os.listdir(self.branches_dir)):
+            branch_dir = os.path.join(self.branches_dir, branch_code)
+            if not os.path.isdir(branch_dir):
+                continue
+            for year in sorted(os.listdir(branch_dir)):
+                if os.path.isdir(os.path.join(branch_dir, year, "faces")):
+                    keys.append((branch_code, year))
+        return keys
+
+    def _search_partition(self, key: Tuple[str, str], embedding: np.ndarray, k: int) -> List[Dict]:
+        gallery = self.get_gallery(*key)
+        if not len(gallery):
+            return []
+        if gallery.dim != embedding.shape[-1]:
+            # One unusable gallery shouldn't fail the search of every other one
+            print(f"⚠️ Skipping face gallery {key[0]}/{key[1]}: {gallery.dim}-d, probe is {embedding.shape[-1]}-d")
+            return []
+        candidates = gallery.search(embedding, k)["candidates"]
+        return [{**candidate, "branch_code": key[0], "year": key[1]} for candidate in candidates]
+
+    def _search_all(self, keys: List[Tuple[str, str]], embedding: np.ndarray, k: int) -> List[Dict]:
+        if len(keys) == 1:
+            results = [self._search_partition(keys[0], embedding, k)]
+        else:
+            results = self.executor.map(lambda key: self._search_partition(key, embedding, k), keys)
+        return sorted((candidate for candidates in results for candidate in candidates), key=lambda c: c["distance"])
+
+    def search(self, embedding: np.ndarray, k: int = 5, branch_code: Optional[str] = None,
+               year: Optional[str] = None, accept_distance: Optional[float] = None) -> Dict:
+        """Top-k students: {"candidates": [{"roll_no", "branch_code", "year", "distance"}], "margin", "partitions"}"""
+        keys = self.partitions()
+        hinted = [key for key in keys if branch_code in (None, key[0]) and year in (None, key[1])]
+        # Partitions return one extra candidate so the margin is against the true runner-up
+        per_partition = max(k, 2)
+
+        candidates = self._search_all(hinted, embedding, per_partition)
+        searched = len(hinted)
+        if searched < len(keys) and (not candidates or accept_distance is None
+                                     or candidates[0]["distance"] > accept_distance):
+            rest = [key for key in keys if key not in hinted]
+            candidates = sorted(candidates + self._search_all(rest, embedding, per_partition),
+                                key=lambda c: c["distance"])
+            searched = len(keys)
+
+        if not candidates:
+            return {"candidates": [], "margin": 0.0, "partitions": searched}
+        margin = candidates[1]["distance"] - candidates[0]["distance"] if len(candidates) > 1 else float('inf')
+        return {"candidates": candidates[:k], "margin": float(margin), "partitions": searched}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -4,10 +4,17 @@ import pandas as pd
 import os
 from datetime import datetime
 from typing import List, Dict, Optional
+from services.attendance_store import RecordPage, get_attendance_store
+from services.database import get_database
+from services.event_bus import event_bus
+from services.file_lock import update_csv
+from services.stats_aggregator import STATS_COLUMNS
 
 class DataService:
     def __init__(self):
         self.base_dir = "data"
+        # SQLite database when STORAGE_BACKEND=sqlite, otherwise the CSV files are used
+        self.db = get_database(self.base_dir)
     
     def get_branches(self) -> List[Dict]:
         """Get all available branches"""
@@ -19,6 +26,11 @@ class DataService:
     
     def verify_teacher(self, teacher_id: str, password: str) -> bool:
         """Verify teacher credentials"""
+        if self.db:
+            return self.db.query_one(
+                "SELECT 1 FROM teachers WHERE teacher_id = ? AND password = ?", (teacher_id, str(password))
+            ) is not None
+        
         teachers_path = os.path.join(self.base_dir, "teachers.csv")
         if os.path.exists(teachers_path):
             df = pd.read_csv(teachers_path)
@@ -38,6 +50,17 @@ class DataService:
         except:
             return None
         
+        if self.db:
+            student = self.db.query_one(
+                "SELECT roll_no, name, face_path, qr_code_path, registered_on, password FROM students "
+                "WHERE roll_no = ? AND password = ? AND branch_code = ? AND year = ?",
+                (roll_no, str(password), branch, year)
+            )
+            if student:
+                student['branch'] = branch
+                student['year'] = year
+            return student
+        
         students_path = os.path.join(self.base_dir, "branches", branch, year, "students.csv")
         if os.path.exists(students_path):
             df = pd.read_csv(students_path)
@@ -57,146 +80,191 @@ class DataService:
         except:
             return False
         
-        students_path = os.path.join(self.base_dir, "branches", branch_code, year, "students.csv")
-        
-        # Check if student already exists
-        if os.path.exists(students_path):
-            df = pd.read_csv(students_path)
-            if roll_no in df['roll_no'].values:
-                return False
-        else:
-            df = pd.DataFrame(columns=["roll_no", "name", "face_path", "qr_code_path", "registered_on", "password"])
-        
-        # Add new student
-        face_path = f"data/branches/{branch_code}/{year}/faces/{roll_no}.jpg"
-        qr_path = f"data/branches/{branch_code}/{year}/qrcodes/{roll_no}.png"
-        
-        new_student = {
-            "roll_no": roll_no,
-            "name": name,
-            "face_path": face_path,
-            "qr_code_path": qr_path,
-            "registered_on": datetime.now().strftime("%Y-%m-%d"),
-            "password": password
-        }
+        added = self.register_students([{"roll_no": roll_no, "name": name, "password": password}], branch_code, year)
+        return bool(added)
+    
+    def register_students(self, students: List[Dict], branch_code: str, year: str) -> List[str]:
+        """Register students of one branch-year with a single write per file, returns the roll numbers added.
         
-        df = pd.concat([df, pd.DataFrame([new_student])], ignore_index=True)
-        df.to_csv(students_path, index=False)
+        ``students`` are dicts with roll_no, name and password. Students already
+        registered (or repeated in the list) are skipped.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        new_students = [{
+            "roll_no": student["roll_no"],
+            "name": student["name"],
+            "face_path": f"data/branches/{branch_code}/{year}/faces/{student['roll_no']}.jpg",
+            "qr_code_path": f"data/branches/{branch_code}/{year}/qrcodes/{student['roll_no']}.png",
+            "registered_on": today,
+            "password": student["password"]
+        } for student in students]
         
-        # Initialize in attendance.csv
-        self._add_student_to_attendance(roll_no, name, branch_code, year)
+        if self.db:
+            inserted = self.db.execute_each(
+                "INSERT OR IGNORE INTO students (roll_no, branch_code, year, name, face_path, qr_code_path, "
+                "registered_on, password) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(s["roll_no"], branch_code, year, s["name"], s["face_path"], s["qr_code_path"], today, str(s["password"]))
+                 for s in new_students]
+            )
+            added = [s for s, count in zip(new_students, inserted) if count]
+        else:
+            students_path = os.path.join(self.base_dir, "branches", branch_code, year, "students.csv")
+            added = []
+            
+            def add_students(df):
+                # Check which students already exist
+                existing = set(df['roll_no'].astype(str))
+                for student in new_students:
+                    if student["roll_no"] not in existing:
+                        existing.add(student["roll_no"])
+                        added.append(student)
+                if not added:
+                    return None
+                return pd.concat([df, pd.DataFrame(added)], ignore_index=True)
+            
+            columns = ["roll_no", "name", "face_path", "qr_code_path", "registered_on", "password"]
+            update_csv(students_path, add_students, columns)
         
-        # Initialize in stats.csv
-        self._add_student_to_stats(roll_no, name, branch_code, year)
+        if added:
+            # Initialize in attendance and stats
+            self._add_students_to_attendance(added, branch_code, year)
+            self._add_students_to_stats(added, branch_code, year)
         
-        return True
+        return [student["roll_no"] for student in added]
     
-    def _add_student_to_attendance(self, roll_no: str, name: str, branch_code: str, year: str):
-        """Add student to attendance.csv"""
-        attendance_path = os.path.join(self.base_dir, "branches", branch_code, year, "attendance.csv")
-        
-        if os.path.exists(attendance_path):
-            df = pd.read_csv(attendance_path)
-        else:
-            df = pd.DataFrame(columns=["roll_no", "name"])
-        
-        if roll_no not in df['roll_no'].values:
-            new_row = {"roll_no": roll_no, "name": name}
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            df.to_csv(attendance_path, index=False)
+    def get_attendance_store(self, branch_code: str, year: str):
+        """Resident attendance store for a branch-year"""
+        return get_attendance_store(self.base_dir, branch_code, year)
     
-    def _add_student_to_stats(self, roll_no: str, name: str, branch_code: str, year: str):
-        """Add student to stats.csv"""
-        stats_path = os.path.join(self.base_dir, "branches", branch_code, year, "stats.csv")
+    def _add_students_to_attendance(self, students: List[Dict], branch_code: str, year: str):
+        """Add students to attendance records"""
+        store = self.get_attendance_store(branch_code, year)
+        store.add_students([(student["roll_no"], student["name"]) for student in students])
+    
+    def _add_students_to_stats(self, students: List[Dict], branch_code: str, year: str):
+        """Add students to stats.csv"""
+        if self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO stats (roll_no, branch_code, year, name) VALUES (?, ?, ?, ?)",
+                [(student["roll_no"], branch_code, year, student["name"]) for student in students]
+            )
+            return
         
-        if os.path.exists(stats_path):
-            df = pd.read_csv(stats_path)
-        else:
-            df = pd.DataFrame(columns=["roll_no", "name", "present_days", "absent_days", "total_days", "attendance_pct", "last_present", "last_absent"])
+        stats_path = os.path.join(self.base_dir, "branches", branch_code, year, "stats.csv")
         
-        if roll_no not in df['roll_no'].values:
-            new_row = {
-                "roll_no": roll_no,
-                "name": name,
+        def add_rows(df):
+            existing = set(df['roll_no'].astype(str))
+            new_rows = [{
+                "roll_no": student["roll_no"],
+                "name": student["name"],
                 "present_days": 0,
                 "absent_days": 0,
                 "total_days": 0,
                 "attendance_pct": 0.0,
                 "last_present": "",
                 "last_absent": ""
-            }
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            df.to_csv(stats_path, index=False)
+            } for student in students if student["roll_no"] not in existing]
+            if not new_rows:
+                return None
+            return pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+        
+        update_csv(stats_path, add_rows, STATS_COLUMNS)
     
     def get_students(self, branch_code: str, year: str) -> List[Dict]:
         """Get all students for a branch-year"""
+        if self.db:
+            return self.db.query(
+                "SELECT roll_no, name, face_path, qr_code_path, registered_on, password FROM students "
+                "WHERE branch_code = ? AND year = ? ORDER BY rowid",
+                (branch_code, year)
+            )
+        
         students_path = os.path.join(self.base_dir, "branches", branch_code, year, "students.csv")
         if os.path.exists(students_path):
             df = pd.read_csv(students_path)
             return df.to_dict('records')
         return []
     
-    def mark_attendance(self, roll_no: str, branch_code: str, year: str, status: str = "Present") -> bool:
-        """Mark attendance for a student"""
-        attendance_path = os.path.join(self.base_dir, "branches", branch_code, year, "attendance.csv")
+    def mark_attendance(self, roll_no: str, branch_code: str, year: str, status: str = "Present",
+                        session_id: str = "") -> bool:
+        """Mark attendance for a student, optionally within a specific session"""
         today = datetime.now().strftime("%Y-%m-%d")
         
-        if os.path.exists(attendance_path):
-            df = pd.read_csv(attendance_path)
-        else:
+        # O(1) in-memory update, persisted through the store's event log.
+        # The store also keeps the stats counters current, so there is no stats.csv rewrite here.
+        store = self.get_attendance_store(branch_code, year)
+        if not store.mark(roll_no, today, status, session_id):
             return False
         
-        # Add today's column if it doesn't exist
-        if today not in df.columns:
-            df[today] = "Absent"
-        
-        # Mark attendance
-        if roll_no in df['roll_no'].values:
-            df.loc[df['roll_no'] == roll_no, today] = status
-            df.to_csv(attendance_path, index=False)
-            
-            # Update stats
-            self._update_stats(roll_no, branch_code, year, status, today)
-            return True
-        
-        return False
+        # Live dashboards update from this event instead of re-fetching the session
+        event_bus.publish(branch_code, year, "mark", {
+            "session_id": session_id, "roll_no": roll_no, "name": store.names.get(roll_no, ""),
+            "status": status, "date": today
+        })
+        return True
+
+    def mark_attendance_many(self, roll_nos: List[str], branch_code: str, year: str, status: str = "Present",
+                             session_id: str = "") -> Dict[str, List[str]]:
+        """Mark a batch of students with one commit; students already at this status in the
+        session are skipped. Returns the marked, already_marked and unknown roll numbers."""
+        today = datetime.now().strftime("%Y-%m-%d")
+        store = self.get_attendance_store(branch_code, year)
+        session_marks = store.get_session_marks(session_id) if session_id else {}
     
-    def _update_stats(self, roll_no: str, branch_code: str, year: str, status: str, date: str):
-        """Update student statistics"""
-        stats_path = os.path.join(self.base_dir, "branches", branch_code, year, "stats.csv")
-        
-        if os.path.exists(stats_path):
-            df = pd.read_csv(stats_path)
-            
-            if roll_no in df['roll_no'].values:
-                idx = df[df['roll_no'] == roll_no].index[0]
-                
-                if status == "Present":
-                    df.at[idx, 'present_days'] = df.at[idx, 'present_days'] + 1
-                    df.at[idx, 'last_present'] = date
-                else:
-                    df.at[idx, 'absent_days'] = df.at[idx, 'absent_days'] + 1
-                    df.at[idx, 'last_absent'] = date
-                
-                df.at[idx, 'total_days'] = df.at[idx, 'present_days'] + df.at[idx, 'absent_days']
-                
-                if df.at[idx, 'total_days'] > 0:
-                    df.at[idx, 'attendance_pct'] = (df.at[idx, 'present_days'] / df.at[idx, 'total_days']) * 100
-                
-                df.to_csv(stats_path, index=False)
+        result = {"marked": [], "already_marked": [], "unknown": []}
+        for roll_no in roll_nos:
+            if not store.has_student(roll_no):
+                result["unknown"].append(roll_no)
+            elif session_marks.get(roll_no) == status:
+                result["already_marked"].append(roll_no)
+            else:
+                result["marked"].append(roll_no)
+    
+        if result["marked"]:
+            store.mark_many(result["marked"], today, status, session_id)
+            for roll_no in result["marked"]:
+                event_bus.publish(branch_code, year, "mark", {
+                    "session_id": session_id, "roll_no": roll_no, "name": store.names.get(roll_no, ""),
+                    "status": status, "date": today
+                })
+        return result
     
     def get_attendance_data(self, branch_code: str, year: str) -> Dict:
         """Get attendance data for a branch-year"""
-        attendance_path = os.path.join(self.base_dir, "branches", branch_code, year, "attendance.csv")
-        if os.path.exists(attendance_path):
-            df = pd.read_csv(attendance_path)
-            return df.to_dict('records')
+        store = self.get_attendance_store(branch_code, year)
+        if store.exists:
+            return store.to_records()
         return []
     
     def get_stats_data(self, branch_code: str, year: str) -> Dict:
         """Get statistics data for a branch-year"""
-        stats_path = os.path.join(self.base_dir, "branches", branch_code, year, "stats.csv")
-        if os.path.exists(stats_path):
-            df = pd.read_csv(stats_path)
-            return df.to_dict('records')
-        return []
\ No newline at end of file
+        # Cached view over the store's running counters
+        store = self.get_attendance_store(branch_code, year)
+        if store.exists:
+            return store.stats_records()
+        return []
+    
+    def query_attendance(self, branch_code: str, year: str, roll_nos: Optional[List[str]] = None,
+                         date_from: Optional[str] = None, date_to: Optional[str] = None, cursor: Optional[str] = None,
+                         limit: Optional[int] = None, columns: Optional[List[str]] = None) -> RecordPage:
+        """Filtered page of the attendance table, see AttendanceStore.attendance_page"""
+        store = self.get_attendance_store(branch_code, year)
+        if not store.exists:
+            return RecordPage(["roll_no", "name"], [], None)
+        return store.attendance_page(roll_nos, date_from, date_to, cursor, limit, columns)
+    
+    def query_stats(self, branch_code: str, year: str, roll_nos: Optional[List[str]] = None,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None, cursor: Optional[str] = None,
+                    limit: Optional[int] = None, columns: Optional[List[str]] = None) -> RecordPage:
+        """Filtered page of the statistics, see AttendanceStore.stats_page"""
+        store = self.get_attendance_store(branch_code, year)
+        if not store.exists:
+            return RecordPage(list(STATS_COLUMNS), [], None)
+        return store.stats_page(roll_nos, date_from, date_to, cursor, limit, columns)
+    
+    def rebuild_stats(self, branch_code: str, year: str) -> List[Dict]:
+        """Recompute a branch-year's stats from raw attendance and rewrite stats.csv"""
+        store = self.get_attendance_store(branch_code, year)
+        store.rebuild_stats()
+        store.compact()
+        return store.stats_records()
\ No newline at end of file
@@ -0,0 +1,389 @@
+## services/database.py
+
+import glob
+import os
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional
+from services.attendance_store import AttendanceStore
+from services.file_lock import file_lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS teachers (
+    teacher_id TEXT PRIMARY KEY,
+    teacher_name TEXT,
+    password TEXT
+);
+
+CREATE TABLE IF NOT EXISTS students (
+    roll_no TEXT PRIMARY KEY,
+    branch_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    name TEXT,
+    face_path TEXT,
+    qr_code_path TEXT,
+    registered_on TEXT,
+    password TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_students_branch_year ON students (branch_code, year);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    teacher_id TEXT,
+    branch_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    start_time TEXT,
+    deadline_time TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_branch_year_status ON sessions (branch_code, year, status);
+CREATE INDEX IF NOT EXISTS idx_sessions_status_deadline ON sessions (status, deadline_time);
+
+CREATE TABLE IF NOT EXISTS attendance (
+    roll_no TEXT NOT NULL,
+    date TEXT NOT NULL,
+    session_id TEXT NOT NULL DEFAULT '',
+    branch_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    status TEXT NOT NULL,
+    marked_at TEXT,
+    PRIMARY KEY (roll_no, date, session_id)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_branch_year_date ON attendance (branch_code, year, date);
+CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance (session_id);
+
+CREATE TABLE IF NOT EXISTS stats (
+    roll_no TEXT PRIMARY KEY,
+    branch_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    name TEXT,
+    present_days INTEGER NOT NULL DEFAULT 0,
+    absent_days INTEGER NOT NULL DEFAULT 0,
+    total_days INTEGER NOT NULL DEFAULT 0,
+    attendance_pct REAL NOT NULL DEFAULT 0.0,
+    last_present TEXT DEFAULT '',
+    last_absent TEXT DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_stats_branch_year ON stats (branch_code, year);
+
+-- Bumped by every write to a branch-year's attendance or sessions, so other processes know to reload
+CREATE TABLE IF NOT EXISTS store_versions (
+    store TEXT NOT NULL,
+    branch_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store, branch_code, year)
+);
+"""
+
+STUDENT_COLUMNS = ["roll_no", "name", "face_path", "qr_code_path", "registered_on", "password"]
+SESSION_COLUMNS = ["session_id", "teacher_id", "branch_code", "year", "start_time", "deadline_time", "status"]
+STATS_COLUMNS = ["roll_no", "name", "present_days", "absent_days", "total_days", "attendance_pct", "last_present", "last_absent"]
+
+
+class Database:
+    """SQLite database in WAL mode with one connection per thread.
+
+    Request handlers run on threadpool workers, each of which keeps its own
+    connection, so readers never block each other or the single writer.
+    Connections belong to the process that opened them: a worker forked by
+    api.serve opens its own instead of reusing the master's.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        # Connections inherited across a fork, kept referenced so they are never closed (or used) here
+        self._inherited: List[sqlite3.Connection] = []
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            self._inherited.append(conn)
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def init_schema(self):
+        self.connection().executescript(SCHEMA)
+
+    def query(self, sql: str, params: tuple = ()) -> List[Dict]:
+        return [dict(row) for row in self.connection().execute(sql, params).fetchall()]
+
+    def query_one(self, sql: str, params: tuple = ()) -> Optional[Dict]:
+        row = self.connection().execute(sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run one write in its own transaction, returns the affected row count"""
+        conn = self.connection()
+        with conn:
+            return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql: str, rows: List[tuple]) -> int:
+        conn = self.connection()
+        with conn:
+            return conn.executemany(sql, rows).rowcount
+
+    def version(self, store: str, branch_code: str, year: str, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Change counter of a branch-year's "attendance" or "sessions", 0 before the first write"""
+        row = (conn or self.connection()).execute(
+            "SELECT version FROM store_versions WHERE store = ? AND branch_code = ? AND year = ?",
+            (store, branch_code, year)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, conn: sqlite3.Connection, store: str, branch_code: str, year: str) -> int:
+        """Bump a change counter inside conn's open transaction, returns the new value"""
+        conn.execute(
+            "INSERT INTO store_versions (store, branch_code, year, version) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (store, branch_code, year) DO UPDATE SET version = version + 1",
+            (store, branch_code, year)
+        )
+        return self.version(store, branch_code, year, conn)
+
+    def execute_each(self, sql: str, rows: List[tuple]) -> List[int]:
+        """Run sql once per row in a single transaction, returns each row's affected count"""
+        conn = self.connection()
+        with conn:
+            return [conn.execute(sql, row).rowcount for row in rows]
+
+
+# Per-student stats recomputed from the attendance table, so concurrent writers never overwrite each other
+RECOMPUTE_STATS_SQL = """
+INSERT OR REPLACE INTO stats (roll_no, branch_code, year, name, present_days, absent_days, total_days,
+                              attendance_pct, last_present, last_absent)
+SELECT ?, ?, ?, (SELECT name FROM students WHERE roll_no = ?),
+       SUM(status = 'Present'), SUM(status != 'Present'), COUNT(*),
+       CASE WHEN COUNT(*) > 0 THEN SUM(status = 'Present') * 100.0 / COUNT(*) ELSE 0.0 END,
+       COALESCE(MAX(CASE WHEN status = 'Present' THEN date END), ''),
+       COALESCE(MAX(CASE WHEN status != 'Present' THEN date END), '')
+FROM attendance WHERE roll_no = ?
+"""
+
+
+class SQLiteAttendanceStore(AttendanceStore):
+    """AttendanceStore whose marks are written straight to the attendance table.
+
+    Reads are still served from the in-memory records; the event log and
+    columnar file are replaced by one transaction per group commit, and
+    compaction only re-exports the wide attendance.csv. Every commit bumps
+    the branch-year's row in ``store_versions``; a store that sees another
+    version than its own before a read or mark reloads from the database,
+    so several uvicorn workers can share one branch-year.
+    """
+
+    def __init__(self, branch_dir: str, db: Database, branch_code: str, year: str):
+        self.db = db
+        self.branch_code = branch_code
+        self.year = year
+        super().__init__(branch_dir)
+
+    def _read_version(self) -> int:
+        return self.db.version("attendance", self.branch_code, self.year)
+
+    def load(self):
+        with self._lock:
+            # Read before the data: a commit in between only causes one more reload
+            version = self._read_version()
+            students = self.db.query(
+                "SELECT roll_no, name FROM students WHERE branch_code = ? AND year = ? ORDER BY rowid",
+                (self.branch_code, self.year)
+            )
+            marks = self.db.query(
+                "SELECT roll_no, date, session_id, status FROM attendance "
+                "WHERE branch_code = ? AND year = ? ORDER BY date, rowid",
+                (self.branch_code, self.year)
+            )
+
+            self.names = {s["roll_no"]: s["name"] or "" for s in students}
+            self.marks, self.dates = {}, []
+            for m in marks:
+                if m["date"] not in self.dates:
+                    self.dates.append(m["date"])
+                self.marks[(m["roll_no"], m["date"], m["session_id"])] = m["status"]
+
+            self._rebuild_derived()
+
+            # Marks accepted in this process but not committed yet aren't in the database
+            unflushed = [e for c in list(self._inflight) + list(self._pending) for e in c.events]
+            for event in unflushed:
+                self._apply(event)
+
+            self.exists = True
+            self._events_since_compaction = 0
+            self._version = version
+            self._changed()
+
+    def _sync(self):
+        """Reload when another process committed to this branch-year since our last load or commit"""
+        if self._read_version() != self._version:
+            self.load()
+
+    def _write_events(self, events: List[Dict]):
+        # Students are already in the students table, their events only bump the version
+        rows = [(e["roll_no"], e["date"], e.get("session_id", ""), self.branch_code, self.year, e["status"], e["ts"])
+                for e in events if e.get("op") == "mark"]
+        roll_nos = list(dict.fromkeys(row[0] for row in rows))
+
+        conn = self.db.connection()
+        with conn:
+            # The version bump comes first: it takes the write lock, so nothing commits between it and the marks
+            version = self.db.bump_version(conn, "attendance", self.branch_code, self.year)
+            conn.executemany(
+                "INSERT OR REPLACE INTO attendance (roll_no, date, session_id, branch_code, year, status, marked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(RECOMPUTE_STATS_SQL,
+                             [(roll_no, self.branch_code, self.year, roll_no, roll_no) for roll_no in roll_nos])
+
+        if version == self._version + 1:
+            # Only our own commit since the last sync, memory already holds it
+            self._version = version
+        else:
+            # Another process committed in between
+            self.load()
+
+    def rebuild_stats(self):
+        """Recompute every student's counters, in memory and in the stats table"""
+        super().rebuild_stats()
+        with self._lock:
+            roll_nos = list(self.names)
+        self.db.executemany(RECOMPUTE_STATS_SQL,
+                            [(roll_no, self.branch_code, self.year, roll_no, roll_no) for roll_no in roll_nos])
+
+    def compact(self):
+        """Marks are already durable in SQLite, only refresh the CSV exports"""
+        self._sync()
+        with self._lock:
+            if os.path.isdir(self.branch_dir):
+                self._write_wide_csv()
+                self._write_stats_csv()
+
+
+def storage_backend() -> str:
+    """'csv' (default) or 'sqlite', from the STORAGE_BACKEND env var"""
+    return os.getenv("STORAGE_BACKEND", "csv").lower()
+
+_databases: Dict[str, Database] = {}
+_databases_lock = threading.Lock()
+
+def get_database(base_dir: str) -> Optional[Database]:
+    """Shared Database for base_dir, or None when the CSV backend is selected.
+
+    The first time the database file is created it is filled from the
+    existing CSV tree.
+    """
+    if storage_backend() != "sqlite":
+        return None
+
+    path = os.getenv("SQLITE_PATH", os.path.join(base_dir, "attendance.db"))
+    key = os.path.abspath(path)
+    db = _databases.get(key)
+    if db is None:
+        with _databases_lock:
+            db = _databases.get(key)
+            if db is None:
+                # Several workers may start at once, only one of them migrates
+                with file_lock(path):
+                    is_new = not os.path.exists(path)
+                    db = Database(path)
+                    db.init_schema()
+                    if is_new:
+                        migrate_from_csv(db, base_dir)
+                _databases[key] = db
+    return db
+
+
+def _read_csv(path: str) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_csv(path, dtype=str).fillna("")
+
+def migrate_from_csv(db: Database, base_dir: str):
+    """Copy teachers and every data/branches/{BRANCH}/{YEAR} tree into SQLite.
+
+    Rows already in the database are kept (INSERT OR IGNORE), so running the
+    migrator again only picks up what is missing.
+    """
+    start = datetime.now()
+    counts = {"teachers": 0, "students": 0, "sessions": 0, "attendance": 0, "stats": 0}
+
+    teachers = _read_csv(os.path.join(base_dir, "teachers.csv"))
+    if not teachers.empty:
+        counts["teachers"] = db.executemany(
+            "INSERT OR IGNORE INTO teachers (teacher_id, teacher_name, password) VALUES (?, ?, ?)",
+            list(teachers[["teacher_id", "teacher_name", "password"]].itertuples(index=False, name=None))
+        )
+
+    for branch_dir in sorted(glob.glob(os.path.join(base_dir, "branches", "*", "*"))):
+        if not os.path.isdir(branch_dir):
+            continue
+        branch_code = os.path.basename(os.path.dirname(branch_dir))
+        year = os.path.basename(branch_dir)
+
+        students = _read_csv(os.path.join(branch_dir, "students.csv"))
+        if not students.empty:
+            students = students.reindex(columns=STUDENT_COLUMNS, fill_value="")
+            counts["students"] += db.executemany(
+                "INSERT OR IGNORE INTO students (roll_no, branch_code, year, name, face_path, qr_code_path, "
+                "registered_on, password) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(s[0], branch_code, year) + tuple(s[1:]) for s in students.itertuples(index=False, name=None)]
+            )
+
+        sessions = _read_csv(os.path.join(branch_dir, "sessions.csv"))
+        if not sessions.empty:
+            sessions = sessions.reindex(columns=SESSION_COLUMNS, fill_value="")
+            counts["sessions"] += db.executemany(
+                "INSERT OR IGNORE INTO sessions (session_id, teacher_id, branch_code, year, start_time, "
+                "deadline_time, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                list(sessions.itertuples(index=False, name=None))
+            )
+            # Running servers' session registries reload this branch-year
+            conn = db.connection()
+            with conn:
+                db.bump_version(conn, "sessions", branch_code, year)
+
+        stats = _read_csv(os.path.join(branch_dir, "stats.csv"))
+        if not stats.empty:
+            stats = stats.reindex(columns=STATS_COLUMNS, fill_value="")
+            for column in ("present_days", "absent_days", "total_days", "attendance_pct"):
+                stats[column] = pd.to_numeric(stats[column], errors="coerce").fillna(0)
+            counts["stats"] += db.executemany(
+                "INSERT OR IGNORE INTO stats (roll_no, branch_code, year, name, present_days, absent_days, "
+                "total_days, attendance_pct, last_present, last_absent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(s[0], branch_code, year, s[1], int(s[2]), int(s[3]), int(s[4]), float(s[5]), s[6], s[7])
+                 for s in stats.itertuples(index=False, name=None)]
+            )
+
+        # The file-backed store already knows how to read npz/csv + log
+        records = AttendanceStore(branch_dir).to_long_records()
+        if records:
+            counts["attendance"] += db.executemany(
+                "INSERT OR IGNORE INTO attendance (roll_no, date, session_id, branch_code, year, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(r["roll_no"], r["date"], r["session_id"], branch_code, year, r["status"]) for r in records]
+            )
+
+    elapsed = (datetime.now() - start).total_seconds()
+    summary = ", ".join(f"{count} {table}" for table, count in counts.items())
+    print(f"✅ Migrated CSV data into {db.path} in {elapsed:.1f}s ({summary})")
+
+
+if __name__ == "__main__":
+    # One-shot migration: python -m services.database [base_dir]
+    import sys
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    db = Database(os.getenv("SQLITE_PATH", os.path.join(base_dir, "attendance.db")))
+    db.init_schema()
+    migrate_from_csv(db, base_dir)
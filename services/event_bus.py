@@ -0,0 +1,70 @@
+## services/event_bus.py
+
+import asyncio
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+class EventBus:
+    """In-process fan-out of live attendance events, one topic per (branch_code, year).
+
+    Subscribers are asyncio queues owned by the API's event loop (one per
+    open event stream). ``publish`` can be called from any thread, e.g. the
+    threadpool running a mark or the scheduler's close, and costs nothing
+    when nobody is listening. A subscriber that falls more than ``max_queue``
+    events behind gets its backlog replaced by a single ``resync`` event.
+    Events published by other API worker processes are not seen here.
+    """
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self._subscribers: Dict[Tuple[str, str], Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, branch_code: str, year: str) -> asyncio.Queue:
+        """New queue receiving (event, data) tuples for a branch-year; call on the event loop"""
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault((branch_code, year), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, branch_code: str, year: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get((branch_code, year))
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[(branch_code, year)]
+
+    def subscriber_count(self, branch_code: str, year: str) -> int:
+        return len(self._subscribers.get((branch_code, year), ()))
+
+    def publish(self, branch_code: str, year: str, event: str, data: Dict):
+        """Send an event to every subscriber of the branch-year (safe to call from any thread)"""
+        key = (str(branch_code), str(year))
+        if not self._subscribers.get(key) or self._loop is None or self._loop.is_closed():
+            return
+
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(key, event, data)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, key, event, data)
+
+    def _deliver(self, key: Tuple[str, str], event: str, data: Dict):
+        with self._lock:
+            queues = list(self._subscribers.get(key, ()))
+        for queue in queues:
+            if queue.full():
+                # Too far behind to replay, the stream sends a fresh snapshot instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {}))
+            else:
+                queue.put_nowait((event, data))
+
+event_bus = EventBus()
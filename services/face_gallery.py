@@ -0,0 +1,296 @@
+## services/face_gallery.py
+
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from services.face_index import create_index, dequantize, quantize
+from services.face_models import model_slug
+from services.file_lock import file_lock, file_signature
+
+class FaceGallery:
+    """Persistent embedding gallery for one branch-year faces folder.
+
+    Each student has up to ``max_samples`` sample embeddings, one per
+    enrolment capture, and a template: the L2-normalised mean of the samples.
+    Probes are matched against the template matrix only, which is kept
+    compact in ``embeddings.npy`` (FACE_GALLERY_DTYPE): int8 with per-row
+    scales in ``embeddings_scales.npy`` by default, or float16 / float32.
+    The matrix is memory-mapped rather than read, and only copied into
+    memory when it changes.
+    Samples live in ``samples.npy`` as float16, memory-mapped since they are
+    only read when a template is recomputed. Roll numbers and sample counts
+    are in ``embeddings.json``. Searches go through a face index (see
+    services/face_index.py) rebuilt lazily on change.
+    The files are kept per model in ``faces/models/<model>/``, so switching
+    FACE_MODEL back and forth doesn't re-embed the stored images.
+    Several processes enrol into the same gallery (face workers, the API
+    process, the model server): changes go through ``updating()``, which
+    holds a file lock and reloads the gallery first.
+    """
+
+    def __init__(self, faces_dir: str, model_name: str, index_backend: Optional[str] = None,
+                 dtype: Optional[str] = None, max_samples: Optional[int] = None):
+        self.faces_dir = faces_dir
+        self.model_name = model_name
+        self.dtype = dtype or os.getenv("FACE_GALLERY_DTYPE", "int8")
+        self.max_samples = max_samples or int(os.getenv("FACE_MAX_SAMPLES", 5))
+        self.gallery_dir = os.path.join(faces_dir, "models", model_slug(model_name))
+        self.matrix_path, self.scales_path, self.samples_path, self.meta_path = _gallery_paths(self.gallery_dir)
+        self.roll_nos: List[str] = []
+        self.matrix, self.scales = quantize(np.zeros((0, 0), dtype=np.float32), self.dtype)
+        # Samples as saved (memory-mapped) plus the ones changed since
+        self._saved_samples = np.zeros((0, 0), dtype=np.float16)
+        self._sample_rows: Dict[str, Tuple[int, int]] = {}
+        self._changed_samples: Dict[str, np.ndarray] = {}
+        self.index_backend = index_backend
+        self._index = None
+        self._index_dirty = True
+        self._loaded_signature = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.roll_nos)
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.size else 0
+
+    def memory_bytes(self) -> int:
+        """Resident size of what searches touch: the template matrix and its scales"""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def load(self) -> bool:
+        """Load gallery from disk, returns False if missing or stale"""
+        signature = file_signature(self.meta_path)
+        if signature is None:
+            # Galleries saved before they were kept per model sit in the faces folder itself
+            if os.path.exists(os.path.join(self.faces_dir, "embeddings.json")) and self._load_from(self.faces_dir, None):
+                print(f"📦 Moving face gallery {self.faces_dir} to {self.gallery_dir}")
+                self.save()
+                return True
+            return False
+        return self._load_from(self.gallery_dir, signature)
+
+    def _load_from(self, gallery_dir: str, signature: Optional[tuple]) -> bool:
+        matrix_path, scales_path, samples_path, meta_path = _gallery_paths(gallery_dir)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            # Memory-mapped: processes serving the same gallery share its pages
+            matrix = np.load(matrix_path, mmap_mode="r")
+            stored_dtype = meta.get("dtype", "float32")
+            scales = np.load(scales_path) if stored_dtype == "int8" else None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load face gallery {gallery_dir}: {e}")
+            return False
+
+        # Gallery built with another model can't be compared against
+        if meta.get("model_name") != self.model_name:
+            print(f"⚠️ Face gallery {gallery_dir} was built with {meta.get('model_name')}, ignoring")
+            return False
+
+        roll_nos = meta.get("roll_nos", [])
+        if (matrix.ndim != 2 or matrix.shape[0] != len(roll_nos)
+                or (scales is not None and len(scales) != len(roll_nos))):
+            # Caught between the file writes of another process
+            return False
+
+        # Galleries saved before multi-sample enrolment hold one float32 embedding per student
+        counts = meta.get("sample_counts") or [1] * len(roll_nos)
+        samples = None
+        if "sample_counts" in meta:
+            try:
+                samples = np.load(samples_path, mmap_mode="r")
+            except (OSError, ValueError):
+                samples = None
+        if samples is None or len(samples) != sum(counts):
+            samples = dequantize(matrix, scales).astype(np.float16)
+            counts = [1] * len(roll_nos)
+
+        if stored_dtype != self.dtype:
+            matrix, scales = quantize(dequantize(matrix, scales), self.dtype)
+
+        sample_rows = {}
+        start = 0
+        for roll_no, count in zip(roll_nos, counts):
+            sample_rows[roll_no] = (start, count)
+            start += count
+
+        with self._lock:
+            self.roll_nos = roll_nos
+            self.matrix = np.ascontiguousarray(matrix)
+            self.scales = scales
+            self._saved_samples = samples
+            self._sample_rows = sample_rows
+            self._changed_samples = {}
+            self._loaded_signature = signature
+            self._index_dirty = True
+        return True
+
+    def refresh(self):
+        """Reload if another process updated the gallery on disk"""
+        signature = file_signature(self.meta_path)
+        if signature is not None and signature != self._loaded_signature:
+            self.load()
+
+    @contextmanager
+    def updating(self):
+        """Hold the gallery's cross-process lock for a refresh, enrol and save.
+
+        The gallery is reloaded under the lock if another process saved it
+        since, so the save never writes back a copy missing their students.
+        """
+        with file_lock(self.meta_path):
+            self.refresh()
+            yield self
+
+    def save(self):
+        """Write gallery to disk (arrays first, metadata last)"""
+        with file_lock(self.meta_path):
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        with self._lock:
+            roll_nos = list(self.roll_nos)
+            matrix, scales = self.matrix, self.scales
+            per_student = [self._samples_of(roll_no) for roll_no in roll_nos]
+
+        samples = (np.concatenate(per_student) if per_student
+                   else np.zeros((0, matrix.shape[1] if matrix.size else 0), dtype=np.float16))
+        meta = {
+            "model_name": self.model_name,
+            "dim": int(matrix.shape[1]) if matrix.size else 0,
+            "dtype": self.dtype,
+            "roll_nos": roll_nos,
+            "sample_counts": [len(student_samples) for student_samples in per_student],
+        }
+
+        writes = [(self.matrix_path, matrix), (self.samples_path, samples)]
+        if scales is not None:
+            writes.append((self.scales_path, scales))
+        temp_paths = []
+        try:
+            for path, array in writes:
+                with self._temp_file(path, temp_paths) as f:
+                    np.save(f, array)
+            with self._temp_file(self.meta_path, temp_paths, "w") as f:
+                json.dump(meta, f)
+            for (path, _), temp_path in zip(writes + [(self.meta_path, None)], temp_paths):
+                os.replace(temp_path, path)
+        except BaseException:
+            for temp_path in temp_paths:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+        self._loaded_signature = file_signature(self.meta_path)
+
+    def _temp_file(self, path: str, temp_paths: List[str], mode: str = "wb"):
+        """Open a uniquely named temp file next to path, recording it in temp_paths"""
+        fd, temp_path = tempfile.mkstemp(dir=self.gallery_dir, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        temp_paths.append(temp_path)
+        return os.fdopen(fd, mode)
+
+    def _samples_of(self, roll_no: str) -> np.ndarray:
+        """float16 (k, dim) samples of a student, caller holds the lock"""
+        if roll_no in self._changed_samples:
+            return self._changed_samples[roll_no]
+        start, count = self._sample_rows[roll_no]
+        return np.asarray(self._saved_samples[start:start + count])
+
+    def samples(self, roll_no: str) -> np.ndarray:
+        """A student's sample embeddings as float32 rows"""
+        with self._lock:
+            return self._samples_of(roll_no).astype(np.float32)
+
+    def enrol(self, samples: Dict[str, np.ndarray], replace: bool = True):
+        """Set the sample embeddings of students (or add to them with replace=False) and
+        recompute their templates, with a single matrix rebuild"""
+        if not samples:
+            return
+        prepared = {roll_no: _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, np.shape(vectors)[-1]))
+                    for roll_no, vectors in samples.items()}
+
+        with self._lock:
+            dim = next(iter(prepared.values())).shape[1]
+            if any(vectors.shape[1] != dim for vectors in prepared.values()) or (self.dim and self.dim != dim):
+                raise ValueError(f"Embedding size {dim} does not match gallery size {self.dim}")
+
+            positions = {roll_no: i for i, roll_no in enumerate(self.roll_nos)}
+            templates = []
+            for roll_no, vectors in prepared.items():
+                if not replace and roll_no in positions:
+                    vectors = np.vstack([self._samples_of(roll_no).astype(np.float32), vectors])
+                vectors = vectors[-self.max_samples:]
+                self._changed_samples[roll_no] = vectors.astype(np.float16)
+                templates.append(vectors.mean(axis=0))
+            quantized, quantized_scales = quantize(np.asarray(templates), self.dtype)
+
+            # Copies, so searches holding the old matrix aren't affected
+            matrix = self.matrix.copy() if self.matrix.size else np.zeros((0, dim), dtype=quantized.dtype)
+            scales = self.scales.copy() if self.scales is not None else None
+            roll_list = list(self.roll_nos)
+            new_rows = []
+            for row, roll_no in enumerate(prepared):
+                if roll_no in positions:
+                    matrix[positions[roll_no]] = quantized[row]
+                    if scales is not None:
+                        scales[positions[roll_no]] = quantized_scales[row]
+                else:
+                    roll_list.append(roll_no)
+                    new_rows.append(row)
+            if new_rows:
+                matrix = np.vstack([matrix, quantized[new_rows]])
+                if scales is not None:
+                    scales = np.concatenate([scales, quantized_scales[new_rows]])
+
+            self.matrix = np.ascontiguousarray(matrix)
+            self.scales = scales
+            self.roll_nos = roll_list
+            self._index_dirty = True
+
+    def upsert(self, roll_no: str, embedding: np.ndarray):
+        """Add or replace a student with a single sample embedding"""
+        self.enrol({roll_no: np.asarray(embedding).reshape(1, -1)})
+
+    def upsert_many(self, roll_nos: List[str], embeddings: np.ndarray):
+        """Add or replace many single-sample students with a single matrix rebuild (bulk enrolment)"""
+        embeddings = np.asarray(embeddings).reshape(len(roll_nos), -1)
+        self.enrol({roll_no: embedding.reshape(1, -1) for roll_no, embedding in zip(roll_nos, embeddings)})
+
+    def snapshot(self) -> Tuple[List[str], np.ndarray]:
+        """Consistent (roll_nos, template vectors as float32) pair"""
+        with self._lock:
+            return list(self.roll_nos), dequantize(self.matrix, self.scales)
+
+    def get_index(self):
+        """Face index over the current templates, rebuilt after any change"""
+        with self._lock:
+            if self._index_dirty:
+                index = create_index(self.index_backend, size=len(self.roll_nos))
+                # Built as a new object so in-flight searches keep a consistent index
+                if type(index) is type(self._index) and hasattr(index, "warm_start"):
+                    index.warm_start(self._index)
+                index.build(self.roll_nos, self.matrix, self.scales)
+                self._index = index
+                self._index_dirty = False
+            return self._index
+
+    def search(self, embedding: np.ndarray, k: int = 1) -> Dict:
+        """Top-k closest students: {"candidates": [{"roll_no", "distance"}], "margin"}"""
+        return self.get_index().search(embedding, k)
+
+
+def _gallery_paths(gallery_dir: str) -> Tuple[str, str, str, str]:
+    """Template matrix, int8 scales, samples and metadata files of a gallery"""
+    return tuple(os.path.join(gallery_dir, name) for name in
+                 ("embeddings.npy", "embeddings_scales.npy", "samples.npy", "embeddings.json"))
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
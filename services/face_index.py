@@ -0,0 +1,223 @@
+## services/face_index.py
+
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# Rows upcast to float32 at a time when searching a float16/int8 matrix, small enough to stay in cache
+SEARCH_BLOCK_ROWS = 2048
+
+
+class BruteForceIndex:
+    """Exact nearest-neighbour search over a contiguous matrix.
+
+    The matrix may be float32, or a compact float16 / int8 (with per-row
+    scales) matrix from quantize(); compact matrices are searched block by
+    block so the full-size float32 copy never exists.
+    """
+
+    name = "brute"
+
+    def __init__(self, metric: str = "cosine"):
+        if metric not in ("cosine", "euclidean_l2"):
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.metric = metric
+        self.ids: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.scales: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def build(self, ids: List[str], matrix: np.ndarray, scales: Optional[np.ndarray] = None):
+        """Index vectors; rows are L2-normalised so both metrics reduce to a dot product.
+
+        float32 rows are normalised here; float16/int8 rows (and int8 scales)
+        must come from quantize(), which normalises before quantizing.
+        """
+        self.ids = list(ids)
+        if matrix.dtype in (np.float16, np.int8):
+            self.matrix = np.ascontiguousarray(matrix)
+            self.scales = scales
+        else:
+            self.matrix = _normalize(np.ascontiguousarray(matrix, dtype=np.float32))
+            self.scales = None
+
+    def _similarity(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if matrix.dtype == np.float32:
+            return matrix @ query
+
+        similarity = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            block = matrix[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+            similarity[start:start + SEARCH_BLOCK_ROWS] = block @ query
+        if self.scales is not None:
+            similarity *= self.scales if rows is None else self.scales[rows]
+        return similarity
+
+    def vectors(self) -> np.ndarray:
+        """Indexed rows as float32"""
+        return dequantize(self.matrix, self.scales)
+
+    def _distances(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        similarity = self._similarity(query, rows)
+        if self.metric == "cosine":
+            return 1.0 - similarity
+        return np.sqrt(np.maximum(2.0 - 2.0 * similarity, 0.0))
+
+    def _top_k(self, distances: np.ndarray, rows: Optional[np.ndarray], k: int) -> Dict:
+        k = min(k, len(distances))
+        if k == 0:
+            return {"candidates": [], "margin": 0.0}
+
+        # argpartition is O(n), only the k winners get sorted
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top])]
+        row_ids = top if rows is None else rows[top]
+
+        candidates = [{"roll_no": self.ids[int(r)], "distance": float(distances[i])} for r, i in zip(row_ids, top)]
+        margin = candidates[1]["distance"] - candidates[0]["distance"] if len(candidates) > 1 else float('inf')
+        return {"candidates": candidates, "margin": float(margin)}
+
+    def search(self, query: np.ndarray, k: int = 1) -> Dict:
+        """Return top-k candidates (closest first) and the best-vs-second distance margin"""
+        if not len(self.ids):
+            return {"candidates": [], "margin": 0.0}
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        # Ask for one extra so the margin is always against the true runner-up
+        result = self._top_k(self._distances(query), None, max(k, 2))
+        result["candidates"] = result["candidates"][:k]
+        return result
+
+
+class IVFIndex(BruteForceIndex):
+    """Approximate inverted-file index: k-means coarse quantizer + exact search in the probed lists.
+
+    Only ``n_probe`` of ``n_lists`` clusters are scanned per query, so search cost
+    grows with roughly n_probe / n_lists of the gallery instead of all of it.
+    """
+
+    name = "ivf"
+
+    def __init__(self, metric: str = "cosine", n_lists: Optional[int] = None, n_probe: int = 4,
+                 train_iterations: int = 10, seed: int = 0):
+        super().__init__(metric)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists: List[np.ndarray] = []
+        self._trained_size = 0
+
+    def warm_start(self, previous: "IVFIndex"):
+        """Reuse the trained clusters of a previous index over the same gallery"""
+        self.centroids = previous.centroids
+        self._trained_size = previous._trained_size
+
+    def build(self, ids: List[str], matrix: np.ndarray, scales: Optional[np.ndarray] = None):
+        super().build(ids, matrix, scales)
+        n = len(self.ids)
+        if n == 0:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+            self.lists = []
+            return
+
+        # Retrain only when the gallery has grown a lot or the dimension changed,
+        # otherwise new vectors are just reassigned to the existing clusters.
+        if (not self.centroids.size or self.centroids.shape[1] != self.matrix.shape[1]
+                or n > 2 * self._trained_size):
+            self._train()
+        self._assign()
+
+    def _train(self):
+        n = len(self.ids)
+        vectors = self.vectors()
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._trained_size = n
+
+    def _assign(self):
+        assignment = np.argmax(self.vectors() @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def search(self, query: np.ndarray, k: int = 1) -> Dict:
+        if not len(self.ids):
+            return {"candidates": [], "margin": 0.0}
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        rows = np.concatenate([self.lists[c] for c in closest])
+
+        result = self._top_k(self._distances(query, rows), rows, max(k, 2))
+        result["candidates"] = result["candidates"][:k]
+        return result
+
+
+INDEX_BACKENDS = {
+    BruteForceIndex.name: BruteForceIndex,
+    IVFIndex.name: IVFIndex,
+}
+
+# Below this many faces an exact scan is faster than probing clusters
+AUTO_IVF_MIN_SIZE = 1000
+
+
+def create_index(backend: Optional[str] = None, size: int = 0, metric: str = "cosine"):
+    """Create a face index; backend is 'brute', 'ivf' or 'auto' (FACE_INDEX_BACKEND env, default auto)"""
+    backend = backend or os.getenv("FACE_INDEX_BACKEND", "auto")
+    if backend == "auto":
+        backend = IVFIndex.name if size >= AUTO_IVF_MIN_SIZE else BruteForceIndex.name
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown face index backend: {backend}")
+    return INDEX_BACKENDS[backend](metric=metric)
+
+
+def quantize(vectors: np.ndarray, dtype: str = "float32") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """L2-normalise rows and store them as float32, float16 or int8.
+
+    int8 rows get a per-row scale (returned alongside, None otherwise) so
+    that row * scale approximates the normalised vector.
+    """
+    vectors = _normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Unsupported gallery dtype: {dtype}")
+
+
+def dequantize(matrix: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """float32 rows of a matrix produced by quantize()"""
+    vectors = matrix.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
@@ -0,0 +1,101 @@
+## services/face_models.py
+
+import os
+import numpy as np
+from typing import NamedTuple, Optional, Tuple
+
+class FaceModelSpec(NamedTuple):
+    name: str  # DeepFace model name
+    input_size: Tuple[int, int]  # (width, height) of the aligned face
+    dim: int  # embedding size
+    distance_threshold: float  # DeepFace's tuned cosine threshold (same as DeepFace.verify)
+    weights_mb: int  # approximate size of the weights
+
+
+# Recognition models FACE_MODEL can select, from heaviest to lightest
+FACE_MODELS = {spec.name: spec for spec in [
+    FaceModelSpec("VGG-Face", (224, 224), 4096, 0.68, 580),
+    FaceModelSpec("Facenet512", (160, 160), 512, 0.30, 95),
+    FaceModelSpec("ArcFace", (112, 112), 512, 0.68, 137),
+    FaceModelSpec("SFace", (112, 112), 128, 0.593, 37),
+]}
+
+# Detector backends FACE_DETECTOR can select ("skip" uses the whole image as the face)
+DETECTOR_BACKENDS = ("opencv", "ssd", "mtcnn", "retinaface", "mediapipe", "yolov8", "yunet", "fastmtcnn", "skip")
+
+RUNTIMES = ("deepface", "onnx")
+
+
+class FaceModelConfig(NamedTuple):
+    model: FaceModelSpec
+    detector_backend: str
+    distance_threshold: float
+    runtime: str  # "deepface" (its Keras / OpenCV model) or "onnx" (ONNX Runtime, see OnnxEmbedder)
+    onnx_path: str
+
+
+def model_slug(model_name: str) -> str:
+    """File-name form of a model name: VGG-Face -> vggface"""
+    return model_name.lower().replace("-", "")
+
+def load_face_model_config(model_name: Optional[str] = None, detector_backend: Optional[str] = None,
+                           runtime: Optional[str] = None) -> FaceModelConfig:
+    """Face model settings from the arguments, else FACE_MODEL, FACE_DETECTOR and FACE_RUNTIME.
+
+    FACE_DISTANCE_THRESHOLD overrides the model's threshold, FACE_ONNX_DIR
+    is where exported models are looked up (data/models/<model>.onnx).
+    """
+    model_name = model_name or os.environ.get("FACE_MODEL", "VGG-Face")
+    detector_backend = detector_backend or os.environ.get("FACE_DETECTOR", "opencv")
+    runtime = runtime or os.environ.get("FACE_RUNTIME", "deepface")
+
+    if model_name not in FACE_MODELS:
+        raise ValueError(f"Unknown face model {model_name}, choose one of {', '.join(FACE_MODELS)}")
+    if detector_backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown face detector {detector_backend}, choose one of {', '.join(DETECTOR_BACKENDS)}")
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown face runtime {runtime}, choose one of {', '.join(RUNTIMES)}")
+
+    spec = FACE_MODELS[model_name]
+    threshold = float(os.environ.get("FACE_DISTANCE_THRESHOLD", spec.distance_threshold))
+    onnx_path = os.path.join(os.environ.get("FACE_ONNX_DIR", os.path.join("data", "models")),
+                             f"{model_slug(model_name)}.onnx")
+    return FaceModelConfig(spec, detector_backend, threshold, runtime, onnx_path)
+
+
+class OnnxEmbedder:
+    """Runs an exported face model with ONNX Runtime on the CPU.
+
+    Takes the same (n, height, width, 3) batch of aligned faces as the Keras
+    model. onnxruntime is an optional dependency, imported only here.
+    """
+
+    def __init__(self, path: str, threads: Optional[int] = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or int(os.environ.get("FACE_ONNX_THREADS", 0))
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch.astype(np.float32)})[0].astype(np.float32)
+
+
+def export_onnx(model_name: str, path: str) -> str:
+    """Convert a DeepFace Keras model to ONNX at ``path`` (needs tf2onnx)"""
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model(model_name)
+    if not hasattr(model.model, "predict_on_batch"):
+        # SFace already runs through OpenCV's own ONNX runtime
+        raise ValueError(f"{model_name} is not a Keras model and has no ONNX export")
+
+    width, height = FACE_MODELS[model_name].input_size
+    signature = [tf.TensorSpec((None, height, width, 3), tf.float32, name="face")]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tf2onnx.convert.from_keras(model.model, input_signature=signature, opset=13, output_path=path)
+    return path
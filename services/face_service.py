@@ -2,136 +2,433 @@
 
 import cv2
 import os
+import tempfile
 import numpy as np
 from deepface import DeepFace
-import tempfile
-from typing import Optional, Tuple
+from deepface.detectors import DetectorWrapper
+from deepface.modules import detection
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from services.campus_index import CampusFaceIndex
+from services.face_gallery import FaceGallery
+from services.face_models import OnnxEmbedder, load_face_model_config
 
 class FaceService:
-    def __init__(self):
+    def __init__(self, model_name: Optional[str] = None, detector_backend: Optional[str] = None,
+                 runtime: Optional[str] = None):
         self.confidence_threshold = 0.6
+        # Model, detector and runtime from FACE_MODEL / FACE_DETECTOR / FACE_RUNTIME (see services/face_models.py)
+        self.config = load_face_model_config(model_name, detector_backend, runtime)
+        self.model_name = self.config.model.name
+        self.detector_backend = self.config.detector_backend
+        # Cosine threshold tuned for the model (same as DeepFace.verify)
+        self.distance_threshold = self.config.distance_threshold
+        self.runtime = self.config.runtime
+        self.onnx_model = None
+        # Required distance gap between best and second-best candidate (0 = off)
+        self.min_margin = 0.0
+        self.galleries = {}
+        self._galleries_lock = threading.Lock()
+        # Every branch-year gallery, for lookups that don't know the student's branch (face login)
+        self.campus_index = CampusFaceIndex("data", self.get_gallery)
+        # Embed stored images missing from a gallery when it is first loaded
+        self.embed_missing = True
+        self.ready = False
+    
+    def warm_up(self) -> bool:
+        """Build the recognition model and detector once and run a dummy inference"""
+        if self.ready:
+            return True
+        try:
+            print(f"🔥 Loading {self.model_name} model ({self.runtime}) and {self.detector_backend} detector...")
+            start = time.perf_counter()
+            
+            if self.runtime == "onnx":
+                self.onnx_model = self._load_onnx_model()
+            if self.onnx_model is None:
+                DeepFace.build_model(self.model_name)
+            if self.detector_backend != "skip":
+                DetectorWrapper.build_model(self.detector_backend)
+            
+            # First forward pass builds the TensorFlow graph
+            width, height = self.config.model.input_size
+            self.get_embedding(np.zeros((height, width, 3), dtype=np.uint8))
+            
+            self.ready = True
+            print(f"✅ Face model ready in {time.perf_counter() - start:.1f}s")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Face model warm-up failed: {str(e)}")
+            return False
+    
+    def _load_onnx_model(self) -> Optional[OnnxEmbedder]:
+        """ONNX Runtime session for the model, None (DeepFace fallback) if it can't be used"""
+        if not os.path.exists(self.config.onnx_path):
+            print(f"⚠️ {self.config.onnx_path} not found (export it with face_benchmark.py --export-onnx), using DeepFace")
+            return None
+        try:
+            return OnnxEmbedder(self.config.onnx_path)
+        except ImportError:
+            print("⚠️ onnxruntime is not installed, using DeepFace")
+            return None
+    
+    def get_faces_dir(self, branch_code: str, year: str) -> str:
+        """Get faces directory path for a branch-year"""
+        return os.path.join("data", "branches", branch_code, year, "faces")
+    
+    def get_embedding(self, img) -> Optional[np.ndarray]:
+        """Compute face embedding for an image path or BGR array"""
+        return self.embed_faces([self.detect_face(img)])[0]
+    
+    def decode_image(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """Decode uploaded image bytes to a BGR array"""
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    def detect_face(self, img) -> np.ndarray:
+        """Detect, align and resize a face (image path or BGR array) into a model-ready (1, h, w, 3) tensor"""
+        width, height = self.config.model.input_size
+        face_objs = detection.extract_faces(
+            img_path=img,
+            target_size=(height, width),
+            detector_backend=self.detector_backend,
+            enforce_detection=False,
+            align=True
+        )
+        return face_objs[0]['face']
+    
+    def embed_faces(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Embed detected faces with a single batched forward pass"""
+        if self.onnx_model is not None:
+            return self.onnx_model(np.concatenate(faces, axis=0))
+        
+        model = DeepFace.build_model(self.model_name)
+        
+        # Keras models take the whole batch at once, others (SFace, Dlib) go one by one
+        if hasattr(model.model, 'predict_on_batch'):
+            batch = np.concatenate(faces, axis=0)
+            return model.model(batch, training=False).numpy().astype(np.float32)
+        return np.asarray([model.find_embeddings(face) for face in faces], dtype=np.float32)
+    
+    def embed_probes(self, images_bytes: List[bytes]) -> List[Tuple[Optional[np.ndarray], Dict[str, float]]]:
+        """Embed uploaded images in memory, returning (embedding or None, per-stage ms) for each.
+        
+        Each image is decoded and its face detected and aligned once; all faces
+        then share one forward pass, whose time is reported as every item's embed stage.
+        """
+        faces = []
+        positions = []
+        timings = [{} for _ in images_bytes]
+        
+        for i, image_bytes in enumerate(images_bytes):
+            try:
+                start = time.perf_counter()
+                img = self.decode_image(image_bytes)
+                timings[i]["decode"] = _elapsed_ms(start)
+                if img is None:
+                    continue
+                start = time.perf_counter()
+                faces.append(self.detect_face(img))
+                positions.append(i)
+                timings[i]["detect"] = _elapsed_ms(start)
+            except Exception as e:
+                print(f"❌ Error detecting face in batch item {i}: {str(e)}")
+        
+        results = [(None, item_timings) for item_timings in timings]
+        if faces:
+            start = time.perf_counter()
+            embeddings = self.embed_faces(faces)
+            embed_ms = _elapsed_ms(start)
+            for position, embedding in zip(positions, embeddings):
+                timings[position]["embed"] = embed_ms
+                results[position] = (embedding, timings[position])
+        return results
+    
+    def get_embeddings_batch(self, images_bytes: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Embed several uploaded images, returning None for images that can't be used"""
+        return [embedding for embedding, _ in self.embed_probes(images_bytes)]
+    
+    def get_gallery(self, branch_code: str, year: str) -> FaceGallery:
+        """Get embedding gallery for a branch-year, building it on first use"""
+        key = (branch_code, year)
+        gallery = self.galleries.get(key)
+        
+        if gallery is None:
+            with self._galleries_lock:
+                gallery = self.galleries.get(key)
+                if gallery is None:
+                    gallery = FaceGallery(self.get_faces_dir(branch_code, year), self.model_name)
+                    gallery.load()
+                    self._sync_gallery_with_images(gallery)
+                    self.galleries[key] = gallery
+        else:
+            gallery.refresh()
+        
+        return gallery
+    
+    def ensure_gallery(self, branch_code: str, year: str) -> int:
+        """Load (and if needed build) a branch-year gallery, returns its size"""
+        return len(self.get_gallery(branch_code, year))
+    
+    def _sync_gallery_with_images(self, gallery: FaceGallery):
+        """Embed stored face images that are missing from the gallery (one-time migration)"""
+        if not self.embed_missing or not os.path.exists(gallery.faces_dir):
+            return
+        
+        known = set(gallery.roll_nos)
+        missing = {roll_no: files for roll_no, files in face_image_files(gallery.faces_dir).items()
+                   if roll_no not in known}
+        if not missing:
+            return
+        
+        print(f"🧠 Building face embeddings for {len(missing)} students' stored images in {gallery.faces_dir}")
+        samples = {}
+        for roll_no, files in missing.items():
+            try:
+                embeddings = [self.get_embedding(os.path.join(gallery.faces_dir, face_file)) for face_file in files]
+                embeddings = [embedding for embedding in embeddings if embedding is not None]
+                if embeddings:
+                    samples[roll_no] = np.stack(embeddings)
+            except Exception as e:
+                print(f"❌ Error embedding {roll_no}: {str(e)}")
+        
+        with gallery.updating():
+            # Another process may have embedded some of them meanwhile
+            samples = {roll_no: vectors for roll_no, vectors in samples.items() if roll_no not in gallery.roll_nos}
+            if samples:
+                gallery.enrol(samples)
+                gallery.save()
     
     def save_face_image(self, image_bytes: bytes, roll_no: str, branch_code: str, year: str) -> bool:
-        """Save face image for a student"""
+        """Save face image for a student and add its embedding to the gallery"""
+        return self.save_face_images([image_bytes], roll_no, branch_code, year)
+    
+    def save_face_images(self, images_bytes: List[bytes], roll_no: str, branch_code: str, year: str,
+                         replace: bool = True) -> bool:
+        """Save one or more face captures of a student and enrol them as one template.
+        
+        Captures are saved as {roll_no}.jpg, {roll_no}.2.jpg, ... and embedded
+        with one forward pass; the gallery keeps their mean as the student's
+        template. replace=False adds them to the student's earlier captures.
+        The earlier files are only replaced once the gallery is saved, so a
+        failed enrolment leaves the student as they were.
+        """
         try:
             # Create face directory path
-            face_dir = os.path.join("data", "branches", branch_code, year, "faces")
+            face_dir = self.get_faces_dir(branch_code, year)
             os.makedirs(face_dir, exist_ok=True)
             
-            # Save image
-            face_path = os.path.join(face_dir, f"{roll_no}.jpg")
+            # Convert bytes to images, unreadable captures are skipped
+            images = [img for img in map(self.decode_image, images_bytes) if img is not None]
+            if not images:
+                return False
             
-            # Convert bytes to image
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            # Load gallery before writing the new images so they aren't picked up as a migration
+            gallery = self.get_gallery(branch_code, year)
             
-            if img is None:
-                return False
+            # Embed once at registration so recognition never re-embeds stored faces
+            embeddings = self.embed_faces([self.detect_face(img) for img in images])
             
-            # Save image
-            success = cv2.imwrite(face_path, img)
-            return success
+            # New captures are staged under temp names, the stored ones stay until the gallery is saved
+            earlier = face_image_files(face_dir).get(roll_no, [])
+            first = 1 if replace else len(earlier) + 1
+            staged = []
+            try:
+                for n, img in enumerate(images, start=first):
+                    encoded, jpeg = cv2.imencode(".jpg", img)
+                    if not encoded:
+                        return False
+                    fd, temp_path = tempfile.mkstemp(dir=face_dir, prefix=f".{roll_no}.", suffix=".tmp")
+                    staged.append((temp_path, f"{roll_no}.jpg" if n == 1 else f"{roll_no}.{n}.jpg"))
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(jpeg.tobytes())
+                
+                with gallery.updating():
+                    gallery.enrol({roll_no: embeddings}, replace=replace)
+                    gallery.save()
+                
+                # The new captures take their names, earlier ones they don't overwrite are dropped
+                for temp_path, face_file in staged:
+                    os.replace(temp_path, os.path.join(face_dir, face_file))
+                if replace:
+                    kept = {face_file for _, face_file in staged}
+                    for old_file in earlier:
+                        if old_file not in kept:
+                            os.remove(os.path.join(face_dir, old_file))
+            finally:
+                for temp_path, _ in staged:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            print(f"🧑 Enrolled {roll_no} from {len(images)} capture(s)")
+            return True
             
         except Exception as e:
             print(f"Error saving face image: {e}")
             return False
     
-    def recognize_face(self, input_image_bytes: bytes, branch_code: str, year: str) -> Optional[str]:
+    def prepare_enrolment(self, items: List[Tuple[str, bytes]], branch_code: str,
+                          year: str) -> List[Tuple[Optional[np.ndarray], Optional[str], Optional[str]]]:
+        """Stage a batch of enrolment photos and embed them with one forward pass.
+        
+        Returns (embedding, error, staged_path) per (roll_no, image_bytes) item.
+        Photos are written under temp names and only take {roll_no}.jpg in
+        place_enrolment_photos, once the student is registered. The gallery
+        is not touched, the caller adds every embedding at once with add_embeddings.
+        """
+        face_dir = self.get_faces_dir(branch_code, year)
+        os.makedirs(face_dir, exist_ok=True)
+        
+        results = [(None, "Image could not be decoded", None)] * len(items)
+        faces = []
+        positions = []
+        for i, (roll_no, image_bytes) in enumerate(items):
+            img = self.decode_image(image_bytes)
+            if img is None:
+                continue
+            try:
+                face = self.detect_face(img)
+            except Exception as e:
+                results[i] = (None, f"Face detection failed: {str(e)}", None)
+                continue
+            encoded, jpeg = cv2.imencode(".jpg", img)
+            if not encoded:
+                results[i] = (None, "Could not save face image", None)
+                continue
+            fd, staged_path = tempfile.mkstemp(dir=face_dir, prefix=f".{roll_no}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(jpeg.tobytes())
+            results[i] = (None, "Could not compute face embedding", staged_path)
+            faces.append(face)
+            positions.append(i)
+        
+        if faces:
+            try:
+                embeddings = self.embed_faces(faces)
+            except Exception as e:
+                print(f"❌ Error embedding enrolment batch: {str(e)}")
+                embeddings = [None] * len(faces)
+            for position, embedding in zip(positions, embeddings):
+                if embedding is not None:
+                    results[position] = (embedding, None, results[position][2])
+        return results
+    
+    def place_enrolment_photos(self, staged: Dict[str, str], registered: List[str], branch_code: str, year: str):
+        """Move staged enrolment photos of registered students to {roll_no}.jpg and drop the others.
+        
+        ``staged`` maps roll numbers to prepare_enrolment's staged paths, a
+        student who was already registered keeps their stored photo.
+        """
+        face_dir = self.get_faces_dir(branch_code, year)
+        registered = set(registered)
+        for roll_no, staged_path in staged.items():
+            try:
+                if roll_no in registered:
+                    os.replace(staged_path, os.path.join(face_dir, f"{roll_no}.jpg"))
+                else:
+                    os.remove(staged_path)
+            except FileNotFoundError:
+                pass
+    
+    def add_embeddings(self, embeddings: Dict[str, np.ndarray], branch_code: str, year: str) -> int:
+        """Add enrolled students' embeddings to the gallery and save it once, returns the gallery size"""
+        gallery = self.get_gallery(branch_code, year)
+        if embeddings:
+            with gallery.updating():
+                gallery.upsert_many(list(embeddings), np.stack(list(embeddings.values())))
+                gallery.save()
+        return len(gallery)
+    
+    def recognize_face(self, input_image_bytes: bytes, branch_code: str, year: str,
+                       min_margin: Optional[float] = None) -> Optional[str]:
         """Recognize face and return roll number of best match"""
         try:
             print(f"🔍 Starting face recognition for {branch_code}/{year}")
-            
-            # Save input image temporarily
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-                tmp_file.write(input_image_bytes)
-                input_image_path = tmp_file.name
-            print(f"📁 Input image saved to: {input_image_path}")
-            
-            # Get all face images from the faces directory
-            faces_dir = os.path.join("data", "branches", branch_code, year, "faces")
-            print(f"📂 Looking for faces in: {faces_dir}")
-            
-            if not os.path.exists(faces_dir):
-                print(f"❌ Faces directory not found: {faces_dir}")
-                os.unlink(input_image_path)
-                return None
-            
-            face_files = [f for f in os.listdir(faces_dir) if f.endswith('.jpg')]
-            print(f"📊 Found {len(face_files)} face images to compare")
-            
-            if not face_files:
-                print("❌ No face images found in database")
-                os.unlink(input_image_path)
-                return None
-            
-            best_match = None
-            lowest_distance = float('inf')
-            all_results = []
-            
-            # Compare with all stored faces and find best match
-            for face_file in face_files:
-                roll_no = face_file.replace('.jpg', '')
-                stored_face_path = os.path.join(faces_dir, face_file)
-                
-                try:
-                    print(f"🔄 Comparing with {roll_no}...")
-                    
-                    # Use DeepFace to verify faces
-                    result = DeepFace.verify(
-                        img1_path=input_image_path,
-                        img2_path=stored_face_path,
-                        model_name='VGG-Face',
-                        enforce_detection=False
-                    )
-                    
-                    distance = result['distance']
-                    verified = result['verified']
-                    
-                    print(f"   📈 {roll_no}: distance={distance:.4f}, verified={verified}")
-                    
-                    # Store result for logging
-                    all_results.append({
-                        'roll_no': roll_no,
-                        'distance': distance,
-                        'verified': verified
-                    })
-                    
-                    # Check if this is the best match so far
-                    if verified and distance < lowest_distance:
-                        lowest_distance = distance
-                        best_match = roll_no
-                        print(f"   ✅ New best match: {roll_no} with distance {distance:.4f}")
-                        
-                except Exception as e:
-                    print(f"❌ Error comparing with {roll_no}: {str(e)}")
-                    continue
-            
-            # Clean up temporary file
-            os.unlink(input_image_path)
-            
-            # Log all comparison results
-            print(f"📊 All comparison results:")
-            for result in sorted(all_results, key=lambda x: x['distance']):
-                status = "✅ VERIFIED" if result['verified'] else "❌ NOT VERIFIED"
-                print(f"   {result['roll_no']}: {result['distance']:.4f} - {status}")
-            
-            if best_match:
-                print(f"🎯 BEST MATCH FOUND: {best_match} with distance {lowest_distance:.4f}")
-                return best_match
-            else:
-                print("❌ No verified matches found")
-                return None
+            roll_no, timings = self.recognize_face_timed(input_image_bytes, branch_code, year, min_margin)
+            print(f"⏱️ Face recognition stages (ms): {timings}")
+            return roll_no
             
         except Exception as e:
             print(f"❌ Critical error in face recognition: {str(e)}")
-            # Clean up temporary file if it exists
-            try:
-                if 'input_image_path' in locals():
-                    os.unlink(input_image_path)
-            except:
-                pass
             return None
     
+    def recognize_face_timed(self, input_image_bytes: bytes, branch_code: str, year: str,
+                             min_margin: Optional[float] = None) -> Tuple[Optional[str], Dict[str, float]]:
+        """Recognize a face from upload bytes without touching disk, with decode/detect/embed/match timings"""
+        # One detection and one embedding for the probe, stored faces are already in the gallery
+        probe_embedding, timings = self.embed_probes([input_image_bytes])[0]
+        if probe_embedding is None:
+            print("❌ Could not compute embedding for input image")
+            return None, timings
+        
+        start = time.perf_counter()
+        roll_no = self.match_embedding(probe_embedding, branch_code, year, min_margin)
+        timings["match"] = _elapsed_ms(start)
+        return roll_no, timings
+    
+    def match_embedding(self, probe_embedding: np.ndarray, branch_code: str, year: str,
+                        min_margin: Optional[float] = None) -> Optional[str]:
+        """Match a probe embedding against the branch-year gallery"""
+        if min_margin is None:
+            min_margin = self.min_margin
+        
+        gallery = self.get_gallery(branch_code, year)
+        print(f"📊 Gallery has {len(gallery)} face embeddings to compare")
+        
+        if not len(gallery):
+            print("❌ No face embeddings found in database")
+            return None
+        
+        # One index search against every stored face
+        result = gallery.search(probe_embedding, k=5)
+        best = self._verified_best(result, min_margin)
+        return best['roll_no'] if best else None
+    
+    def match_embedding_campus(self, probe_embedding: np.ndarray, branch_code: Optional[str] = None,
+                               year: Optional[str] = None, min_margin: Optional[float] = None) -> Optional[Dict]:
+        """Match a probe against every gallery on campus, branch_code/year only narrow the search.
+        
+        Returns the best candidate ({"roll_no", "branch_code", "year", "distance"}) or None.
+        """
+        if min_margin is None:
+            min_margin = self.min_margin
+        
+        result = self.campus_index.search(probe_embedding, k=5, branch_code=branch_code, year=year,
+                                          accept_distance=self.distance_threshold)
+        print(f"📊 Searched {result['partitions']} galleries")
+        if not result["candidates"]:
+            print("❌ No face embeddings found in database")
+            return None
+        return self._verified_best(result, min_margin)
+    
+    def _verified_best(self, result: Dict, min_margin: float) -> Optional[Dict]:
+        """Best candidate of a search if it is within the distance threshold and clear of the runner-up"""
+        candidates = result["candidates"]
+        if not candidates:
+            # e.g. the IVF lists probed for this face are empty
+            print("❌ No candidates found")
+            return None
+        
+        print(f"📊 Closest comparison results (margin {result['margin']:.4f}):")
+        for candidate in candidates:
+            status = "✅ VERIFIED" if candidate['distance'] <= self.distance_threshold else "❌ NOT VERIFIED"
+            place = f" ({candidate['branch_code']}/{candidate['year']})" if 'branch_code' in candidate else ""
+            print(f"   {candidate['roll_no']}{place}: {candidate['distance']:.4f} - {status}")
+        
+        best = candidates[0]
+        
+        if best['distance'] > self.distance_threshold:
+            print("❌ No verified matches found")
+            return None
+        
+        if result['margin'] < min_margin:
+            print(f"❌ Ambiguous match: {best['roll_no']} only {result['margin']:.4f} ahead of next candidate")
+            return None
+        
+        print(f"🎯 BEST MATCH FOUND: {best['roll_no']} with distance {best['distance']:.4f}")
+        return best
+    
     def extract_face_from_camera(self, image_bytes: bytes) -> Optional[bytes]:
         """Extract and crop face from camera image"""
         try:
@@ -172,4 +469,34 @@ class FaceService:
             
         except Exception as e:
             print(f"Error extracting face: {e}")
-            return None
\ No newline at end of file
+            return None
+
+def face_image_files(faces_dir: str) -> Dict[str, List[str]]:
+    """Stored capture files per roll number: {roll_no}.jpg, then {roll_no}.2.jpg, {roll_no}.3.jpg, ..."""
+    if not os.path.isdir(faces_dir):
+        return {}
+    captures: Dict[str, List[Tuple[int, str]]] = {}
+    for face_file in os.listdir(faces_dir):
+        if not face_file.endswith('.jpg'):
+            continue
+        roll_no, _, number = face_file[:-len('.jpg')].partition('.')
+        captures.setdefault(roll_no, []).append((int(number) if number.isdigit() else 1, face_file))
+    return {roll_no: [face_file for _, face_file in sorted(files)] for roll_no, files in captures.items()}
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+# Process-pool workers keep their own FaceService so the model is loaded once per process
+_worker_face_service = None
+
+def init_face_worker():
+    """Pool initializer: load and warm up the face model in this worker process"""
+    global _worker_face_service
+    _worker_face_service = FaceService()
+    _worker_face_service.warm_up()
+
+def call_face_worker(method: str, *args):
+    """Picklable entry point that runs a FaceService method inside a pool worker"""
+    if _worker_face_service is None:
+        init_face_worker()
+    return getattr(_worker_face_service, method)(*args)
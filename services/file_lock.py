@@ -0,0 +1,101 @@
+## services/file_lock.py
+
+import os
+import tempfile
+import threading
+import pandas as pd
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads in this process are serialized
+    fcntl = None
+
+_thread_locks: Dict[str, threading.RLock] = {}
+_thread_locks_guard = threading.Lock()
+# Per-thread nesting depth, so only the outermost file_lock takes the flock
+_held = threading.local()
+
+def _thread_lock(path: str) -> threading.RLock:
+    key = os.path.abspath(path)
+    lock = _thread_locks.get(key)
+    if lock is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(key, threading.RLock())
+    return lock
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock on ``path`` across threads and processes.
+
+    Threads in this process queue on an RLock and other processes, e.g. extra
+    uvicorn workers, are excluded with flock on a ``<path>.lock`` sidecar
+    file. The lock is re-entrant within a thread.
+    """
+    key = os.path.abspath(path)
+    with _thread_lock(path):
+        depth = getattr(_held, "depth", None)
+        if depth is None:
+            depth = _held.depth = {}
+        if fcntl is None or depth.get(key):
+            depth[key] = depth.get(key, 0) + 1
+            try:
+                yield
+            finally:
+                depth[key] -= 1
+            return
+
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            depth[key] = 1
+            try:
+                yield
+            finally:
+                depth[key] = 0
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, size) of path, or None if missing; changes on every atomic replace or append"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def atomic_write_csv(df: pd.DataFrame, path: str):
+    """Write df to a temp file in the same directory, fsync it and rename over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def update_csv(path: str, mutate: Callable[[pd.DataFrame], Optional[pd.DataFrame]],
+               columns: Optional[List[str]] = None, **read_kwargs):
+    """Locked read-modify-write of a CSV file.
+
+    ``mutate`` receives the current table (an empty one with ``columns`` if
+    the file doesn't exist yet) and returns the table to write back, or None
+    to leave the file untouched. Returns whatever was written (or None).
+    """
+    with file_lock(path):
+        if os.path.exists(path):
+            df = pd.read_csv(path, **read_kwargs)
+        elif columns is not None:
+            df = pd.DataFrame(columns=columns)
+        else:
+            return None
+
+        result = mutate(df)
+        if result is not None:
+            atomic_write_csv(result, path)
+        return result
@@ -0,0 +1,114 @@
+## services/inference_batcher.py
+
+import asyncio
+import time
+from typing import Any, Callable, List, Optional, Set
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for one batched call.
+
+    ``submit`` is awaited by request handlers. A background task waits for the
+    first item, keeps collecting until ``max_wait_ms`` after that item was
+    queued or until ``max_batch_size`` items are queued, then runs
+    ``batch_fn(items)`` in an executor and hands each caller its own result.
+
+    Up to ``max_concurrent`` batches (the executor's workers) run at once;
+    the loop goes back to collecting as soon as a batch is started. Items
+    that queued while every worker was busy have already waited their
+    window and go out with the next free worker.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 25, executor=None, name: str = "batcher", max_concurrent: int = 1):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the batching loop on the running event loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Let batches already in the executor hand out their results
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result from the next batch"""
+        if not self.running:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.monotonic()))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.max_concurrent)
+
+        def finished(task: asyncio.Task):
+            self._batches.discard(task)
+            slots.release()
+
+        while True:
+            # Collect only once a worker is free, the queue fills up meanwhile
+            await slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+            task = asyncio.get_running_loop().create_task(self._process(batch))
+            self._batches.add(task)
+            task.add_done_callback(finished)
+
+    async def _process(self, batch: list):
+        items = [item for item, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+
+        start = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        print(f"⚡ {self.name}: processed batch of {len(items)} in {(time.perf_counter() - start) * 1000:.0f}ms")
+        for future, result in zip(futures, results):
+            # Caller may have gone away (client disconnect cancels the handler)
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,123 @@
+## services/model_server.py
+
+import os
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import Optional
+
+def socket_path() -> str:
+    """Unix socket the model server listens on (FACE_MODEL_SOCKET)"""
+    return os.environ.get("FACE_MODEL_SOCKET", os.path.join("data", "face_model.sock"))
+
+def _authkey() -> Optional[bytes]:
+    key = os.environ.get("FACE_MODEL_SERVER_KEY")
+    return key.encode() if key else None
+
+def serve_model(path: Optional[str] = None, max_concurrent: Optional[int] = None):
+    """Load the face model once and run FaceService calls for every API worker.
+
+    Each client connection gets a thread; at most ``max_concurrent``
+    (FACE_WORKERS) calls run the model at a time, TensorFlow already spreads
+    each one over the cores.
+    """
+    from services.face_service import FaceService
+
+    path = path or socket_path()
+    service = FaceService()
+    service.warm_up()
+    slots = threading.BoundedSemaphore(max_concurrent or int(os.environ.get("FACE_WORKERS", 1)))
+
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = Listener(path, family="AF_UNIX", authkey=_authkey())
+    os.chmod(path, 0o600)
+    print(f"🧠 Face model server ({service.model_name}) listening on {path}")
+
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"⚠️ Rejected face model client: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(service, conn, slots), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+def _serve_connection(service, conn, slots: threading.BoundedSemaphore):
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if method.startswith("_"):
+                    raise AttributeError(f"FaceService.{method} is not served")
+                with slots:
+                    reply = ("ok", getattr(service, method)(*args))
+            except Exception as e:
+                reply = ("error", e)
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                # The result or exception couldn't be pickled
+                conn.send(("error", RuntimeError(f"FaceService.{method}: {e}")))
+
+
+class ModelServerClient:
+    """Runs FaceService methods in the model server, one connection per calling thread.
+
+    Used by the face pool threads of each API worker (FACE_POOL=server).
+    Connections are opened on first use, so a client created before the
+    workers fork holds none, and calls wait up to FACE_MODEL_SERVER_WAIT
+    seconds for the server to come up.
+    """
+
+    def __init__(self, path: Optional[str] = None, connect_timeout: Optional[float] = None):
+        self.path = path or socket_path()
+        self.authkey = _authkey()
+        self.connect_timeout = connect_timeout or float(os.environ.get("FACE_MODEL_SERVER_WAIT", 300))
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = Client(self.path, family="AF_UNIX", authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Not listening yet: still loading the model, or restarting
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._local.conn = conn
+        return conn
+
+    def call(self, method: str, *args):
+        """FaceService.<method>(*args), run in the model server"""
+        conn = self._connection()
+        try:
+            conn.send((method, args))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            # Server went away; the next call reconnects
+            self._local.conn = None
+            conn.close()
+            raise
+        if status == "error":
+            raise result
+        return result
+
+
+if __name__ == "__main__":
+    serve_model()
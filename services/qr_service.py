@@ -1,72 +1,383 @@
 ## services/qr_service.py
 
 import qrcode
+import hashlib
+import io
+import math
+import multiprocessing
 import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
 from pyzbar import pyzbar
-from PIL import Image
+from pyzbar.pyzbar import ZBarSymbol
+from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
+from typing import Dict, List, Optional, Tuple
+from services.file_lock import file_signature
+from services.qr_token import InvalidQRToken, QRTokenSigner, ReplayGuard, card_token_expiry, load_secret
+
+def render_qr_code(data: str, qr_path: str) -> bool:
+    """Render a QR code PNG encoding data to qr_path"""
+    try:
+        os.makedirs(os.path.dirname(qr_path), exist_ok=True)
+        
+        # Generate QR code
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        
+        # Create QR code image
+        img = qr.make_image(fill_color="black", back_color="white")
+        
+        # Save QR code
+        img.save(qr_path)
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error generating QR code: {e}")
+        return False
+
+# Grayscale decode flags per downscale factor; JPEGs are scaled in the DCT domain, so it is cheaper than a full decode
+REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+def _decode_first(gray: np.ndarray) -> Optional[str]:
+    """First QR code zbar reads in a grayscale image"""
+    decoded = pyzbar.decode(gray, symbols=[ZBarSymbol.QRCODE])
+    return decoded[0].data.decode('utf-8') if decoded else None
+
+def _qr_region(gray: np.ndarray, margin: float = 0.2) -> Optional[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) around the QR code found by OpenCV's finder-pattern detector, with a quiet-zone margin"""
+    found, points = cv2.QRCodeDetector().detect(gray)
+    if not found or points is None:
+        return None
+    points = points.reshape(-1, 2)
+    (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+    pad = margin * max(x1 - x0, y1 - y0)
+    height, width = gray.shape
+    return (max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+            min(width, int(x1 + pad) + 1), min(height, int(y1 + pad) + 1))
+
+def _render_qr_chunk(items: List[Tuple[str, str]]) -> List[bool]:
+    """Process-pool entry point: render a chunk of (data, qr_path) items"""
+    return [render_qr_code(data, qr_path) for data, qr_path in items]
+
+
+class QRImageCache:
+    """LRU of recently served QR PNGs with their strong ETags.
+
+    A hit costs one stat call to confirm the file hasn't been regenerated
+    since it was cached; the file is only read on a miss or a change.
+    """
+
+    def __init__(self, max_items: int = 512):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[tuple, bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Tuple[bytes, str]]:
+        """(png_bytes, etag) for path, or None if the file doesn't exist"""
+        signature = file_signature(path)
+        with self._lock:
+            cached = self._items.get(path)
+            if signature is None:
+                self._items.pop(path, None)
+                return None
+            if cached is not None and cached[0] == signature:
+                self._items.move_to_end(path)
+                return cached[1], cached[2]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+
+        with self._lock:
+            self._items[path] = (signature, data, etag)
+            self._items.move_to_end(path)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return data, etag
+
 
 class QRService:
     def __init__(self):
-        pass
+        # Recently served QR images, so printing day doesn't reread them from disk
+        self.image_cache = QRImageCache(int(os.environ.get("QR_CACHE_SIZE", 512)))
+        # Batches smaller than this are rendered in-process, process start-up would cost more
+        self.parallel_threshold = 64
+        # Photos are scanned at about this long side first, full resolution is the fallback
+        self.decode_side = int(os.environ.get("QR_DECODE_SIDE", 1000))
+        # QR codes carry signed tokens, checked in memory when scanned
+        self.tokens = QRTokenSigner(load_secret(), int(os.environ.get("QR_DISPLAY_PERIOD", 30)))
+        # About a semester: a copied card token stops working when the cards are reissued
+        self.card_ttl_seconds = int(os.environ.get("QR_CARD_TTL_DAYS", 120)) * 86400
+        self.replay_guard = ReplayGuard()
+        # Only the rotating phone code marks attendance, ID card tokens are refused
+        self.require_display_code = os.environ.get("QR_REQUIRE_DISPLAY_CODE", "0") == "1"
+        # Cards printed before signed tokens encode the bare roll number; opt-in, optionally until a cut-off date
+        self.accept_plain_roll = os.environ.get("QR_ACCEPT_PLAIN_ROLL", "0") == "1"
+        self.plain_roll_until = os.environ.get("QR_PLAIN_ROLL_UNTIL") or None
+        # Card token expiry per QR PNG, keyed by file signature so a PNG is only decoded again once regenerated
+        self._card_expiry: Dict[str, Tuple[tuple, Optional[float]]] = {}
+        self._card_expiry_lock = threading.Lock()
     
     def generate_qr_code(self, roll_no: str, branch_code: str, year: str) -> bool:
         """Generate QR code for student"""
-        try:
-            # Create QR code directory path
-            qr_dir = os.path.join("data", "branches", branch_code, year, "qrcodes")
-            os.makedirs(qr_dir, exist_ok=True)
-            
-            # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(roll_no)
-            qr.make(fit=True)
-            
-            # Create QR code image
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Save QR code
-            qr_path = os.path.join(qr_dir, f"{roll_no}.png")
-            img.save(qr_path)
-            
+        token = self.tokens.issue_card_token(roll_no, branch_code, year, self.card_ttl_seconds)
+        return render_qr_code(token, self.get_qr_code_path(roll_no, branch_code, year))
+    
+    def generate_qr_codes(self, students: List[Tuple[str, str, str]], workers: Optional[int] = None) -> Dict[str, bool]:
+        """Generate QR codes for many (roll_no, branch_code, year) students, in parallel processes when worthwhile"""
+        items = [
+            (self.tokens.issue_card_token(roll_no, branch_code, year, self.card_ttl_seconds),
+             self.get_qr_code_path(roll_no, branch_code, year))
+            for roll_no, branch_code, year in students
+        ]
+        if not items:
+            return {}
+        
+        start = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        if len(items) < self.parallel_threshold or workers == 1:
+            results = _render_qr_chunk(items)
+        else:
+            chunk_size = math.ceil(len(items) / (workers * 4))
+            chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+            # spawn: workers start clean instead of inheriting the server's threads
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = [ok for chunk_results in pool.map(_render_qr_chunk, chunks) for ok in chunk_results]
+        
+        print(f"🔳 Generated {sum(results)}/{len(items)} QR codes in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return {roll_no: ok for (roll_no, _, _), ok in zip(students, results)}
+    
+    def needs_new_qr_code(self, roll_no: str, branch_code: str, year: str) -> bool:
+        """True when the student's QR PNG is missing, encodes a bare roll number or holds an expired card token"""
+        qr_path = self.get_qr_code_path(roll_no, branch_code, year)
+        signature = file_signature(qr_path)
+        if signature is None:
+            with self._card_expiry_lock:
+                self._card_expiry.pop(qr_path, None)
             return True
-            
-        except Exception as e:
-            print(f"Error generating QR code: {e}")
-            return False
+        with self._card_expiry_lock:
+            cached = self._card_expiry.get(qr_path)
+        if cached is not None and cached[0] == signature:
+            expires = cached[1]
+        else:
+            gray = cv2.imread(qr_path, cv2.IMREAD_GRAYSCALE)
+            code = _decode_first(gray) if gray is not None else None
+            expires = card_token_expiry(code) if code else None
+            with self._card_expiry_lock:
+                self._card_expiry[qr_path] = (signature, expires)
+        return expires is None or expires < time.time()
+    
+    def get_qr_code_image(self, roll_no: str, branch_code: str, year: str) -> Optional[Tuple[bytes, str]]:
+        """QR code PNG bytes and ETag for a student, served from the in-memory LRU when possible"""
+        return self.image_cache.get(self.get_qr_code_path(roll_no, branch_code, year))
+    
+    def build_id_cards_pdf(self, students: List[Dict], branch_code: str, year: str, dpi: int = 200) -> bytes:
+        """Printable A4 PDF of ID cards (QR code, name, roll number), 8 cards per page.
+        
+        Pages are 1-bit black and white: QR modules stay sharp (no JPEG
+        artifacts to trip scanners) and a 600-student batch stays a small file.
+        """
+        page_width, page_height = int(8.27 * dpi), int(11.69 * dpi)
+        margin = int(0.4 * dpi)
+        columns, rows = 2, 4
+        gap = int(0.2 * dpi)
+        card_width = (page_width - 2 * margin - (columns - 1) * gap) // columns
+        card_height = (page_height - 2 * margin - (rows - 1) * gap) // rows
+        qr_size = min(card_height - 2 * gap, card_width // 2)
+        
+        title_font = _card_font(int(0.16 * dpi))
+        text_font = _card_font(int(0.12 * dpi))
+        
+        pages = []
+        per_page = columns * rows
+        for page_start in range(0, max(len(students), 1), per_page):
+            page = Image.new("1", (page_width, page_height), 1)
+            draw = ImageDraw.Draw(page)
+            for slot, student in enumerate(students[page_start:page_start + per_page]):
+                x = margin + (slot % columns) * (card_width + gap)
+                y = margin + (slot // columns) * (card_height + gap)
+                draw.rounded_rectangle([x, y, x + card_width, y + card_height], radius=gap // 2, outline=0, width=2)
+                
+                qr_path = self.get_qr_code_path(student["roll_no"], branch_code, year)
+                if os.path.exists(qr_path):
+                    with Image.open(qr_path) as qr_image:
+                        qr_image = qr_image.convert("1").resize((qr_size, qr_size), Image.NEAREST)
+                        page.paste(qr_image, (x + gap, y + (card_height - qr_size) // 2))
+                
+                text_x = x + 2 * gap + qr_size
+                text_y = y + card_height // 2 - int(0.3 * dpi)
+                draw.text((text_x, text_y), _fit_text(draw, str(student["name"]), title_font, x + card_width - gap - text_x),
+                          fill=0, font=title_font)
+                draw.text((text_x, text_y + int(0.3 * dpi)), str(student["roll_no"]), fill=0, font=text_font)
+                draw.text((text_x, text_y + int(0.5 * dpi)), f"{branch_code} · {year}", fill=0, font=text_font)
+            pages.append(page)
+        
+        buffer = io.BytesIO()
+        pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=dpi)
+        return buffer.getvalue()
     
     def decode_qr_code(self, image_bytes: bytes) -> str:
         """Decode QR code from image bytes"""
+        return self.decode_qr_code_timed(image_bytes)[0]
+    
+    def decode_qr_code_timed(self, image_bytes: bytes) -> Tuple[Optional[str], Dict[str, float]]:
+        """Decode the first QR code in a photo, returning it with per-stage timings in ms.
+        
+        Phone photos are 3-12 MP, far more than a QR code needs, so the fast
+        path works on a reduced grayscale decode (JPEGs are scaled down while
+        being decoded): OpenCV's finder-pattern detector locates the code and
+        zbar only reads that crop. Only when that fails is the photo decoded
+        at full resolution and read again.
+        """
+        timings = {}
+        stage_start = time.perf_counter()
+        
+        def lap(stage: str):
+            nonlocal stage_start
+            now = time.perf_counter()
+            timings[stage] = round((now - stage_start) * 1000, 2)
+            stage_start = now
+        
         try:
-            # Convert bytes to image
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            data = np.frombuffer(image_bytes, np.uint8)
+            factor = self._reduction_factor(image_bytes)
+            gray = cv2.imdecode(data, REDUCED_GRAYSCALE[factor])
+            lap("decode")
             
-            if img is None:
-                return None
+            if gray is None:
+                return None, timings
             
-            # Convert to PIL Image for pyzbar
-            img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            region = _qr_region(gray)
+            lap("locate")
             
-            # Decode QR codes
-            decoded_objects = pyzbar.decode(img_pil)
+            if region:
+                x0, y0, x1, y1 = region
+                code = _decode_first(gray[y0:y1, x0:x1])
+                lap("read_roi")
+            else:
+                # The detector misses some codes zbar still reads
+                code = _decode_first(gray)
+                lap("read_reduced")
+            if code or factor == 1:
+                return code, timings
             
-            if decoded_objects:
-                # Return the first QR code data
-                return decoded_objects[0].data.decode('utf-8')
-            
-            return None
+            # Fallback: modules too small at the reduced size, retry at full resolution
+            gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            lap("decode_full")
+            if region:
+                x0, y0, x1, y1 = (value * factor for value in region)
+                code = _decode_first(gray[y0:y1, x0:x1])
+            if not code:
+                code = _decode_first(gray)
+            lap("read_full")
+            return code, timings
             
         except Exception as e:
             print(f"Error decoding QR code: {e}")
-            return None
+            return None, timings
+    
+    def _reduction_factor(self, image_bytes: bytes) -> int:
+        """Largest of 1, 2, 4, 8 that keeps the photo's long side at or above decode_side"""
+        try:
+            # Only the header is parsed here, not the pixels
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                long_side = max(img.size)
+        except Exception:
+            return 1
+        factor = 1
+        while factor < 8 and long_side / (factor * 2) >= self.decode_side:
+            factor *= 2
+        return factor
+    
+    def decode_qr_codes(self, image_bytes: bytes) -> List[str]:
+        """Every distinct QR code in a frame, in the order zbar finds them (scanning stations).
+    
+        The frame is decoded straight to 8-bit grayscale and handed to zbar as
+        is, without the BGR -> RGB -> PIL conversions of decode_qr_code, and
+        only QR symbols are searched for.
+        """
+        try:
+            gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                return []
+    
+            codes = []
+            for decoded in pyzbar.decode(gray, symbols=[ZBarSymbol.QRCODE]):
+                code = decoded.data.decode('utf-8', errors='replace').strip()
+                if code and code not in codes:
+                    codes.append(code)
+            return codes
+    
+        except Exception as e:
+            print(f"Error decoding QR codes: {e}")
+            return []
+    
+    def resolve_attendance_code(self, code: str, session: Dict, single_use: bool = True) -> str:
+        """Roll number a scanned code marks present in this session, else InvalidQRToken.
+        
+        Signed tokens are verified in memory (signature, expiry, branch-year and
+        session); single_use rejects a display code that was already redeemed.
+        Bare roll numbers are only accepted while QR_ACCEPT_PLAIN_ROLL allows
+        it, and every one is logged.
+        """
+        code = code.strip()
+        session_id, branch_code, year = session['session_id'], str(session['branch_code']), str(session['year'])
+        try:
+            token = self.tokens.verify(code, session_id)
+        except InvalidQRToken:
+            if "." not in code and self._plain_roll_accepted():
+                print(f"⚠️ Accepted plain roll number QR code {code.upper()} in session {session_id}")
+                return code.upper()
+            raise
+        
+        if self.require_display_code and not token.session_tag:
+            raise InvalidQRToken("ID card codes are not accepted, show the session code on your phone")
+        if (token.branch_code, token.year) != (branch_code, year):
+            raise InvalidQRToken(f"Student {token.roll_no} is not in {branch_code}/{year}")
+        if single_use and token.session_tag and not self.replay_guard.first_use(token):
+            raise InvalidQRToken("QR code was already used, show the current one")
+        return token.roll_no
+    
+    def _plain_roll_accepted(self) -> bool:
+        if not self.accept_plain_roll:
+            return False
+        return self.plain_roll_until is None or date.today().isoformat() <= self.plain_roll_until
     
     def get_qr_code_path(self, roll_no: str, branch_code: str, year: str) -> str:
         """Get QR code file path for a student"""
         return os.path.join("data", "branches", branch_code, year, "qrcodes", f"{roll_no}.png")
+
+def _card_font(size: int):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1 has only the small bitmap font
+            return ImageFont.load_default()
+
+def _fit_text(draw: ImageDraw.ImageDraw, text: str, font, max_width: int) -> str:
+    """text, shortened with an ellipsis until it fits max_width pixels"""
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > max_width:
+        text = text[:-1]
+    return text + "…"
@@ -0,0 +1,164 @@
+## services/qr_token.py
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+TOKEN_PREFIX = "SA1"
+
+class InvalidQRToken(ValueError):
+    """A scanned code that is not a valid, current attendance token"""
+
+class QRToken(NamedTuple):
+    roll_no: str
+    branch_code: str
+    year: str
+    expires: int  # unix time
+    session_tag: str  # empty for ID card tokens, else the session a display code is bound to
+    signature: str
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _mac(key: bytes, body: str) -> str:
+    # 128-bit truncated HMAC-SHA256 keeps the QR code small
+    return _b64(hmac.new(key, body.encode(), hashlib.sha256).digest()[:16])
+
+def session_tag(session_id: str) -> str:
+    """Short, fixed-length stand-in for a session ID inside display codes"""
+    return _b64(hashlib.sha256(session_id.encode()).digest()[:6])
+
+def display_code(display_key: str, roll_no: str, branch_code: str, year: str, session_id: str,
+                 period: int, now: Optional[float] = None) -> str:
+    """The display code for the current ``period``-second window.
+
+    Shown as a QR code on the student's phone and recomputed every period
+    from the display key, without calling the server.
+    """
+    now = time.time() if now is None else now
+    expires = (int(now) // period + 1) * period
+    body = f"{TOKEN_PREFIX}.{roll_no}.{branch_code}.{year}.{expires:x}.{session_tag(session_id)}"
+    return f"{body}.{_mac(display_key.encode(), body)}"
+
+def load_secret(base_dir: str = "data") -> bytes:
+    """QR_TOKEN_SECRET, or a random key kept in data/qr_token.key so every worker and restart shares it"""
+    secret = os.environ.get("QR_TOKEN_SECRET")
+    if secret:
+        return secret.encode()
+
+    path = os.path.join(base_dir, "qr_token.key")
+    if not os.path.exists(path):
+        os.makedirs(base_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(secrets.token_hex(32).encode())
+        try:
+            # link() fails if another worker created the key first; theirs is kept
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+def card_token_expiry(code: str) -> Optional[int]:
+    """Expiry (unix time) of an ID card token, None for anything else; the signature is not checked"""
+    parts = code.split(".")
+    if len(parts) != 7 or parts[0] != TOKEN_PREFIX or parts[5]:
+        return None
+    try:
+        return int(parts[4], 16)
+    except ValueError:
+        return None
+
+
+class QRTokenSigner:
+    """Signs and verifies attendance QR tokens in memory.
+
+    Tokens read ``SA1.<roll_no>.<branch>.<year>.<expiry hex>.<session tag>.<mac>``.
+    ID card tokens have no session tag and are signed with the server
+    secret. Display codes carry the session tag and are signed with a
+    display key derived from the secret for one (session, student), so a
+    client holding the key can rotate codes itself while codes stay
+    useless for other sessions and other students.
+    """
+
+    def __init__(self, secret: bytes, display_period: int = 30):
+        self.secret = secret
+        self.display_period = display_period
+        # Clock skew and scan latency allowed around a display code's window
+        self.grace_seconds = display_period / 2
+
+    def issue_card_token(self, roll_no: str, branch_code: str, year: str, ttl_seconds: int) -> str:
+        """Token printed on a student's ID card, valid for ttl_seconds"""
+        expires = int(time.time()) + ttl_seconds
+        body = f"{TOKEN_PREFIX}.{roll_no}.{branch_code}.{year}.{expires:x}."
+        return f"{body}.{_mac(self.secret, body)}"
+
+    def display_key(self, session_id: str, roll_no: str) -> str:
+        """Key a student's app rotates display codes with for one session"""
+        return _b64(hmac.new(self.secret, f"display|{session_id}|{roll_no}".encode(), hashlib.sha256).digest())
+
+    def verify(self, code: str, session_id: str, now: Optional[float] = None) -> QRToken:
+        """The token in ``code`` if it is authentic and current for this session, else InvalidQRToken"""
+        now = time.time() if now is None else now
+        parts = code.split(".")
+        if len(parts) != 7 or parts[0] != TOKEN_PREFIX:
+            raise InvalidQRToken("Not an attendance QR code")
+        try:
+            token = QRToken(parts[1], parts[2], parts[3], int(parts[4], 16), parts[5], parts[6])
+        except ValueError:
+            raise InvalidQRToken("Not an attendance QR code")
+
+        body = code[:-len(token.signature) - 1]
+        if token.session_tag:
+            if token.session_tag != session_tag(session_id):
+                raise InvalidQRToken("QR code belongs to a different session")
+            key = self.display_key(session_id, token.roll_no).encode()
+        else:
+            key = self.secret
+        if not hmac.compare_digest(token.signature, _mac(key, body)):
+            raise InvalidQRToken("QR code signature is not valid")
+
+        if token.session_tag:
+            # A display code is only good for its own window; the key holder could
+            # otherwise sign codes that stay valid for the whole session
+            if token.expires < now - self.grace_seconds:
+                raise InvalidQRToken("QR code has expired, show the current one")
+            if token.expires > now + self.display_period + self.grace_seconds:
+                raise InvalidQRToken("QR code is not valid yet, check the phone's clock")
+        elif token.expires < now:
+            raise InvalidQRToken("QR code has expired, ask for a new ID card")
+        return token
+
+
+class ReplayGuard:
+    """Display codes already redeemed, remembered until they expire.
+
+    Lives in process memory, so with several API workers a code is
+    single-use per worker.
+    """
+
+    def __init__(self, retention_seconds: float = 60):
+        # Kept a while past expiry, since verification allows some grace
+        self.retention_seconds = retention_seconds
+        self._used: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def first_use(self, token: QRToken, now: Optional[float] = None) -> bool:
+        """Record the token as used, False if it was used before"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if len(self._used) > 1024:
+                cutoff = now - self.retention_seconds
+                self._used = {signature: expires for signature, expires in self._used.items() if expires >= cutoff}
+            if token.signature in self._used:
+                return False
+            self._used[token.signature] = token.expires
+            return True
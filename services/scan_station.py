@@ -0,0 +1,78 @@
+## services/scan_station.py
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+class JPEGFrameSplitter:
+    """Splits a byte stream of back-to-back JPEG images into frames.
+
+    Works on raw concatenated JPEGs as well as multipart MJPEG bodies
+    (multipart/x-mixed-replace), since part headers and boundaries between
+    the SOI/EOI markers are skipped. Frames are assumed not to embed JPEG
+    thumbnails, which camera streams don't.
+    """
+
+    SOI = b"\xff\xd8"
+    EOI = b"\xff\xd9"
+
+    def __init__(self, max_frame_bytes: int = 8 * 1024 * 1024):
+        self.max_frame_bytes = max_frame_bytes
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add received bytes, returns the frames completed by them"""
+        self._buffer += chunk
+        frames = []
+        while True:
+            start = self._buffer.find(self.SOI)
+            if start < 0:
+                # Keep a trailing 0xff, it may be the first half of the next SOI
+                del self._buffer[:-1]
+                break
+            end = self._buffer.find(self.EOI, start + 2)
+            if end < 0:
+                del self._buffer[:start]
+                if len(self._buffer) > self.max_frame_bytes:
+                    # Not a JPEG stream or a frame too big to be a camera frame, resync on the next SOI
+                    del self._buffer[:2]
+                break
+            frames.append(bytes(self._buffer[start:end + 2]))
+            del self._buffer[:end + 2]
+        return frames
+
+
+class ScanDeduplicator:
+    """Roll numbers already scanned per session within the last ``window_seconds``.
+
+    A station sees the same student in many consecutive frames; only the
+    first sighting in a window is passed on to be marked.
+    """
+
+    def __init__(self, window_seconds: float = 60):
+        self.window_seconds = window_seconds
+        self._seen: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def filter_new(self, session_id: str, roll_nos: List[str], now: Optional[float] = None) -> List[str]:
+        """The roll numbers not seen in this session within the window, recording them as seen"""
+        now = time.monotonic() if now is None else now
+        new = []
+        with self._lock:
+            seen = self._seen.setdefault(session_id, {})
+            for roll_no in roll_nos:
+                last = seen.get(roll_no)
+                if last is None or now - last >= self.window_seconds:
+                    new.append(roll_no)
+                seen[roll_no] = now
+            self._prune(now)
+        return new
+
+    def _prune(self, now: float):
+        for session_id in list(self._seen):
+            seen = self._seen[session_id]
+            expired = [roll_no for roll_no, last in seen.items() if now - last >= self.window_seconds]
+            for roll_no in expired:
+                del seen[roll_no]
+            if not seen:
+                del self._seen[session_id]
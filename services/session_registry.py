@@ -0,0 +1,85 @@
+## services/session_registry.py
+
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+def parse_session_id(session_id: str) -> Optional[Tuple[str, str]]:
+    """(branch_code, year) from SES_YYYYMMDD_HHMMSS_BRANCH_YEAR, or None"""
+    parts = session_id.split('_')
+    if len(parts) < 5:
+        return None
+    return parts[3], parts[4]
+
+
+class ActiveSessionRegistry:
+    """In-process cache of active sessions, keyed by session_id and (branch, year).
+
+    Each branch-year is loaded once through ``loader`` and then served from
+    memory. Before a lookup the registry compares ``signature(branch, year)``
+    (e.g. the stat of sessions.csv) with the one it loaded, so changes
+    written by other workers are picked up with a single stat call.
+    ``invalidate`` is called after this process starts or closes a session.
+    """
+
+    def __init__(self, loader: Callable[[str, str], List[Dict]], signature: Callable[[str, str], Any]):
+        self.loader = loader
+        self.signature = signature
+        self._by_id: Dict[str, Dict] = {}
+        self._deadlines: Dict[str, datetime] = {}
+        self._by_branch: Dict[Tuple[str, str], List[str]] = {}
+        self._signatures: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+
+    def _ensure(self, branch_code: str, year: str):
+        key = (branch_code, year)
+        signature = self.signature(branch_code, year)
+        if key in self._signatures and self._signatures[key] == signature:
+            return
+
+        sessions = self.loader(branch_code, year)
+        with self._lock:
+            for session_id in self._by_branch.pop(key, []):
+                self._by_id.pop(session_id, None)
+                self._deadlines.pop(session_id, None)
+
+            ids = []
+            for session in sessions:
+                session_id = session['session_id']
+                self._by_id[session_id] = session
+                self._deadlines[session_id] = datetime.fromisoformat(str(session['deadline_time']))
+                ids.append(session_id)
+            self._by_branch[key] = ids
+            self._signatures[key] = signature
+
+    def invalidate(self, branch_code: str, year: str):
+        """Force a reload of one branch-year on its next lookup"""
+        with self._lock:
+            self._signatures.pop((branch_code, year), None)
+
+    def get_active(self, branch_code: str, year: str) -> Optional[Dict]:
+        """The branch-year's active session whose deadline hasn't passed"""
+        self._ensure(branch_code, year)
+        now = datetime.now()
+        for session_id in self._by_branch.get((branch_code, year), ()):
+            if now < self._deadlines.get(session_id, now):
+                return self._by_id.get(session_id)
+        return None
+
+    def get_active_by_id(self, session_id: str) -> Optional[Dict]:
+        """The session if it is active and not past its deadline"""
+        session = self._by_id.get(session_id)
+        if session is not None:
+            branch_year = (str(session['branch_code']), str(session['year']))
+        else:
+            # Not seen yet, e.g. started by another worker
+            branch_year = parse_session_id(session_id)
+            if branch_year is None:
+                return None
+
+        self._ensure(*branch_year)
+        session = self._by_id.get(session_id)
+        deadline = self._deadlines.get(session_id)
+        if session is None or deadline is None or datetime.now() >= deadline:
+            return None
+        return session
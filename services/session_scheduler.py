@@ -0,0 +1,114 @@
+## services/session_scheduler.py
+
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+class SessionExpiryScheduler:
+    """Closes sessions at their deadline_time from a background asyncio task.
+
+    Deadlines sit in a min-heap; the task sleeps until the earliest one (or
+    until ``schedule`` pushes an earlier deadline) and then runs the close,
+    including absent marking, in an executor. On start, and every
+    ``resync_seconds`` after that, the heap is refilled from the stored
+    sessions. That covers restarts and sessions started by other workers.
+    """
+
+    def __init__(self, session_service, resync_seconds: float = 60, executor=None):
+        self.session_service = session_service
+        self.resync_seconds = resync_seconds
+        self.executor = executor
+        self._heap: List[Tuple[datetime, str, str, str]] = []
+        self._scheduled = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the scheduler loop on the running event loop"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, session: Dict):
+        """Add an active session's deadline to the heap (safe to call from any thread)"""
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if self._loop is not None and not on_loop:
+            # e.g. a sync endpoint running in the threadpool
+            self._loop.call_soon_threadsafe(self.schedule, session)
+            return
+
+        session_id = session["session_id"]
+        if session_id in self._scheduled:
+            return
+
+        deadline = datetime.fromisoformat(str(session["deadline_time"]))
+        heapq.heappush(self._heap, (deadline, session_id, str(session["branch_code"]), str(session["year"])))
+        self._scheduled.add(session_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _resync(self):
+        loop = asyncio.get_running_loop()
+        try:
+            sessions = await loop.run_in_executor(self.executor, self.session_service.list_active_sessions)
+        except Exception as e:
+            print(f"⚠️ Session scheduler could not load sessions: {e}")
+            return
+        for session in sessions:
+            self.schedule(session)
+
+    async def _expire(self, session_id: str, branch_code: str, year: str):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.executor, self.session_service.close_session, session_id, branch_code, year, True
+            )
+        except Exception as e:
+            print(f"❌ Failed to close expired session {session_id}: {e}")
+
+    async def _run(self):
+        await self._resync()
+        last_sync = time.monotonic()
+
+        while True:
+            self._wakeup.clear()
+            timeout = self.resync_seconds - (time.monotonic() - last_sync)
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            now = datetime.now()
+            while self._heap and self._heap[0][0] <= now:
+                _, session_id, branch_code, year = heapq.heappop(self._heap)
+                self._scheduled.discard(session_id)
+                await self._expire(session_id, branch_code, year)
+
+            if time.monotonic() - last_sync >= self.resync_seconds:
+                await self._resync()
+                last_sync = time.monotonic()
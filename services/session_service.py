@@ -2,12 +2,22 @@
 
 import pandas as pd
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
+from services.attendance_store import get_attendance_store
+from services.database import get_database
+from services.event_bus import event_bus
+from services.file_lock import file_signature, update_csv
+from services.session_registry import ActiveSessionRegistry
 
 class SessionService:
     def __init__(self):
         self.base_dir = "data"
+        # SQLite database when STORAGE_BACKEND=sqlite, otherwise the CSV files are used
+        self.db = get_database(self.base_dir)
+        # Active sessions served from memory, reloaded when the sessions file/database changes
+        self.registry = ActiveSessionRegistry(self._load_active_sessions, self._sessions_signature)
     
     def start_session(self, teacher_id: str, branch_code: str, year: str, duration_minutes: int = 60) -> str:
         """Start a new attendance session"""
@@ -24,12 +34,20 @@ class SessionService:
         deadline_time = start_time + timedelta(minutes=duration_minutes)
         
         # Save session
-        sessions_path = os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv")
+        if self.db:
+            conn = self.db.connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, teacher_id, branch_code, year, start_time, deadline_time, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'active')",
+                    (session_id, teacher_id, branch_code, year, start_time.isoformat(), deadline_time.isoformat())
+                )
+                self.db.bump_version(conn, "sessions", branch_code, year)
+            self.registry.invalidate(branch_code, year)
+            self._publish_started(branch_code, year)
+            return session_id
         
-        if os.path.exists(sessions_path):
-            df = pd.read_csv(sessions_path)
-        else:
-            df = pd.DataFrame(columns=["session_id", "teacher_id", "branch_code", "year", "start_time", "deadline_time", "status"])
+        sessions_path = os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv")
         
         new_session = {
             "session_id": session_id,
@@ -41,92 +59,180 @@ class SessionService:
             "status": "active"
         }
         
-        df = pd.concat([df, pd.DataFrame([new_session])], ignore_index=True)
-        df.to_csv(sessions_path, index=False)
+        columns = ["session_id", "teacher_id", "branch_code", "year", "start_time", "deadline_time", "status"]
+        update_csv(sessions_path, lambda df: pd.concat([df, pd.DataFrame([new_session])], ignore_index=True), columns)
+        self.registry.invalidate(branch_code, year)
+        self._publish_started(branch_code, year)
         
         return session_id
     
+    def _publish_started(self, branch_code: str, year: str):
+        session = self.get_active_session(branch_code, year)
+        if session:
+            event_bus.publish(branch_code, year, "session_started", session)
+    
     def get_active_session(self, branch_code: str, year: str) -> Optional[Dict]:
         """Get active session for a branch-year"""
-        sessions_path = os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv")
-        
-        if not os.path.exists(sessions_path):
-            return None
-        
-        df = pd.read_csv(sessions_path)
-        active_sessions = df[df['status'] == 'active']
-        
-        if active_sessions.empty:
-            return None
-        
-        # Check if session is still valid (not expired)
-        for _, session in active_sessions.iterrows():
-            deadline = datetime.fromisoformat(session['deadline_time'])
-            if datetime.now() < deadline:
-                return session.to_dict()
-            else:
-                # Session expired, close it
-                self.close_session(session['session_id'], branch_code, year, auto_close=True)
+        return self.registry.get_active(branch_code, year)
+    
+    def get_active_session_by_id(self, session_id: str) -> Optional[Dict]:
+        """The session if it is currently active, an O(1) lookup for per-scan validation"""
+        return self.registry.get_active_by_id(session_id)
+    
+    def _sessions_signature(self, branch_code: str, year: str):
+        if self.db:
+            # Bumped only by session writes, attendance commits don't force a reload
+            return self.db.version("sessions", branch_code, year)
+        return file_signature(os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv"))
+    
+    def _load_active_sessions(self, branch_code: str, year: str) -> List[Dict]:
+        """Sessions with status active for a branch-year, read from storage"""
+        if self.db:
+            active_sessions = self.db.query(
+                "SELECT session_id, teacher_id, branch_code, year, start_time, deadline_time, status FROM sessions "
+                "WHERE branch_code = ? AND year = ? AND status = 'active'",
+                (branch_code, year)
+            )
+        else:
+            sessions_path = os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv")
+            
+            if not os.path.exists(sessions_path):
+                return []
+            
+            df = pd.read_csv(sessions_path, dtype=str)
+            active_sessions = df[df['status'] == 'active'].to_dict('records')
         
-        return None
+        # Sessions past their deadline are filtered at lookup time, before the
+        # expiry scheduler has closed them; closing is never done on this read path
+        return active_sessions
+    
+    def list_active_sessions(self) -> List[Dict]:
+        """Every session still marked active, across all branches and years"""
+        if self.db:
+            return self.db.query(
+                "SELECT session_id, teacher_id, branch_code, year, start_time, deadline_time, status FROM sessions "
+                "WHERE status = 'active' ORDER BY deadline_time"
+            )
+        
+        sessions = []
+        branches_dir = os.path.join(self.base_dir, "branches")
+        if not os.path.isdir(branches_dir):
+            return sessions
+        for branch_code in sorted(os.listdir(branches_dir)):
+            branch_dir = os.path.join(self.base_dir, "branches", branch_code)
+            if not os.path.isdir(branch_dir):
+                continue
+            for year in sorted(os.listdir(branch_dir)):
+                sessions_path = os.path.join(branch_dir, year, "sessions.csv")
+                if os.path.exists(sessions_path):
+                    df = pd.read_csv(sessions_path, dtype=str)
+                    sessions.extend(df[df['status'] == 'active'].to_dict('records'))
+        return sessions
     
-    def close_session(self, session_id: str, branch_code: str, year: str, auto_close: bool = False):
-        """Close a session and mark absent students"""
+    def close_session(self, session_id: str, branch_code: str, year: str, auto_close: bool = False) -> Dict:
+        """Close a session and mark absent students, returns what was done and how long it took"""
+        start = time.perf_counter()
+        absent_marked = 0
         sessions_path = os.path.join(self.base_dir, "branches", branch_code, year, "sessions.csv")
-        
-        if os.path.exists(sessions_path):
-            df = pd.read_csv(sessions_path)
-            df.loc[df['session_id'] == session_id, 'status'] = 'closed'
-            df.to_csv(sessions_path, index=False)
+        # Start times of the closed session, its absences are dated by it rather than by today
+        start_times = []
+        
+        if self.db or os.path.exists(sessions_path):
+            # Auto-close only acts on sessions that are still active, so a session the
+            # teacher closed (or another worker expired) is not processed twice
+            if self.db:
+                sql = "UPDATE sessions SET status = 'closed' WHERE session_id = ?"
+                conn = self.db.connection()
+                with conn:
+                    was_active = conn.execute(sql + " AND status = 'active'" if auto_close else sql,
+                                              (session_id,)).rowcount > 0
+                    if was_active:
+                        self.db.bump_version(conn, "sessions", branch_code, year)
+                row = self.db.query_one("SELECT start_time FROM sessions WHERE session_id = ?", (session_id,))
+                if row:
+                    start_times.append(row["start_time"])
+            else:
+                def set_closed(df):
+                    rows = df['session_id'] == session_id
+                    if auto_close:
+                        rows &= df['status'] == 'active'
+                    if not rows.any():
+                        return None
+                    df.loc[rows, 'status'] = 'closed'
+                    start_times.extend(df.loc[rows, 'start_time'].dropna())
+                    return df
+                was_active = update_csv(sessions_path, set_closed) is not None
+            
+            self.registry.invalidate(branch_code, year)
+            
+            if auto_close and not was_active:
+                return {"session_id": session_id, "absent_marked": 0, "close_ms": 0.0}
             
             if auto_close:
                 # Mark all unmarked students as absent
-                self._mark_absent_students(branch_code, year)
+                session_date = str(start_times[0])[:10] if start_times else datetime.now().strftime("%Y-%m-%d")
+                absent_marked = self._mark_absent_students(branch_code, year, session_id, session_date)
+            
+            # Session is over, fold the event log into the columnar file and attendance.csv
+            get_attendance_store(self.base_dir, branch_code, year).compact()
+        
+        close_ms = (time.perf_counter() - start) * 1000
+        print(f"🔒 Closed session {session_id}: {absent_marked} marked absent in {close_ms:.0f}ms")
+        result = {"session_id": session_id, "absent_marked": absent_marked, "close_ms": round(close_ms, 1)}
+        event_bus.publish(branch_code, year, "session_closed", {**result, "auto_close": auto_close})
+        return result
     
-    def _mark_absent_students(self, branch_code: str, year: str):
-        """Mark students who didn't attend as absent"""
+    def _mark_absent_students(self, branch_code: str, year: str, session_id: str, session_date: str) -> int:
+        """Mark students who didn't attend the session as absent on the session's date, returns how many"""
+        store = get_attendance_store(self.base_dir, branch_code, year)
+        
+        # One set difference against the roster, then one commit for all absences and their stats.
+        # Marks migrated from the wide CSV have no session, one on the session's date covers it
+        unmarked = store.unmarked_students(session_id, session_date)
+        return store.mark_many(unmarked, session_date, "Absent", session_id)
+    
+    def get_session_attendance(self, session_id: str, branch_code: str, year: str) -> List[Dict]:
+        """Get attendance for a specific session"""
         from .data_service import DataService
         data_service = DataService()
         
-        # Get all students
-        students = data_service.get_students(branch_code, year)
-        today = datetime.now().strftime("%Y-%m-%d")
+        store = data_service.get_attendance_store(branch_code, year)
+        session_marks = store.get_session_marks(session_id)
         
-        attendance_path = os.path.join(self.base_dir, "branches", branch_code, year, "attendance.csv")
+        # Nothing recorded for this session yet
+        if not session_marks:
+            return []
         
-        if os.path.exists(attendance_path):
-            df = pd.read_csv(attendance_path)
-            
-            # Add today's column if it doesn't exist
-            if today not in df.columns:
-                df[today] = "Absent"
-            
-            # Mark all students who don't have attendance today as absent
-            for student in students:
-                roll_no = student['roll_no']
-                if roll_no in df['roll_no'].values:
-                    current_status = df.loc[df['roll_no'] == roll_no, today].iloc[0]
-                    if pd.isna(current_status) or current_status == "":
-                        data_service.mark_attendance(roll_no, branch_code, year, "Absent")
-            
-            df.to_csv(attendance_path, index=False)
+        return [
+            {"roll_no": roll_no, "name": name, "status": session_marks.get(roll_no, "Absent")}
+            for roll_no, name in store.names.items()
+        ]
     
-    def get_session_attendance(self, session_id: str, branch_code: str, year: str) -> List[Dict]:
-        """Get attendance for a specific session"""
-        from .data_service import DataService
-        data_service = DataService()
+    def get_live_snapshot(self, branch_code: str, year: str) -> Dict:
+        """Active session (or None) and the full roster with current statuses, the starting state of a live feed"""
+        session = self.get_active_session(branch_code, year)
+        attendance = []
+        if session:
+            store = get_attendance_store(self.base_dir, branch_code, year)
+            session_marks = store.get_session_marks(session['session_id'])
+            attendance = [
+                {"roll_no": roll_no, "name": name, "status": session_marks.get(roll_no, "Absent")}
+                for roll_no, name in store.names.items()
+            ]
+        return {"session": session, "attendance": attendance}
+    
+    def get_new_marks(self, branch_code: str, year: str, session_id: str, known: Dict[str, str]) -> List[Dict]:
+        """Mark events for the session's statuses that differ from ``known``, which is updated in place.
         
+        Marks taken by other API workers never reach this process's event bus;
+        a live feed polls this to pick them up from the shared attendance store.
+        """
+        store = get_attendance_store(self.base_dir, branch_code, year)
         today = datetime.now().strftime("%Y-%m-%d")
-        attendance_data = data_service.get_attendance_data(branch_code, year)
-        
-        # Filter for today's attendance
-        result = []
-        for record in attendance_data:
-            if today in record:
-                result.append({
-                    "roll_no": record["roll_no"],
-                    "name": record["name"],
-                    "status": record.get(today, "Absent")
-                })
-        
-        return result
\ No newline at end of file
+        events = []
+        for roll_no, status in store.get_session_marks(session_id).items():
+            if known.get(roll_no) != status:
+                known[roll_no] = status
+                events.append({"session_id": session_id, "roll_no": roll_no, "name": store.names.get(roll_no, ""),
+                               "status": status, "date": today})
+        return events
\ No newline at end of file
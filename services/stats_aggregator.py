@@ -0,0 +1,97 @@
+## services/stats_aggregator.py
+
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+STATS_COLUMNS = ["roll_no", "name", "present_days", "absent_days", "total_days", "attendance_pct", "last_present", "last_absent"]
+
+class StatsAggregator:
+    """Running per-student attendance counters.
+
+    Counters change by the difference between a record's old and new status,
+    so re-marking the same (roll_no, date, session_id) never double-counts.
+    ``rebuild`` recomputes everything from raw records in one vectorized pass.
+    """
+
+    def __init__(self):
+        # roll_no -> [present, absent, last_present, last_absent]
+        self.counts: Dict[str, list] = {}
+        # Students whose last_present/last_absent may have moved backwards
+        self._stale_last = set()
+
+    def rebuild(self, marks: Dict[Tuple[str, str, str], str]):
+        """Recompute all counters from (roll_no, date, session_id) -> status"""
+        self.counts = {}
+        self._stale_last = set()
+        if not marks:
+            return
+
+        keys = list(marks.keys())
+        df = pd.DataFrame({
+            "roll_no": [k[0] for k in keys],
+            "date": [k[1] for k in keys],
+            "present": [status == "Present" for status in marks.values()],
+        })
+
+        grouped = df.groupby("roll_no", sort=False)
+        present = grouped["present"].sum()
+        total = grouped.size()
+        last_present = df[df["present"]].groupby("roll_no")["date"].max()
+        last_absent = df[~df["present"]].groupby("roll_no")["date"].max()
+
+        summary = pd.DataFrame({"present": present, "total": total})
+        summary["last_present"] = last_present
+        summary["last_absent"] = last_absent
+        summary = summary.fillna({"last_present": "", "last_absent": ""})
+
+        for roll_no, p, t, lp, la in summary.itertuples(name=None):
+            self.counts[roll_no] = [int(p), int(t - p), lp, la]
+
+    def apply(self, roll_no: str, date: str, old_status: Optional[str], new_status: str):
+        """Account for one record changing from old_status (None if new) to new_status"""
+        if old_status == new_status:
+            return
+
+        counts = self.counts.setdefault(roll_no, [0, 0, "", ""])
+        if old_status is not None:
+            slot = 0 if old_status == "Present" else 1
+            counts[slot] -= 1
+            if counts[slot + 2] == date:
+                self._stale_last.add(roll_no)
+
+        slot = 0 if new_status == "Present" else 1
+        counts[slot] += 1
+        counts[slot + 2] = max(counts[slot + 2], date)
+
+    def to_records(self, names: Dict[str, str], marks: Dict[Tuple[str, str, str], str]) -> List[Dict]:
+        """Rows in the stats.csv layout for every student in names"""
+        if self._stale_last:
+            self._refresh_last_dates(marks)
+
+        rows = []
+        for roll_no, name in names.items():
+            present, absent, last_present, last_absent = self.counts.get(roll_no, (0, 0, "", ""))
+            total = present + absent
+            rows.append({
+                "roll_no": roll_no,
+                "name": name,
+                "present_days": present,
+                "absent_days": absent,
+                "total_days": total,
+                "attendance_pct": (present / total) * 100 if total > 0 else 0.0,
+                "last_present": last_present,
+                "last_absent": last_absent
+            })
+        return rows
+
+    def _refresh_last_dates(self, marks: Dict[Tuple[str, str, str], str]):
+        stale, self._stale_last = self._stale_last, set()
+        last = {roll_no: ["", ""] for roll_no in stale}
+        for (roll_no, date, _), status in marks.items():
+            if roll_no in last:
+                slot = 0 if status == "Present" else 1
+                last[roll_no][slot] = max(last[roll_no][slot], date)
+        for roll_no, (last_present, last_absent) in last.items():
+            counts = self.counts.get(roll_no)
+            if counts is not None:
+                counts[2], counts[3] = last_present, last_absent
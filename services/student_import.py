@@ -0,0 +1,112 @@
+## services/student_import.py
+
+import io
+import os
+import zipfile
+import pandas as pd
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+ROSTER_COLUMNS = ["roll_no", "name", "password"]
+
+class StudentImport:
+    """A roster CSV and a ZIP of face photos, validated before anything is written.
+
+    The roster needs roll_no, name and password columns and may have a
+    branch_code column (otherwise ``branch_code`` applies to every row).
+    Photos are matched by file name, e.g. ``BT26CSE001.jpg`` in any folder of
+    the archive. Every row is checked up front; rows that fail get an
+    ``error`` and are reported without being imported. Photos are read from
+    the archive only when their batch is enrolled.
+    """
+
+    def __init__(self, roster_bytes: bytes, photos_bytes: bytes, branch_code: Optional[str],
+                 known_branches: Iterable[str], registered: Callable[[str, str], Set[str]]):
+        try:
+            roster = pd.read_csv(io.BytesIO(roster_bytes), dtype=str, keep_default_na=False)
+        except (ValueError, pd.errors.ParserError) as e:
+            raise ValueError(f"Could not read roster CSV: {e}")
+        roster.columns = [str(c).strip().lower() for c in roster.columns]
+        missing = [c for c in ROSTER_COLUMNS if c not in roster.columns]
+        if missing:
+            raise ValueError(f"Roster is missing columns: {', '.join(missing)}")
+        if branch_code is None and "branch_code" not in roster.columns:
+            raise ValueError("Give a branch_code, either as a form field or as a roster column")
+
+        try:
+            self.archive = zipfile.ZipFile(io.BytesIO(photos_bytes))
+        except zipfile.BadZipFile:
+            raise ValueError("Photos must be uploaded as a ZIP archive")
+        self.photos = self._index_photos(self.archive)
+
+        known_branches = set(known_branches)
+        registered_cache: Dict[Tuple[str, str], Set[str]] = {}
+        seen = set()
+        self.rows: List[Dict] = []
+
+        for position, record in enumerate(roster.to_dict("records")):
+            roll_no = record["roll_no"].strip().upper()
+            row = {
+                "row": position + 2,  # line in the CSV, after the header
+                "roll_no": roll_no,
+                "name": record["name"].strip(),
+                "password": record["password"],
+                "branch_code": (record.get("branch_code") or branch_code or "").strip().upper(),
+                "year": "20" + roll_no[2:4] if len(roll_no) >= 4 else "",
+                "error": None
+            }
+            key = (row["branch_code"], row["year"])
+            if key not in registered_cache and row["branch_code"] in known_branches and row["year"].isdigit():
+                registered_cache[key] = registered(*key)
+
+            row["error"] = self._validate(row, known_branches, registered_cache.get(key, set()), seen)
+            seen.add(roll_no)
+            self.rows.append(row)
+
+    @staticmethod
+    def _index_photos(archive: zipfile.ZipFile) -> Dict[str, str]:
+        """roll_no -> archive member holding its photo"""
+        photos = {}
+        for info in archive.infolist():
+            base_name = os.path.basename(info.filename)
+            stem, extension = os.path.splitext(base_name)
+            if info.is_dir() or base_name.startswith(".") or extension.lower() not in PHOTO_EXTENSIONS:
+                continue
+            photos[stem.strip().upper()] = info.filename
+        return photos
+
+    def _validate(self, row: Dict, known_branches: Set[str], registered: Set[str], seen: Set[str]) -> Optional[str]:
+        # Same roll number format as single registration (BT23CSH013)
+        if len(row["roll_no"]) < 8 or not row["roll_no"].startswith("BT") or not row["year"].isdigit():
+            return "Invalid roll number format. Use BT[YY][BRANCH][XXX]"
+        if not row["name"]:
+            return "Name is empty"
+        if not row["password"]:
+            return "Password is empty"
+        if row["branch_code"] not in known_branches:
+            return f"Unknown branch {row['branch_code'] or '(none)'}"
+        if row["roll_no"] in seen:
+            return "Duplicate roll number in roster"
+        if row["roll_no"] in registered:
+            return "Student already registered"
+        if row["roll_no"] not in self.photos:
+            return "No photo for this roll number in the ZIP"
+        return None
+
+    @property
+    def valid(self) -> List[Dict]:
+        return [row for row in self.rows if row["error"] is None]
+
+    @property
+    def rejected(self) -> List[Dict]:
+        return [row for row in self.rows if row["error"] is not None]
+
+    def groups(self) -> Dict[Tuple[str, str], List[Dict]]:
+        """Valid rows per (branch_code, year), in roster order"""
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for row in self.valid:
+            groups.setdefault((row["branch_code"], row["year"]), []).append(row)
+        return groups
+
+    def read_photo(self, roll_no: str) -> bytes:
+        return self.archive.read(self.photos[roll_no])
@@ -0,0 +1,79 @@
+## services/worker_pool.py
+
+import asyncio
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+class PoolSaturated(Exception):
+    """Raised when a pool already has its maximum number of queued/running tasks"""
+
+    def __init__(self, pool_name: str, retry_after: int):
+        super().__init__(f"{pool_name} pool is busy, retry in {retry_after}s")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Thread or process pool with a bounded number of in-flight tasks.
+
+    Async request handlers await work through ``run`` (or hold a ``slot`` while
+    feeding another component such as the micro-batcher). Once ``max_pending``
+    tasks are in flight new work is rejected with PoolSaturated instead of
+    queueing without limit, so callers can answer 429 with a Retry-After.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int, use_processes: bool = False,
+                 initializer: Optional[Callable] = None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.use_processes = use_processes
+        self.pending = 0
+        # Moving average of task duration, used to estimate Retry-After
+        self.avg_task_seconds = 1.0
+
+        if use_processes:
+            # spawn: workers start clean instead of inheriting the server's threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initializer
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_task_seconds * self.pending / self.workers))
+
+    @asynccontextmanager
+    async def slot(self):
+        """Reserve one in-flight slot or raise PoolSaturated"""
+        if self.pending >= self.max_pending:
+            raise PoolSaturated(self.name, self.retry_after())
+
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pending -= 1
+            self.avg_task_seconds = 0.8 * self.avg_task_seconds + 0.2 * (time.perf_counter() - start)
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) in the pool and await its result"""
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def run_queued(self, fn: Callable, *args):
+        """Like run, but waits for a free slot instead of raising PoolSaturated (for bulk jobs)"""
+        while self.pending >= self.max_pending:
+            await asyncio.sleep(min(1.0, self.avg_task_seconds))
+        return await self.run(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
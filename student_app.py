@@ -7,6 +7,7 @@ import io
 from datetime import datetime
 import cv2
 import numpy as np
+import json
 import time
 
 # Configure Streamlit
@@ -109,24 +110,57 @@ def show_attendance_interface():
     
     st.divider()
     
-    # Check for active session
+    # Subscribe to the branch-year's live feed; its first event is the current session
     try:
-        response = requests.get(f"{API_BASE_URL}/api/sessions/{st.session_state.selected_branch}/{st.session_state.selected_year}/active")
-        
-        if response.status_code == 200:
-            session = response.json()
-            show_active_session_interface(session)
-        
-        elif response.status_code == 404:
-            show_no_session_message()
+        events = stream_session_events(st.session_state.selected_branch, st.session_state.selected_year)
+        _, snapshot = next(events)
         
+        if snapshot["session"]:
+            show_active_session_interface(snapshot["session"], events)
         else:
-            st.error("❌ Error checking for active sessions")
+            show_no_session_message(events)
             
     except requests.exceptions.RequestException:
-        st.error("❌ Could not connect to server")
+        st.error("❌ Could not connect to server, retrying...")
+        time.sleep(5)
+        st.rerun()
 
-def show_active_session_interface(session):
+def stream_session_events(branch_code, year, heartbeat=1):
+    """Yield (event, data) from the API's live session feed, ("ping", None) on each heartbeat"""
+    url = f"{API_BASE_URL}/api/sessions/{branch_code}/{year}/events"
+    with requests.get(url, params={"heartbeat": heartbeat}, stream=True, timeout=(5, heartbeat * 5)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith(":"):
+                yield "ping", None
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event:
+                yield event, json.loads(line[5:])
+                event = None
+
+def show_time_remaining(timer_area, session):
+    """Draw the countdown, returns False once the deadline has passed"""
+    try:
+        deadline = datetime.fromisoformat(session['deadline_time'])
+        now = datetime.now()
+        remaining = deadline - now
+        
+        if remaining.total_seconds() > 0:
+            hours, remainder = divmod(int(remaining.total_seconds()), 3600)
+            minutes, seconds = divmod(remainder, 60)
+            timer_area.metric("⏰ Time Remaining", f"{hours:02d}:{minutes:02d}:{seconds:02d}")
+            return True
+        else:
+            timer_area.error("⏰ Session has expired!")
+            return False
+            
+    except Exception as e:
+        timer_area.warning("⏰ Could not calculate remaining time")
+        return True
+
+def show_active_session_interface(session, events):
     """Show interface when there's an active session"""
     
     # Session info and countdown timer
@@ -137,22 +171,9 @@ def show_active_session_interface(session):
         st.info(f"📝 **Session ID:** {session['session_id']}")
     
     with col2:
-        # Calculate remaining time
-        try:
-            deadline = datetime.fromisoformat(session['deadline_time'])
-            now = datetime.now()
-            remaining = deadline - now
-            
-            if remaining.total_seconds() > 0:
-                hours, remainder = divmod(int(remaining.total_seconds()), 3600)
-                minutes, seconds = divmod(remainder, 60)
-                st.metric("⏰ Time Remaining", f"{hours:02d}:{minutes:02d}:{seconds:02d}")
-            else:
-                st.error("⏰ Session has expired!")
-                return
-                
-        except Exception as e:
-            st.warning("⏰ Could not calculate remaining time")
+        timer_area = st.empty()
+        if not show_time_remaining(timer_area, session):
+            return
     
     st.divider()
     
@@ -183,19 +204,23 @@ def show_active_session_interface(session):
             if st.button("📱 Mark Attendance via QR", type="primary", use_container_width=True):
                 mark_attendance_qr(session['session_id'], qr_image)
     
-    # Auto-refresh every 10 seconds to update timer
-    import time
-    time.sleep(10)
-    st.rerun()
+    # The countdown ticks on each heartbeat of the live feed; the page only
+    # reruns when the session closes, expires or is replaced
+    for event, data in events:
+        if event == "ping":
+            if not show_time_remaining(timer_area, session):
+                st.rerun()
+        elif event in ("snapshot", "session_started", "session_closed"):
+            st.rerun()
 
-def show_no_session_message():
+def show_no_session_message(events):
     """Show message when no active session"""
     st.warning("⚠️ No Active Session")
     st.info("There is currently no active attendance session for your selected branch and year.")
     st.markdown("""
     ### 📋 What to do:
     - **Wait for your teacher** to start an attendance session
-    - **Refresh this page** periodically to check for new sessions
+    - **Keep this page open**, it updates as soon as a session starts
     - **Contact your teacher** if you think there should be an active session
     """)
     
@@ -203,10 +228,11 @@ def show_no_session_message():
     if st.button("🔄 Refresh", type="secondary", use_container_width=False):
         st.rerun()
     
-    # Auto refresh every 30 seconds
-    st.markdown("*Page will auto-refresh every 30 seconds*")
-    time.sleep(30)
-    st.rerun()
+    # Wait on the live feed instead of polling for a session
+    st.markdown("*Waiting for your teacher to start a session...*")
+    for event, data in events:
+        if event == "session_started" or (event == "snapshot" and data["session"]):
+            st.rerun()
 
 def mark_attendance_face(session_id, face_image):
     """Handle face recognition attendance marking"""
@@ -280,6 +306,10 @@ def show_registration():
         # Camera input for face capture
         face_image = st.camera_input("Capture your face photo")
         
+        # More photos (different angles and lighting) make recognition more reliable
+        extra_photos = st.file_uploader("Additional face photos (optional)", type=["jpg", "jpeg", "png"],
+                                        accept_multiple_files=True)
+        
         submit_button = st.form_submit_button("📝 Register", use_container_width=True, type="primary")
         
         if submit_button:
@@ -291,7 +321,9 @@ def show_registration():
                 
                 try:
                     # Prepare form data
-                    files = {"face_image": ("face.jpg", face_image.getvalue(), "image/jpeg")}
+                    files = [("face_image", ("face.jpg", face_image.getvalue(), "image/jpeg"))]
+                    files += [("face_image", (photo.name, photo.getvalue(), photo.type or "image/jpeg"))
+                              for photo in extra_photos or []]
                     data = {
                         "roll_no": roll_no.upper(),
                         "name": name,
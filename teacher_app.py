@@ -3,7 +3,8 @@
 import streamlit as st
 import requests
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
 import time
 
 # Configure Streamlit
@@ -15,6 +16,10 @@ st.set_page_config(
 
 API_BASE_URL = "http://localhost:8000"
 
+# Reporting windows offered on the statistics and records tabs, in days
+PERIODS = {"Last 7 days": 7, "Last 30 days": 30, "All time": None}
+RECORDS_PAGE_SIZE = 50
+
 def main():
     st.title("👨‍🏫 Teacher Dashboard - Face Recognition Attendance System")
     
@@ -83,13 +88,18 @@ def show_dashboard():
         show_session_management()
     
     with tab2:
-        show_current_session()
+        live_view = show_current_session()
     
     with tab3:
         show_statistics()
     
     with tab4:
         show_attendance_records()
+    
+    # Runs for as long as the page is open, pushing updates into the Current Session tab.
+    # It goes last so the other tabs are fully rendered first.
+    if live_view:
+        follow_live_attendance(*live_view)
 
 def show_session_management():
     st.markdown("### 📅 Start New Attendance Session")
@@ -188,56 +198,107 @@ def show_current_session():
         
         st.divider()
         
-        # Get current attendance
-        try:
-            response = requests.get(f"{API_BASE_URL}/api/sessions/{session['session_id']}/attendance",
-                                  params={"branch_code": session["branch_code"], "year": session["year"]})
-            
-            if response.status_code == 200:
-                attendance_data = response.json()
-                
-                if attendance_data:
-                    df = pd.DataFrame(attendance_data)
-                    
-                    # Summary metrics
-                    total_students = len(df)
-                    present_students = len(df[df['status'] == 'Present'])
-                    absent_students = total_students - present_students
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Total Students", total_students)
-                    with col2:
-                        st.metric("Present", present_students, delta=f"{(present_students/total_students*100):.1f}%")
-                    with col3:
-                        st.metric("Absent", absent_students)
-                    
-                    # Attendance table
-                    st.markdown("#### 📋 Real-time Attendance")
-                    
-                    # Style the dataframe
-                    def style_attendance(val):
-                        if val == 'Present':
-                            return 'background-color: #d4edda; color: #155724'
-                        elif val == 'Absent':
-                            return 'background-color: #f8d7da; color: #721c24'
-                        return ''
-                    
-                    styled_df = df.style.applymap(style_attendance, subset=['status'])
-                    st.dataframe(styled_df, use_container_width=True, hide_index=True)
-                    
-                else:
-                    st.info("No students registered for this branch-year")
-                    
-            else:
-                st.error("Failed to fetch attendance data")
-                
-        except requests.exceptions.RequestException:
-            st.error("Could not connect to server")
+        # Filled in by follow_live_attendance from the API's event feed
+        return session, st.empty(), st.empty(), st.empty()
     
     else:
         st.info("No active session. Please start a session from the Session Management tab.")
 
+def stream_session_events(branch_code, year, heartbeat=2):
+    """Yield (event, data) from the API's live session feed, ("ping", None) on each heartbeat"""
+    url = f"{API_BASE_URL}/api/sessions/{branch_code}/{year}/events"
+    with requests.get(url, params={"heartbeat": heartbeat}, stream=True, timeout=(5, heartbeat * 3)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith(":"):
+                yield "ping", None
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event:
+                yield event, json.loads(line[5:])
+                event = None
+
+def show_session_attendance(metrics_area, table_area, attendance_data):
+    if not attendance_data:
+        table_area.info("No students registered for this branch-year")
+        return
+    
+    df = pd.DataFrame(attendance_data)
+    
+    # Summary metrics
+    total_students = len(df)
+    present_students = len(df[df['status'] == 'Present'])
+    absent_students = total_students - present_students
+    
+    with metrics_area.container():
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total Students", total_students)
+        with col2:
+            st.metric("Present", present_students, delta=f"{(present_students/total_students*100):.1f}%")
+        with col3:
+            st.metric("Absent", absent_students)
+    
+    # Style the dataframe
+    def style_attendance(val):
+        if val == 'Present':
+            return 'background-color: #d4edda; color: #155724'
+        elif val == 'Absent':
+            return 'background-color: #f8d7da; color: #721c24'
+        return ''
+    
+    with table_area.container():
+        # Attendance table
+        st.markdown("#### 📋 Real-time Attendance")
+        styled_df = df.style.applymap(style_attendance, subset=['status'])
+        st.dataframe(styled_df, use_container_width=True, hide_index=True)
+
+def follow_live_attendance(session, metrics_area, table_area, status_area):
+    """Apply the session's live events to the attendance table instead of re-fetching it"""
+    attendance = {}
+    dirty = False
+    last_draw = 0.0
+    
+    try:
+        for event, data in stream_session_events(session["branch_code"], session["year"]):
+            if event == "snapshot":
+                active = data["session"]
+                if not active or active["session_id"] != session["session_id"]:
+                    st.session_state.current_session = None
+                    status_area.info("🔒 This session is no longer active")
+                    return
+                attendance = {row["roll_no"]: row for row in data["attendance"]}
+                dirty = True
+            elif event == "mark" and data["session_id"] == session["session_id"]:
+                attendance[data["roll_no"]] = {"roll_no": data["roll_no"], "name": data["name"], "status": data["status"]}
+                dirty = True
+            elif event == "session_closed" and data["session_id"] == session["session_id"]:
+                st.session_state.current_session = None
+                show_session_attendance(metrics_area, table_area, list(attendance.values()))
+                status_area.info(f"🔒 Session closed, {data['absent_marked']} students marked absent")
+                return
+            elif event == "ping":
+                status_area.caption(f"🟢 Live, last checked {datetime.now().strftime('%H:%M:%S')}")
+            
+            # Bursts of marks are redrawn at most twice a second, the heartbeat flushes the rest
+            if dirty and (event == "ping" or time.monotonic() - last_draw >= 0.5):
+                show_session_attendance(metrics_area, table_area, list(attendance.values()))
+                dirty = False
+                last_draw = time.monotonic()
+    
+    except requests.exceptions.RequestException:
+        status_area.error("Could not connect to server, reconnecting...")
+        time.sleep(5)
+        st.rerun()
+
+def period_params(period):
+    """Query parameters limiting a request to the selected reporting window"""
+    days = PERIODS.get(period)
+    if days is None:
+        return {}
+    return {"date_from": (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")}
+
 def show_statistics():
     st.markdown("### 📊 Attendance Statistics")
     
@@ -255,7 +316,7 @@ def show_statistics():
         st.warning("No branches available")
         return
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         branch_options = [f"{b['branch_code']} - {b['branch_name']}" for b in branches]
         selected_branch = st.selectbox("Select Branch", branch_options, key="stats_branch")
@@ -264,9 +325,13 @@ def show_statistics():
     with col2:
         year = st.selectbox("Select Year", ["2022", "2023", "2024", "2025"], index=2, key="stats_year")
     
+    with col3:
+        period = st.selectbox("Period", list(PERIODS), index=2, key="stats_period")
+    
     if branch_code:
         try:
-            response = requests.get(f"{API_BASE_URL}/api/stats/{branch_code}/{year}")
+            # Counted server-side over the selected window only
+            response = requests.get(f"{API_BASE_URL}/api/stats/{branch_code}/{year}", params=period_params(period))
             
             if response.status_code == 200:
                 stats_data = response.json()
@@ -346,7 +411,7 @@ def show_attendance_records():
         st.warning("No branches available")
         return
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         branch_options = [f"{b['branch_code']} - {b['branch_name']}" for b in branches]
         selected_branch = st.selectbox("Select Branch", branch_options, key="records_branch")
@@ -355,12 +420,33 @@ def show_attendance_records():
     with col2:
         year = st.selectbox("Select Year", ["2022", "2023", "2024", "2025"], index=2, key="records_year")
     
+    with col3:
+        period = st.selectbox("Period", list(PERIODS), index=1, key="records_period")
+    
+    roll_filter = st.text_input("Filter by roll number (comma-separated, optional)", key="records_roll")
+    
     if branch_code:
+        url = f"{API_BASE_URL}/api/attendance/{branch_code}/{year}"
+        params = period_params(period)
+        if roll_filter.strip():
+            params["roll_no"] = roll_filter.strip()
+        
+        # Cursors of the pages visited so far, starting over whenever a filter changes
+        filters = (branch_code, year, period, roll_filter)
+        if st.session_state.get("records_filters") != filters:
+            st.session_state.records_filters = filters
+            st.session_state.records_cursors = [None]
+        cursors = st.session_state.records_cursors
+        
         try:
-            response = requests.get(f"{API_BASE_URL}/api/attendance/{branch_code}/{year}")
+            page_params = {**params, "limit": RECORDS_PAGE_SIZE}
+            if cursors[-1]:
+                page_params["cursor"] = cursors[-1]
+            response = requests.get(url, params=page_params)
             
             if response.status_code == 200:
                 attendance_data = response.json()
+                next_cursor = response.headers.get("X-Next-Cursor")
                 
                 if attendance_data:
                     df = pd.DataFrame(attendance_data)
@@ -371,14 +457,31 @@ def show_attendance_records():
                     # Display attendance table
                     st.dataframe(df, use_container_width=True, hide_index=True)
                     
-                    # Download attendance data
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="📥 Download Attendance Data (CSV)",
-                        data=csv,
-                        file_name=f"attendance_{branch_code}_{year}_{datetime.now().strftime('%Y%m%d')}.csv",
-                        mime="text/csv"
-                    )
+                    # Page navigation
+                    col1, col2, col3 = st.columns([1, 2, 1])
+                    with col1:
+                        if len(cursors) > 1 and st.button("⬅️ Previous", key="records_prev"):
+                            cursors.pop()
+                            st.rerun()
+                    with col2:
+                        st.caption(f"Page {len(cursors)}, {RECORDS_PAGE_SIZE} students per page")
+                    with col3:
+                        if next_cursor and st.button("Next ➡️", key="records_next"):
+                            cursors.append(next_cursor)
+                            st.rerun()
+                    
+                    # Download attendance data: the whole filtered table, streamed as CSV by the API
+                    if st.button("📦 Prepare CSV Download", key="records_csv"):
+                        csv_response = requests.get(url, params={**params, "format": "csv"})
+                        if csv_response.status_code == 200:
+                            st.download_button(
+                                label="📥 Download Attendance Data (CSV)",
+                                data=csv_response.content,
+                                file_name=f"attendance_{branch_code}_{year}_{datetime.now().strftime('%Y%m%d')}.csv",
+                                mime="text/csv"
+                            )
+                        else:
+                            st.error("Failed to export attendance records")
                     
                 else:
                     st.info("No attendance records available for this branch-year")